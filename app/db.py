@@ -0,0 +1,335 @@
+"""Thread-safe DuckDB access for the Flask app.
+
+One base database holds the scooter_data view; every request thread gets its
+own cursor (a DuckDB connection sharing that database), so a threaded server
+can run queries concurrently. Running queries are registered under an id and
+can be cancelled with cursor.interrupt(), explicitly or after a timeout.
+
+Viewport queries run on a bounded executor and stream their result as Arrow
+record batches. A new request from a client supersedes that client's previous
+one: its queued queries are dropped before they start and a running one is
+interrupted. Queue depth and latency histograms are kept in QueryMetrics.
+"""
+import bisect
+import glob
+import hashlib
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import duckdb
+import pyarrow as pa
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is open
+LATENCY_BUCKETS_S = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Concurrent DuckDB queries run by the executor (each also uses DuckDB's own threads)
+MAX_WORKERS = 4
+STREAM_BATCH_ROWS = 2048
+# Record batches buffered between the executor and a slow streaming consumer
+STREAM_QUEUE_BATCHES = 8
+
+
+def dataset_fingerprint(data_dir, files=None):
+    """Hash of the Parquet files (relative path, size, mtime) under data_dir.
+
+    Identifies the exact file set a catalog was built from, so a catalog
+    whose fixed file list no longer matches the dataset can be detected.
+    """
+    if files is None:
+        files = glob.glob(os.path.join(data_dir, '**', '*.parquet'), recursive=True)
+    h = hashlib.sha1()
+    for path in sorted(os.path.relpath(f, data_dir).replace("\\", "/") for f in files):
+        st = os.stat(os.path.join(data_dir, path))
+        h.update(f"{path}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+class QueryCancelled(Exception):
+    """Raised when a query was interrupted (cancelled or timed out)."""
+
+
+class QueryMetrics:
+    """Queue depth, outcome counters and latency histograms of executor queries."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_S):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.counters = {"completed": 0, "cancelled": 0, "superseded": 0, "failed": 0}
+        self.wait = [0] * (len(self.buckets) + 1)
+        self.latency = [0] * (len(self.buckets) + 1)
+
+    def _observe(self, histogram, seconds):
+        histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def enqueued(self):
+        with self._lock:
+            self.queued += 1
+
+    def started(self, wait_s):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self._observe(self.wait, wait_s)
+
+    def dropped(self, wait_s):
+        """A queued query that was superseded before it started."""
+        with self._lock:
+            self.queued -= 1
+            self.counters["superseded"] += 1
+            self._observe(self.wait, wait_s)
+
+    def finished(self, outcome, latency_s):
+        with self._lock:
+            self.running -= 1
+            self.counters[outcome] += 1
+            self._observe(self.latency, latency_s)
+
+    def snapshot(self):
+        """Current state; histograms are lists of {le, count} with per-bucket (not cumulative) counts."""
+        bounds = list(self.buckets) + [None]
+        with self._lock:
+            return {
+                "queue_depth": self.queued,
+                "running": self.running,
+                **self.counters,
+                "wait_seconds": [{"le": b, "count": n} for b, n in zip(bounds, self.wait)],
+                "latency_seconds": [{"le": b, "count": n} for b, n in zip(bounds, self.latency)],
+            }
+
+
+class ConnectionManager:
+    """Base DuckDB database with per-thread cursors and query cancellation.
+
+    Args:
+        data_dir: Hive-partitioned dataset root.
+        database: DuckDB database file, or ':memory:'.
+        threads: DuckDB worker threads (None keeps DuckDB's default).
+        memory_limit: DuckDB memory limit, e.g. '8GB' (None keeps the default).
+        read_only: Open a database file read-only.
+        max_workers: Size of the executor used by submit() and stream().
+    """
+
+    def __init__(self, data_dir, database=':memory:', threads=None, memory_limit=None, read_only=False,
+                 max_workers=MAX_WORKERS):
+        self.data_dir = data_dir
+        config = {}
+        if threads:
+            config['threads'] = int(threads)
+        if memory_limit:
+            config['memory_limit'] = memory_limit
+        self.base = duckdb.connect(database=database, read_only=read_only, config=config)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._running = {}
+        self._ids = itertools.count(1)
+        self._latest = {}  # client id -> id of its newest query
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='duckdb')
+        self.metrics = QueryMetrics()
+
+    def create_view(self):
+        """(Re)create the scooter_data view over the Hive dataset."""
+        data_path = os.path.join(self.data_dir, "**", "*.parquet").replace("\\", "/")
+        query = f"CREATE OR REPLACE VIEW scooter_data AS SELECT * FROM read_parquet('{data_path}', hive_partitioning=1);"
+        print(f"Creating view with query: {query}")
+        self.base.execute(query)
+
+    def columns(self, table='scooter_data'):
+        """Column names of a table or view."""
+        return [d[0] for d in self.base.execute(f"SELECT * FROM {table} LIMIT 0").description]
+
+    def cursor(self):
+        """This thread's cursor on the base database."""
+        cur = getattr(self._local, 'cursor', None)
+        if cur is None:
+            with self._lock:
+                cur = self.base.cursor()
+            self._local.cursor = cur
+        return cur
+
+    def execute(self, sql, params=None, fetch='arrow', timeout=None, query_id=None, client_id=None):
+        """Run a query on this thread's cursor and fetch its result.
+
+        Args:
+            sql: Query text.
+            params: Optional prepared statement parameters.
+            fetch: 'arrow' (pyarrow Table), 'df', 'all' or 'one'.
+            timeout: Seconds after which the query is interrupted.
+            query_id: Id under which the query can be cancelled; one is
+                generated if omitted.
+            client_id: Client that issued the query (see submit()).
+
+        Raises:
+            QueryCancelled: If the query was cancelled, superseded or timed out.
+        """
+        cur = self.cursor()
+        query_id = query_id or f"q{next(self._ids)}"
+        with self._lock:
+            if self._superseded(query_id, client_id):
+                raise QueryCancelled(f"Query {query_id} was superseded")
+            self._running[query_id] = cur
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, cur.interrupt)
+            timer.daemon = True
+            timer.start()
+        try:
+            result = cur.execute(sql, params) if params is not None else cur.execute(sql)
+            if fetch == 'reader':
+                return result.fetch_record_batch(STREAM_BATCH_ROWS)
+            if fetch == 'arrow':
+                return result.fetch_arrow_table()
+            if fetch == 'df':
+                return result.fetchdf()
+            if fetch == 'one':
+                return result.fetchone()
+            return result.fetchall()
+        except duckdb.InterruptException as e:
+            raise QueryCancelled(f"Query {query_id} was cancelled") from e
+        finally:
+            if timer:
+                timer.cancel()
+            with self._lock:
+                if self._running.get(query_id) is cur:
+                    del self._running[query_id]
+
+    def _superseded(self, query_id, client_id):
+        """Whether the client has moved on to a newer query. Caller holds the lock."""
+        return client_id is not None and self._latest.get(client_id) != query_id
+
+    def _is_superseded(self, query_id, client_id):
+        with self._lock:
+            return self._superseded(query_id, client_id)
+
+    def claim(self, client_id, query_id=None):
+        """Start a new request for client_id, superseding its previous one.
+
+        The previous query is interrupted if running; queries still queued
+        under it are dropped when they reach a worker.
+
+        Returns:
+            The id to pass (with client_id) to stream() and release().
+        """
+        query_id = query_id or f"q{next(self._ids)}"
+        if client_id is None:
+            return query_id
+        with self._lock:
+            previous = self._latest.get(client_id)
+            self._latest[client_id] = query_id
+        if previous is not None and previous != query_id:
+            self.cancel(previous)
+        return query_id
+
+    def release(self, client_id, query_id):
+        """Forget a finished request (no-op if the client has a newer one)."""
+        with self._lock:
+            if client_id is not None and self._latest.get(client_id) == query_id:
+                del self._latest[client_id]
+
+    def _run(self, fn, query_id, client_id, submitted):
+        """Executor body: drop superseded queries and record metrics around fn()."""
+        waited = time.perf_counter() - submitted
+        if self._is_superseded(query_id, client_id):
+            self.metrics.dropped(waited)
+            raise QueryCancelled(f"Query {query_id} was superseded")
+        self.metrics.started(waited)
+        start = time.perf_counter()
+        outcome = "failed"
+        try:
+            result = fn()
+            outcome = "completed"
+            return result
+        except QueryCancelled:
+            outcome = "superseded" if self._is_superseded(query_id, client_id) else "cancelled"
+            raise
+        finally:
+            self.metrics.finished(outcome, time.perf_counter() - start)
+
+    def stream(self, sql, params=None, timeout=None, query_id=None, client_id=None):
+        """Run a query on the bounded executor, yielding Arrow record batches as they arrive.
+
+        Batches are handed over through a small bounded queue. Closing the
+        generator early (e.g. the HTTP client went away) interrupts the
+        query. With a client_id, query_id must come from claim(); the query
+        stops as soon as the client claims a newer one. At least one
+        (possibly empty) batch is yielded, so the schema is always known.
+
+        Raises:
+            QueryCancelled: If the query was cancelled, superseded or timed out.
+        """
+        query_id = query_id or f"q{next(self._ids)}"
+        batches = queue.Queue(maxsize=STREAM_QUEUE_BATCHES)
+        closed = threading.Event()
+        done = object()
+
+        def put(item):
+            # Blocks while the consumer is behind, gives up once it is gone
+            while not closed.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def produce():
+            cur = self.cursor()
+            timer = None
+            if timeout:
+                timer = threading.Timer(timeout, cur.interrupt)
+                timer.daemon = True
+                timer.start()
+            try:
+                reader = self.execute(sql, params, 'reader', None, query_id, client_id)
+                # Batches are computed while reading, so keep the query cancellable until the end
+                with self._lock:
+                    self._running[query_id] = cur
+                empty = True
+                for batch in reader:
+                    if closed.is_set() or self._is_superseded(query_id, client_id):
+                        raise QueryCancelled(f"Query {query_id} was cancelled")
+                    put(batch)
+                    empty = False
+                if empty:
+                    put(pa.RecordBatch.from_pylist([], schema=reader.schema))
+            except duckdb.InterruptException as e:
+                raise QueryCancelled(f"Query {query_id} was cancelled") from e
+            finally:
+                if timer:
+                    timer.cancel()
+                with self._lock:
+                    if self._running.get(query_id) is cur:
+                        del self._running[query_id]
+
+        self.metrics.enqueued()
+        future = self.executor.submit(self._run, produce, query_id, client_id, time.perf_counter())
+        future.add_done_callback(lambda f: put(f.exception() or done))
+        try:
+            while True:
+                item = batches.get()
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            closed.set()
+            if not future.done():
+                self.cancel(query_id)
+
+    def cancel(self, query_id):
+        """Interrupt a running query; returns False if it is not running."""
+        with self._lock:
+            cur = self._running.get(query_id)
+        if cur is None:
+            return False
+        cur.interrupt()
+        return True
+
+    def running(self):
+        with self._lock:
+            return list(self._running)
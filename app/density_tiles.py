@@ -0,0 +1,159 @@
+"""Raster trip density pyramid for low zoom levels.
+
+scripts/build_density_pyramid.py counts GPS vertices per 256 px Web Mercator
+tile pixel at DENSITY_MAX_ZOOM and sums 2x2 pixel blocks for each lower zoom
+down to DENSITY_MIN_ZOOM. Counts are kept sparse, as (key, count) pairs with
+key = py << KEY_BITS | px in global pixel coordinates, so only occupied pixels
+cost memory.
+
+Each (month, mode) layer is stored as 16-bit grayscale PNG tiles (counts
+saturate at 65535) under DENSITY_DIR/<dataset version>/<month>/<mode>/z/x/y.png;
+month and mode 'all' hold the sums. manifest.json records the months, modes
+and the largest count per zoom of every layer, which fixes the color scale so
+neighbouring tiles match. The app colors tiles on request (render_tile).
+"""
+import json
+import math
+import os
+import struct
+import zlib
+
+import numpy as np
+
+DENSITY_MIN_ZOOM = 5
+DENSITY_MAX_ZOOM = 12
+TILE_SIZE = 256
+ALL = 'all'
+MANIFEST_FILE = 'manifest.json'
+# Global pixel coordinates at DENSITY_MAX_ZOOM fit in KEY_BITS bits
+KEY_BITS = DENSITY_MAX_ZOOM + 8
+MAX_COUNT = np.iinfo(np.uint16).max
+
+# Color ramp (count fraction on a log scale -> RGB), dark purple to yellow
+RAMP_STOPS = np.array([0.0, 0.25, 0.5, 0.75, 1.0])
+RAMP_COLORS = np.array([
+    [40, 11, 84],
+    [101, 21, 110],
+    [188, 55, 84],
+    [249, 142, 9],
+    [252, 255, 164],
+], dtype=np.float64)
+
+
+def pixel_keys(lon, lat, zoom=DENSITY_MAX_ZOOM):
+    """Sparse pixel keys of lon/lat arrays (points outside the Mercator range are dropped)."""
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    keep = np.isfinite(lon) & np.isfinite(lat) & (np.abs(lat) < 85.0511)
+    lon, lat = lon[keep], lat[keep]
+    scale = TILE_SIZE * 2 ** zoom
+    lat_rad = np.radians(lat)
+    px = np.floor((lon + 180.0) / 360.0 * scale).astype(np.int64)
+    py = np.floor((1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / math.pi) / 2.0 * scale).astype(np.int64)
+    px = np.clip(px, 0, scale - 1)
+    py = np.clip(py, 0, scale - 1)
+    return (py << KEY_BITS) | px
+
+
+def count_keys(keys, counts=None):
+    """Sum counts per distinct key; returns sorted (keys, counts)."""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    summed = np.bincount(inverse, weights=counts, minlength=len(unique))
+    return unique, summed.astype(np.int64)
+
+
+def merge_counts(parts):
+    """Merge several sparse (keys, counts) pairs."""
+    parts = [p for p in parts if len(p[0])]
+    if not parts:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    if len(parts) == 1:
+        return parts[0]
+    return count_keys(np.concatenate([k for k, _ in parts]), np.concatenate([c for _, c in parts]))
+
+
+def downsample(keys, counts):
+    """Counts one zoom level lower: 2x2 pixel blocks summed."""
+    mask = (1 << KEY_BITS) - 1
+    px, py = keys & mask, keys >> KEY_BITS
+    return count_keys(((py >> 1) << KEY_BITS) | (px >> 1), counts)
+
+
+def split_tiles(keys, counts):
+    """Yield (x, y, uint16[TILE_SIZE, TILE_SIZE]) for every tile with data."""
+    mask = (1 << KEY_BITS) - 1
+    px, py = keys & mask, keys >> KEY_BITS
+    tile = ((py // TILE_SIZE) << KEY_BITS) | (px // TILE_SIZE)
+    order = np.argsort(tile, kind='stable')
+    tile, px, py, counts = tile[order], px[order], py[order], counts[order]
+    bounds = np.flatnonzero(np.r_[True, tile[1:] != tile[:-1], True])
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        raster = np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.uint16)
+        raster[py[a:b] % TILE_SIZE, px[a:b] % TILE_SIZE] = np.minimum(counts[a:b], MAX_COUNT)
+        yield int(px[a] // TILE_SIZE), int(py[a] // TILE_SIZE), raster
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+def encode_png(pixels):
+    """PNG bytes of a uint16 (H, W) grayscale or uint8 (H, W, 4) RGBA array (filter type 0 rows)."""
+    if pixels.dtype == np.uint16:
+        height, width = pixels.shape
+        bit_depth, color_type = 16, 0
+        rows = pixels.astype('>u2').view(np.uint8).reshape(height, -1)
+    else:
+        height, width, _ = pixels.shape
+        bit_depth, color_type = 8, 6
+        rows = pixels.reshape(height, -1)
+    raw = np.hstack([np.zeros((height, 1), np.uint8), rows]).tobytes()
+    header = struct.pack('>IIBBBBB', width, height, bit_depth, color_type, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', header)
+            + _png_chunk(b'IDAT', zlib.compress(raw, 6)) + _png_chunk(b'IEND', b''))
+
+
+def decode_png16(data):
+    """Counts of a tile written by encode_png (16-bit grayscale, unfiltered rows only)."""
+    width, height, bit_depth, color_type = struct.unpack_from('>IIBB', data, 16)
+    if bit_depth != 16 or color_type != 0:
+        raise ValueError("not a 16-bit grayscale density tile")
+    pos, idat = 8, []
+    while pos < len(data):
+        (length,) = struct.unpack_from('>I', data, pos)
+        kind = data[pos + 4:pos + 8]
+        if kind == b'IDAT':
+            idat.append(data[pos + 8:pos + 8 + length])
+        pos += 12 + length
+    rows = np.frombuffer(zlib.decompress(b''.join(idat)), np.uint8).reshape(height, 1 + 2 * width)
+    if rows[:, 0].any():
+        raise ValueError("filtered PNG rows are not supported")
+    return rows[:, 1:].copy().view('>u2').astype(np.uint16)
+
+
+def layer_dir(root, version, month=ALL, mode=ALL):
+    return os.path.join(root, version, month, mode)
+
+
+def tile_path(root, version, month, mode, z, x, y):
+    return os.path.join(layer_dir(root, version, month, mode), str(z), str(x), f"{y}.png")
+
+
+def load_manifest(root, version):
+    """Manifest of a built pyramid, or None."""
+    try:
+        with open(os.path.join(root, version, MANIFEST_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def render_tile(counts, max_count):
+    """RGBA PNG of a count tile, log-scaled against the layer's largest count at this zoom."""
+    scale = math.log1p(max(int(max_count), 1))
+    level = np.log1p(counts.astype(np.float64)) / scale
+    rgba = np.zeros(counts.shape + (4,), dtype=np.uint8)
+    for channel in range(3):
+        rgba[..., channel] = np.interp(level, RAMP_STOPS, RAMP_COLORS[:, channel]).astype(np.uint8)
+    rgba[..., 3] = np.where(counts > 0, 96 + 159 * np.minimum(level, 1.0), 0).astype(np.uint8)
+    return encode_png(rgba)
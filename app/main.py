@@ -1,43 +1,161 @@
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, jsonify, request, render_template, Response, stream_with_context
 import duckdb
 import os
 import glob
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+
+import density_tiles
+import partition_stats
+import tiles
+import trips_window
+from db import ConnectionManager, QueryCancelled, dataset_fingerprint
+from query_cache import QueryCache, snap_bbox, snap_time
 
 app = Flask(__name__)
 
 # Configuration
 # Pointing to the new Hive-partitioned directory
 DATA_DIR = 'D:/SwingData/data_hive'
-DB_CONNECTION = None
+# Hex cube + cached boundaries built by src/hex_cube.py
+SPATIAL_DIR = 'C:/Users/chois/Gitsrcs/Swingdata/data_parquet/spatial'
+# Rendered trajectory tiles, one subdirectory per dataset version
+TILE_CACHE_DIR = 'D:/SwingData/tile_cache'
+# Raster density pyramid built by scripts/build_density_pyramid.py
+DENSITY_DIR = 'D:/SwingData/density_tiles'
+# Persistent catalog built by scripts/build_catalog.py (file list, summary tables, views)
+CATALOG_FILE = 'D:/SwingData/catalog.duckdb'
+USE_CATALOG = False
+# DuckDB settings for the shared database (None keeps DuckDB's defaults)
+DB_THREADS = None
+DB_MEMORY_LIMIT = None
+# Concurrent /api/sample queries; further requests wait in the executor queue
+DB_MAX_WORKERS = 4
+# Queries running longer than this are interrupted
+QUERY_TIMEOUT_S = 120
+DB = None
+DB_LOCK = threading.Lock()
+# Per-partition stats from scripts/generate_metadata.py, reloaded when the file changes
+PARTITIONS = None
+PARTITIONS_MTIME = None
+MAX_UTC_OFFSET_S = 14 * 3600
+# Whether the dataset has per-vertex simplification levels (scripts/simplify_paths.py)
+PATH_ZOOM = False
+# Whether files carry the per-trip sample_key (scripts/reorganize_data.py) for unbiased sampling
+SAMPLE_KEY = False
+# Stratification options for /api/sample (equal allocation across strata)
+SAMPLE_STRATA = {'month': 'year, month', 'grid': 'grid_lat, grid_lon'}
+# Sample fraction headroom over limit / estimated rows, and growth factor when it fell short
+SAMPLE_OVERSAMPLE = 1.5
+SAMPLE_GROWTH = 4
+# /api/sample result cache: in-memory LRU, spilling to Arrow files (set to None to disable spill)
+QUERY_CACHE_SPILL_DIR = 'D:/SwingData/query_cache'
+QUERY_CACHE = QueryCache(spill_dir=QUERY_CACHE_SPILL_DIR)
 
-def get_db_connection():
-    """Establishes or returns a DuckDB connection to the Parquet files."""
-    global DB_CONNECTION
-    if DB_CONNECTION is None:
-        # Check if we have any files first (recursive check)
-        # In Hive structure: year=*/month=*/day=*/*.parquet
-        if not os.path.exists(DATA_DIR):
-             print("Data directory not found:", DATA_DIR)
-             return None
-             
-        # Connect to in-memory DuckDB
-        DB_CONNECTION = duckdb.connect(database=':memory:')
-        
-        # Create a view using Hive Partitioning
-        # We point to the root directory and enable hive_partitioning
-        # Note: glob pattern should match the files, typically **/*.parquet
-        data_path = os.path.join(DATA_DIR, "**", "*.parquet").replace("\\", "/")
-        
-        # DuckDB auto-infers partitions from directory structure if hive_partitioning=1
-        query = f"CREATE OR REPLACE VIEW scooter_data AS SELECT * FROM read_parquet('{data_path}', hive_partitioning=1);"
-        print(f"Creating view with query: {query}")
+def catalog_is_current():
+    """Whether the catalog exists and was built from the dataset's current files."""
+    if not os.path.exists(CATALOG_FILE):
+        return False
+    try:
+        con = duckdb.connect(database=CATALOG_FILE, read_only=True)
         try:
-            DB_CONNECTION.execute(query)
-        except Exception as e:
-            print(f"Failed to create view: {e}")
+            built = con.execute("SELECT dataset_fingerprint FROM catalog_info").fetchone()[0]
+        finally:
+            con.close()
+    except Exception as e:
+        print(f"Catalog unreadable ({e}); using the Hive view")
+        return False
+    if built != dataset_fingerprint(DATA_DIR):
+        print("Catalog is stale (dataset files changed); using the Hive view. "
+              "Rebuild it with scripts/build_catalog.py")
+        return False
+    return True
+
+def get_db():
+    """Returns the shared connection manager, creating it (and the scooter_data view) once.
+
+    Opens the persistent catalog read-only when it exists and matches the
+    dataset's current files; otherwise builds an in-memory view over the
+    Hive directory.
+    """
+    global DB, USE_CATALOG
+    if DB is not None:
+        return DB
+    with DB_LOCK:
+        if DB is None and catalog_is_current():
+            print(f"Opening catalog: {CATALOG_FILE}")
+            manager = ConnectionManager(DATA_DIR, database=CATALOG_FILE, read_only=True,
+                                        threads=DB_THREADS, memory_limit=DB_MEMORY_LIMIT, max_workers=DB_MAX_WORKERS)
+            detect_columns(manager)
+            USE_CATALOG = True
+            DB = manager
+        if DB is None:
+            # Check if we have any files first (recursive check)
+            # In Hive structure: year=*/month=*/grid_lat=*/grid_lon=*/*.parquet
+            if not os.path.exists(DATA_DIR):
+                print("Data directory not found:", DATA_DIR)
+                return None
+
+            manager = ConnectionManager(DATA_DIR, threads=DB_THREADS, memory_limit=DB_MEMORY_LIMIT,
+                                        max_workers=DB_MAX_WORKERS)
+            try:
+                manager.create_view()
+            except Exception as e:
+                print(f"Failed to create view: {e}")
+                return None
+            detect_columns(manager)
+            DB = manager
+    return DB
+
+def detect_columns(db):
+    """Record which optional preprocessing columns the dataset has."""
+    global PATH_ZOOM, SAMPLE_KEY
+    columns = db.columns()
+    PATH_ZOOM = 'path_zoom' in columns
+    SAMPLE_KEY = 'sample_key' in columns
+
+def get_partitions():
+    """Partition entries (see partition_stats.py), or None if they were not generated."""
+    global PARTITIONS, PARTITIONS_MTIME
+    path = os.path.join(DATA_DIR, partition_stats.PARTITION_STATS_FILE)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if mtime != PARTITIONS_MTIME:
+        PARTITIONS = partition_stats.load(DATA_DIR)
+        PARTITIONS_MTIME = mtime
+    return PARTITIONS
+
+def no_partitions_match(start=None, end=None, bbox=None):
+    """True when partition stats exist and no non-empty partition can hold matching trips."""
+    partitions = get_partitions()
+    if partitions is None:
+        return False
+    return not partition_stats.overlapping(partitions, start, end, bbox)
+
+def time_bounds(start_str=None, end_str=None):
+    """Epoch-second bounds (or None) of a request's time window, for partition pruning.
+
+    Naive timestamps are compared by DuckDB in the session time zone, so they
+    are widened by the largest UTC offset instead of guessing the zone.
+    """
+    def epoch(value, slack):
+        if not value:
             return None
-        
-    return DB_CONNECTION
+        ts = datetime.fromisoformat(value)
+        if ts.tzinfo is None:
+            return ts.replace(tzinfo=timezone.utc).timestamp() + slack
+        return ts.timestamp()
+    return epoch(start_str, -MAX_UTC_OFFSET_S), epoch(end_str, MAX_UTC_OFFSET_S)
+
+def get_db_connection():
+    """Returns this thread's DuckDB cursor on the shared database."""
+    db = get_db()
+    return db.cursor() if db else None
 
 @app.route('/')
 def index():
@@ -45,7 +163,8 @@ def index():
 
 @app.route('/api/stats')
 def stats():
-    # Optimization: Read from metadata.json if available
+    """Dataset totals: merged partition stats (metadata.json), else the catalog, else a scan."""
+    # Fastest: metadata.json, merged from per-partition stats by scripts/generate_metadata.py
     metadata_file = os.path.join(DATA_DIR, 'metadata.json')
     if os.path.exists(metadata_file):
         try:
@@ -54,18 +173,32 @@ def stats():
                 return jsonify(json.load(f))
         except Exception as e:
             print(f"Error reading metadata: {e}")
+
+    # The catalog's summary view (sums over per-file footer stats)
+    db = get_db()
+    if db and USE_CATALOG:
+        try:
+            total, start, end, num_files = db.execute("SELECT * FROM summary", fetch='one')
+            return jsonify({
+                "total_records": int(total or 0),
+                "start_date": start.isoformat() if start else None,
+                "end_date": end.isoformat() if end else None,
+                "num_files": num_files,
+            })
+        except Exception as e:
+            print(f"Error reading catalog summary: {e}")
             
-    con = get_db_connection()
-    if not con:
+    if not db:
         return jsonify({"error": "No data available yet"}), 503
         
     try:
         # Simple count query
-        res_count = con.execute("SELECT count(*) FROM scooter_data").fetchone()
+        res_count = db.execute("SELECT count(*) FROM scooter_data", fetch='one', timeout=QUERY_TIMEOUT_S)
         count = res_count[0] if res_count else 0
         
         # Get date range
-        min_max = con.execute("SELECT min(start_timestamp), max(end_timestamp) FROM scooter_data").fetchone()
+        min_max = db.execute("SELECT min(start_timestamp), max(end_timestamp) FROM scooter_data",
+                             fetch='one', timeout=QUERY_TIMEOUT_S)
         
         start_date = None
         end_date = None
@@ -88,75 +221,451 @@ def stats():
 
 @app.route('/api/sample')
 def sample():
-    """Return points for visualization, optionally filtered by time and region."""
-    con = get_db_connection()
-    if not con:
+    """Return points for visualization, optionally filtered by time and region.
+
+    The bbox is snapped outward to a tile grid and the time window to hour
+    buckets, so nearby viewports are answered from the result cache. An
+    optional `qid` names the query so /api/cancel can interrupt it.
+
+    Queries run on the shared bounded executor. A `client` id makes a new
+    request supersede the same client's previous one (its query is
+    interrupted, or dropped if still queued); the superseded request gets 499.
+    With `stream=1` the response is NDJSON, one JSON array of trips per Arrow
+    batch, sent while the query is still running.
+
+    With sample_key in the data, rows are a reproducible uniform sample (the
+    `limit` trips with the smallest keys), read through a `sample_key < p`
+    prefix sized from the catalog's counts. `stratify=month|grid` balances
+    the sample across months or 0.1 degree grid cells.
+    """
+    db = get_db()
+    if not db:
         return jsonify({"error": "No data available"}), 503
     
     # Get parameters
-    limit = request.args.get('limit', 5000)
-    start_str = request.args.get('start')
-    end_str = request.args.get('end')
+    limit = int(request.args.get('limit', 5000))
+    start_str = snap_time(request.args.get('start'))
+    end_str = snap_time(request.args.get('end'), up=True)
     
     # Bounding box params
     north = request.args.get('north')
     south = request.args.get('south')
     east = request.args.get('east')
     west = request.args.get('west')
+    bbox = None
+    if north and south and east and west:
+        bbox = snap_bbox(float(north), float(south), float(east), float(west))
+    # Map zoom (256 px tiles); with simplification levels only the vertices needed there are returned
+    zoom = request.args.get('zoom')
+    zoom = int(float(zoom)) if zoom is not None and PATH_ZOOM else None
+    stratify = request.args.get('stratify')
+    stratify = stratify if stratify in SAMPLE_STRATA and SAMPLE_KEY else None
+    client_id = request.args.get('client')
+    streaming = request.args.get('stream') == '1'
+
+    # Nothing to query when no partition overlaps the time range and box
+    if no_partitions_match(*time_bounds(start_str, end_str), bbox):
+        db.release(client_id, db.claim(client_id))
+        if streaming:
+            return Response("", mimetype='application/x-ndjson')
+        return jsonify([])
     
+    key = QUERY_CACHE.make_key(
+        tiles.dataset_version(DATA_DIR),
+        limit=limit, start=start_str, end=end_str, bbox=bbox, zoom=zoom, stratify=stratify,
+    )
+    table = QUERY_CACHE.get(key)
+    if table is not None:
+        # Even a cache hit is the client's newest request
+        db.release(client_id, db.claim(client_id))
+        if streaming:
+            return Response(ndjson_batches(table.to_batches()), mimetype='application/x-ndjson')
+        return jsonify(table.to_pylist())
+
+    query_id = db.claim(client_id, request.args.get('qid'))
+    batches = sample_batches(db, limit, start_str, end_str, bbox, zoom, stratify, query_id, client_id)
+    try:
+        # Fail before the response starts if the request is superseded while queued
+        first = next(batches)
+    except QueryCancelled as e:
+        db.release(client_id, query_id)
+        return jsonify({"error": str(e), "cancelled": True}), 499
+    except Exception as e:
+        db.release(client_id, query_id)
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+    def collect():
+        received = [first]
+        try:
+            yield first
+            for batch in batches:
+                received.append(batch)
+                yield batch
+            QUERY_CACHE.put(key, pa.Table.from_batches(received))
+        finally:
+            batches.close()
+            db.release(client_id, query_id)
+
+    if streaming:
+        return Response(stream_with_context(ndjson_batches(collect())), mimetype='application/x-ndjson')
+    try:
+        return jsonify(pa.Table.from_batches(list(collect())).to_pylist())
+    except QueryCancelled as e:
+        return jsonify({"error": str(e), "cancelled": True}), 499
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+def ndjson_batches(batches):
+    """NDJSON body: one JSON array of rows per record batch, then an error line if the query stopped."""
     try:
-        query = "SELECT route_id, start_timestamp, end_timestamp, path FROM scooter_data"
-        conditions = []
+        for batch in batches:
+            if batch.num_rows:
+                yield app.json.dumps(batch.to_pylist()) + "\n"
+    except QueryCancelled as e:
+        yield app.json.dumps({"error": str(e), "cancelled": True}) + "\n"
+    except Exception as e:
+        yield app.json.dumps({"error": str(e)}) + "\n"
+
+def sample_batches(db, limit, start_str, end_str, bbox, zoom, stratify, query_id, client_id):
+    """Record batches of an /api/sample result, streamed from the executor.
+
+    Key-prefix sampling first reads keys in [0, p); if that held fewer than
+    `limit` trips it continues with [p, SAMPLE_GROWTH * p) for the remainder.
+    The key ranges are disjoint and each is read in key order, so the batches
+    concatenate to the `limit` smallest keys.
+    """
+    # Smallest key prefix expected to hold `limit` trips; strata need the full range
+    fraction = None
+    if SAMPLE_KEY and not stratify:
+        estimate = estimate_rows(db, start_str, end_str, bbox)
+        if estimate:
+            fraction = min(1.0, SAMPLE_OVERSAMPLE * limit / estimate)
+    low, remaining = 0.0, limit
+    while True:
+        key_range = (low, fraction) if fraction is not None else None
+        query = sample_query(remaining, start_str, end_str, bbox, zoom, key_range, stratify)
+        for batch in db.stream(query, timeout=QUERY_TIMEOUT_S, query_id=query_id, client_id=client_id):
+            remaining -= batch.num_rows
+            yield batch
+        if fraction is None or fraction >= 1.0 or remaining <= 0:
+            return
+        low, fraction = fraction, min(1.0, fraction * SAMPLE_GROWTH)
+
+def estimate_rows(db, start_str=None, end_str=None, bbox=None):
+    """Upper bound on matching trips from the catalog's daily per-grid counts, else partition stats.
+
+    Returns None when neither is available.
+    """
+    if not USE_CATALOG:
+        partitions = get_partitions()
+        if partitions is None:
+            return None
+        keys = partition_stats.overlapping(partitions, *time_bounds(start_str, end_str), bbox)
+        return sum(partitions[k]['rows'] for k in keys) or None
+    conditions = []
+    if start_str:
+        conditions.append(f"day >= CAST(TIMESTAMP '{start_str}' AS DATE)")
+    if end_str:
+        conditions.append(f"day <= CAST(TIMESTAMP '{end_str}' AS DATE)")
+    if bbox:
+        n, s, e, w = bbox
+        conditions.append(f"grid_lat BETWEEN {int(s * 10)} AND {int(n * 10)}")
+        conditions.append(f"grid_lon BETWEEN {int(w * 10)} AND {int(e * 10)}")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    row = db.execute(f"SELECT sum(trips) FROM daily_counts {where}", fetch='one')
+    return int(row[0]) if row and row[0] else None
+
+def sample_query(limit, start_str=None, end_str=None, bbox=None, zoom=None, key_range=None, stratify=None):
+    """SQL for /api/sample from normalized parameters.
+
+    key_range: optional (low, high) bounds on sample_key, low inclusive.
+    """
+    path_expr = "path"
+    if zoom is not None:
+        path_expr = f"{tiles.path_at_zoom_sql(zoom)} AS path"
+    query = f"SELECT route_id, start_timestamp, end_timestamp, {path_expr} FROM scooter_data"
+    if SAMPLE_KEY:
+        rank = "0"
+        if stratify:
+            rank = f"row_number() OVER (PARTITION BY {SAMPLE_STRATA[stratify]} ORDER BY sample_key)"
+        query = (f"SELECT route_id, start_timestamp, end_timestamp, {path_expr}, "
+                 f"sample_key, {rank} AS stratum_rank FROM scooter_data")
+    conditions = []
+    if key_range is not None:
+        low, high = key_range
+        if low > 0:
+            conditions.append(f"sample_key >= {low}")
+        if high < 1.0:
+            conditions.append(f"sample_key < {high}")
+    
+    if start_str:
+        conditions.append(f"start_timestamp >= '{start_str}'")
+    if end_str:
+        conditions.append(f"end_timestamp <= '{end_str}'")
         
-        if start_str:
-            conditions.append(f"start_timestamp >= '{start_str}'")
-        if end_str:
-            conditions.append(f"end_timestamp <= '{end_str}'")
-            
-        # Region filtering
-        if north and south and east and west:
-            # Cast to float
-            n, s, e, w = float(north), float(south), float(east), float(west)
-            
-            # 1. Exact Spatial Filter (Points must start in bounds)
-            conditions.append(f"path[1][2] BETWEEN {s} AND {n}")
-            conditions.append(f"path[1][3] BETWEEN {w} AND {e}")
-            
-            # 2. Partition Pruning (Optimization)
-            # We filter by the grid columns so DuckDB skips irrelevant folders
-            min_grid_lat = int(s * 10) # FLOOR
-            max_grid_lat = int(n * 10)
-            min_grid_lon = int(w * 10)
-            max_grid_lon = int(e * 10)
-            
-            conditions.append(f"grid_lat BETWEEN {min_grid_lat} AND {max_grid_lat}")
-            conditions.append(f"grid_lon BETWEEN {min_grid_lon} AND {max_grid_lon}")
-            
-        if conditions:
-            query += " WHERE " + " AND ".join(conditions)
-            
-        # Hard cap to prevent browser crash
-        query += f" LIMIT {limit}"
+    # Region filtering
+    if bbox:
+        n, s, e, w = bbox
         
-        print(f"Executing: {query}")
-        df = con.execute(query).fetchdf()
+        # 1. Exact Spatial Filter (Points must start in bounds)
+        conditions.append(f"path[1][2] BETWEEN {s} AND {n}")
+        conditions.append(f"path[1][3] BETWEEN {w} AND {e}")
         
-        import numpy as np
-        def to_list(x):
-            if isinstance(x, np.ndarray):
-                return [to_list(i) for i in x]
-            elif isinstance(x, list):
-                return [to_list(i) for i in x]
-            return x
-            
-        df['path'] = df['path'].apply(to_list)
+        # 2. Partition Pruning (Optimization)
+        # We filter by the grid columns so DuckDB skips irrelevant folders
+        min_grid_lat = int(s * 10) # FLOOR
+        max_grid_lat = int(n * 10)
+        min_grid_lon = int(w * 10)
+        max_grid_lon = int(e * 10)
+        
+        conditions.append(f"grid_lat BETWEEN {min_grid_lat} AND {max_grid_lat}")
+        conditions.append(f"grid_lon BETWEEN {min_grid_lon} AND {max_grid_lon}")
         
-        result = df.to_dict(orient='records')
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+        
+    if SAMPLE_KEY:
+        # Smallest keys first (round-robin across strata): a uniform, reproducible sample
+        query = (f"SELECT route_id, start_timestamp, end_timestamp, path FROM ({query}) "
+                 f"ORDER BY stratum_rank, sample_key")
+
+    # Hard cap to prevent browser crash
+    query += f" LIMIT {limit}"
+    print(f"Executing: {query}")
+    return query
+
+@app.route('/api/trips_window')
+def trips_window_data():
+    """Trips active in [start, start + duration) as packed SWW1 buffers (see trips_window.py).
+
+    Query params: start (epoch seconds or ISO timestamp), duration (seconds),
+    optional north/south/east/west box, zoom and client. Trips come sorted by
+    start time with timestamps relative to the window start, so playback can
+    prefetch the next window while this one plays.
+    """
+    db = get_db()
+    if not db:
+        return jsonify({"error": "No data available"}), 503
+    start = request.args.get('start')
+    if not start:
+        return jsonify({"error": "start is required"}), 400
+    try:
+        start = float(start)
+    except ValueError:
+        start = datetime.fromisoformat(start).timestamp()
+    duration = float(request.args.get('duration', trips_window.DEFAULT_WINDOW_S))
+    duration = min(max(duration, 1.0), trips_window.MAX_WINDOW_S)
+
+    north = request.args.get('north')
+    south = request.args.get('south')
+    east = request.args.get('east')
+    west = request.args.get('west')
+    bbox = None
+    if north and south and east and west:
+        bbox = snap_bbox(float(north), float(south), float(east), float(west))
+    zoom = request.args.get('zoom')
+    zoom = int(float(zoom)) if zoom is not None and PATH_ZOOM else None
+
+    client_id = request.args.get('client')
+    query_id = db.claim(client_id, request.args.get('qid'))
+    try:
+        # to_timestamp() bounds meet naive timestamps in the session time zone,
+        # so pad the partition check by the largest UTC offset (as time_bounds does)
+        if no_partitions_match(start - trips_window.MAX_TRIP_S - MAX_UTC_OFFSET_S,
+                               start + duration + MAX_UTC_OFFSET_S, bbox):
+            empty = pa.table({"route_id": pa.array([], pa.string()),
+                              "path": pa.array([], pa.list_(pa.list_(pa.float64())))})
+            data = trips_window.pack_window(empty, start, start + duration)
+        else:
+            query = trips_window.window_query(start, start + duration, bbox, zoom)
+            batches = list(db.stream(query, timeout=QUERY_TIMEOUT_S, query_id=query_id, client_id=client_id))
+            data = trips_window.pack_window(pa.Table.from_batches(batches), start, start + duration)
+    except QueryCancelled as e:
+        return jsonify({"error": str(e), "cancelled": True}), 499
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        db.release(client_id, query_id)
+
+    response = Response(data, mimetype='application/octet-stream')
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response
+
+@app.route('/api/daily_counts')
+def daily_counts():
+    """Trips per day from the catalog, optionally within a north/south/east/west box."""
+    db = get_db()
+    if not db or not USE_CATALOG:
+        return jsonify({"error": "Catalog not built (run scripts/build_catalog.py)"}), 503
+
+    conditions = []
+    north = request.args.get('north')
+    south = request.args.get('south')
+    east = request.args.get('east')
+    west = request.args.get('west')
+    if north and south and east and west:
+        conditions.append(f"grid_lat BETWEEN {int(float(south) * 10)} AND {int(float(north) * 10)}")
+        conditions.append(f"grid_lon BETWEEN {int(float(west) * 10)} AND {int(float(east) * 10)}")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    rows = db.execute(f"SELECT day, sum(trips) FROM daily_counts {where} GROUP BY day ORDER BY day", fetch='all')
+    return jsonify([{"day": d.isoformat(), "trips": int(n)} for d, n in rows])
+
+@app.route('/api/cancel')
+def cancel():
+    """Interrupt the running query registered under `qid`."""
+    db = get_db()
+    qid = request.args.get('qid')
+    if not db or not qid:
+        return jsonify({"cancelled": False})
+    return jsonify({"cancelled": db.cancel(qid)})
+
+@app.route('/api/metrics')
+def metrics():
+    """Executor queue depth, query outcome counters and wait/latency histograms."""
+    db = get_db()
+    if not db:
+        return jsonify({"error": "No data available"}), 503
+    return jsonify({**db.metrics.snapshot(), "workers": db.max_workers})
+
+@app.route('/api/cache_stats')
+def cache_stats():
+    """Hit/miss/evict counters and sizes of the /api/sample result cache."""
+    return jsonify(QUERY_CACHE.stats())
+
+@app.route('/api/hexes')
+def hexes():
+    """Return per-hex indicators from the precomputed hex cube.
+
+    Query params: res (6-10), endpoint (origin/dest), month (YYYY-MM), mode,
+    min_trips, and an optional north/south/east/west bounding box. Boundaries
+    come from the cached [lon, lat] rings, so no H3 work happens per request.
+    """
+    cube_file = os.path.join(SPATIAL_DIR, 'hex_cube.parquet').replace("\\", "/")
+    boundary_file = os.path.join(SPATIAL_DIR, 'hex_boundaries.parquet').replace("\\", "/")
+    if not os.path.exists(cube_file) or not os.path.exists(boundary_file):
+        return jsonify({"error": "Hex cube not built (run src/hex_cube.py)"}), 503
+
+    try:
+        params = {
+            "cube": cube_file,
+            "boundaries": boundary_file,
+            "res": int(request.args.get('res', 8)),
+            "endpoint": request.args.get('endpoint', 'origin'),
+            "min_trips": int(request.args.get('min_trips', 10)),
+        }
+        conditions = ["c.res = $res", "c.endpoint = $endpoint"]
+        if request.args.get('month'):
+            conditions.append("c.month_year = $month")
+            params["month"] = request.args.get('month')
+        if request.args.get('mode'):
+            conditions.append("c.mode = $mode")
+            params["mode"] = request.args.get('mode')
+
+        north = request.args.get('north')
+        south = request.args.get('south')
+        east = request.args.get('east')
+        west = request.args.get('west')
+        if north and south and east and west:
+            conditions.append("b.hex_lat BETWEEN $south AND $north")
+            conditions.append("b.hex_lon BETWEEN $west AND $east")
+            params.update(north=float(north), south=float(south), east=float(east), west=float(west))
+
+        query = f"""
+            SELECT
+                printf('%x', c.cell) AS hex,
+                SUM(c.trip_count) AS trip_count,
+                SUM(c.speeding_trips) * 100.0 / SUM(c.trip_count) AS speeding_pct,
+                SUM(c.sum_mean_speed) / NULLIF(SUM(c.n_mean_speed), 0) AS mean_speed,
+                any_value(b.hex_lat) AS lat,
+                any_value(b.hex_lon) AS lon,
+                any_value(b.boundary) AS boundary
+            FROM read_parquet($cube) c
+            JOIN read_parquet($boundaries) b USING (cell)
+            WHERE {" AND ".join(conditions)}
+            GROUP BY c.cell
+            HAVING SUM(c.trip_count) >= $min_trips
+        """
+        cursor = duckdb.connect(database=':memory:')
+        rel = cursor.execute(query, params)
+        columns = [d[0] for d in rel.description]
+        result = [dict(zip(columns, row)) for row in rel.fetchall()]
+        cursor.close()
         return jsonify(result)
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/tiles/<int:z>/<int:x>/<int:y>')
+def trajectory_tile(z, x, y):
+    """Clipped, zoom-quantized trajectories of one tile (SWT1 binary, see tiles.py)."""
+    if not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        return jsonify({"error": "Tile out of range"}), 400
+
+    version = tiles.dataset_version(DATA_DIR)
+    path = tiles.tile_cache_path(TILE_CACHE_DIR, version, z, x, y)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            data = f.read()
+    else:
+        con = get_db_connection()
+        if not con:
+            return jsonify({"error": "No data available"}), 503
+        try:
+            data = tiles.get_tile(con, TILE_CACHE_DIR, version, z, x, y, path_zoom=PATH_ZOOM)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return jsonify({"error": str(e)}), 500
+
+    response = Response(data, mimetype='application/octet-stream')
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    response.headers['ETag'] = f'"{version}-{z}-{x}-{y}"'
+    return response
+
+@app.route('/density_tiles/manifest')
+def density_manifest():
+    """Months, modes and zoom range of the density pyramid."""
+    manifest = density_tiles.load_manifest(DENSITY_DIR, tiles.dataset_version(DATA_DIR))
+    if manifest is None:
+        return jsonify({"error": "Density pyramid not built (run scripts/build_density_pyramid.py)"}), 503
+    return jsonify({k: manifest[k] for k in ("min_zoom", "max_zoom", "months", "modes")})
+
+@app.route('/density_tiles/<int:z>/<int:x>/<int:y>')
+def density_tile(z, x, y):
+    """Colored PNG of the vertex density pyramid; query params month (YYYY-MM) and mode, default all."""
+    if not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        return jsonify({"error": "Tile out of range"}), 400
+    version = tiles.dataset_version(DATA_DIR)
+    manifest = density_tiles.load_manifest(DENSITY_DIR, version)
+    if manifest is None:
+        return jsonify({"error": "Density pyramid not built (run scripts/build_density_pyramid.py)"}), 503
+    if not manifest["min_zoom"] <= z <= manifest["max_zoom"]:
+        return jsonify({"error": "Zoom outside the pyramid"}), 404
+
+    month = request.args.get('month') or density_tiles.ALL
+    mode = request.args.get('mode') or density_tiles.ALL
+    max_count = manifest["max_counts"].get(f"{month}/{mode}", {}).get(str(z))
+    if max_count is None:
+        return jsonify({"error": "Unknown month or mode"}), 404
+
+    path = density_tiles.tile_path(DENSITY_DIR, version, month, mode, z, x, y)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            counts = density_tiles.decode_png16(f.read())
+    else:
+        counts = np.zeros((density_tiles.TILE_SIZE, density_tiles.TILE_SIZE), dtype=np.uint16)
+
+    response = Response(density_tiles.render_tile(counts, max_count), mimetype='image/png')
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    response.headers['ETag'] = f'"{version}-{month}-{mode}-{z}-{x}-{y}"'
+    return response
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -0,0 +1,138 @@
+"""Per-partition statistics of the Hive dataset.
+
+scripts/generate_metadata.py keeps, for every year=/month=/grid_lat=/grid_lon=
+directory, its row count, time range, vertex bounding box and a HyperLogLog
+sketch of distinct users, together with the (name, size, mtime) of the files
+they were computed from. Only partitions whose files changed are rescanned;
+global totals are merged from the partition entries. The app uses the same
+entries to skip requests that no partition can answer.
+
+HyperLogLog: 2**HLL_PRECISION one-byte registers over md5_number_lower(user_id),
+so sketches merge across runs (and DuckDB versions) by element-wise max.
+"""
+import base64
+import json
+import math
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+PARTITION_STATS_FILE = 'partition_stats.json'
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+# Bits of the 64-bit hash left after the register index
+HLL_VALUE_BITS = 64 - HLL_PRECISION
+
+
+def hll_register_sql(hash_expr):
+    """SQL (register, rank) expressions of a UBIGINT hash.
+
+    rank is the position of the first set bit in the low HLL_VALUE_BITS
+    bits (HLL_VALUE_BITS + 1 when they are all zero). The highest set bit is
+    found with log2 and corrected by one where floating point rounded it.
+    """
+    mask = (1 << HLL_VALUE_BITS) - 1
+    w = f"({hash_expr} & {mask}::UBIGINT)"
+    b = f"CAST(floor(log2({w})) AS INTEGER)"
+    top = (f"CASE WHEN ({w} >> {b}) = 0 THEN {b} - 1 "
+           f"WHEN ({w} >> ({b} + 1)) > 0 THEN {b} + 1 ELSE {b} END")
+    rank = f"CASE WHEN {w} = 0 THEN {HLL_VALUE_BITS + 1} ELSE {HLL_VALUE_BITS} - ({top}) END"
+    return f"CAST({hash_expr} >> {HLL_VALUE_BITS} AS INTEGER)", rank
+
+
+def hll_from_registers(registers, ranks):
+    """Sketch (uint8 array) from sparse (register, max rank) pairs."""
+    sketch = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    np.maximum.at(sketch, np.asarray(registers, dtype=np.int64), np.asarray(ranks, dtype=np.uint8))
+    return sketch
+
+
+def hll_merge(sketches):
+    """Union of sketches."""
+    merged = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    for sketch in sketches:
+        np.maximum(merged, sketch, out=merged)
+    return merged
+
+
+def hll_estimate(sketch):
+    """Distinct count estimate (with the linear-counting small-range correction)."""
+    m = HLL_REGISTERS
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -sketch.astype(np.int64)))
+    zeros = int(np.count_nonzero(sketch == 0))
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return int(round(estimate))
+
+
+def hll_encode(sketch):
+    return base64.b64encode(sketch.tobytes()).decode('ascii')
+
+
+def hll_decode(text):
+    return np.frombuffer(base64.b64decode(text), dtype=np.uint8)
+
+
+def epoch_iso(seconds):
+    """Naive ISO timestamp of epoch(naive TIMESTAMP) seconds, or None.
+
+    The data's timestamps are wall-clock times without a zone and epoch()
+    reads them as UTC, so the inverse is rendered without an offset, as the
+    timestamps themselves were (the client parses it as local time).
+    """
+    if seconds is None:
+        return None
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None).isoformat()
+
+
+def merge_partitions(partitions):
+    """Global statistics merged from partition entries, without touching the data."""
+    entries = [p for p in partitions.values() if p['rows']]
+    starts = [p['min_start'] for p in entries if p['min_start'] is not None]
+    ends = [p['max_end'] for p in entries if p['max_end'] is not None]
+    boxes = [p['bbox'] for p in entries if p['bbox']]
+    sketches = [hll_decode(p['hll']) for p in entries if p.get('hll')]
+    return {
+        "total_records": sum(p['rows'] for p in entries),
+        "start_date": epoch_iso(min(starts)) if starts else None,
+        "end_date": epoch_iso(max(ends)) if ends else None,
+        "distinct_users": hll_estimate(hll_merge(sketches)) if sketches else None,
+        "bbox": [min(b[0] for b in boxes), min(b[1] for b in boxes),
+                 max(b[2] for b in boxes), max(b[3] for b in boxes)] if boxes else None,
+        "num_partitions": len(entries),
+    }
+
+
+def load(data_dir):
+    """Partition entries keyed by relative directory, or None if not generated."""
+    path = os.path.join(data_dir, PARTITION_STATS_FILE)
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)['partitions']
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def overlapping(partitions, start=None, end=None, bbox=None):
+    """Entries that can hold trips in [start, end] (epoch seconds) starting inside bbox.
+
+    bbox is (north, south, east, west). A trip's start point lies inside its
+    partition's vertex bbox, so partitions outside the box can be skipped.
+    """
+    matches = []
+    for key, p in partitions.items():
+        if not p['rows']:
+            continue
+        if start is not None and p['max_end'] is not None and p['max_end'] < start:
+            continue
+        if end is not None and p['min_start'] is not None and p['min_start'] > end:
+            continue
+        if bbox and p['bbox']:
+            n, s, e, w = bbox
+            west, south, east, north = p['bbox']
+            if west > e or east < w or south > n or north < s:
+                continue
+        matches.append(key)
+    return matches
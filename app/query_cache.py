@@ -0,0 +1,181 @@
+"""Result cache for viewport queries.
+
+Requests are normalized before lookup so that nearby viewports share entries:
+the bounding box is snapped outward to a Web Mercator tile grid (tile size
+chosen from the viewport size) and time windows to fixed buckets. Results are
+kept as Arrow tables in a size-bounded LRU in memory; entries pushed out of
+memory can spill to Arrow IPC files on disk (itself size-bounded, LRU).
+Keys include the dataset version, so regenerating metadata.json starts a
+fresh cache.
+"""
+import hashlib
+import math
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+
+import tiles
+
+CACHE_MAX_BYTES = 512 * 1024 ** 2
+SPILL_MAX_BYTES = 4 * 1024 ** 3
+# Grid tiles per viewport width: the snapped bbox exceeds the viewport by at most ~2/SNAP_TILES
+SNAP_TILES = 4
+TIME_BUCKET = timedelta(hours=1)
+
+
+def snap_bbox(north, south, east, west):
+    """Snap a bbox outward to the tile grid whose tiles are ~1/SNAP_TILES of its width.
+
+    Returns:
+        (north, south, east, west) of the snapped box.
+    """
+    width = max(east - west, 1e-6)
+    z = min(max(int(math.floor(math.log2(360.0 * SNAP_TILES / width))), 0), 22)
+    x0, y0 = tiles.lonlat_to_tile(west, north, z)
+    x1, y1 = tiles.lonlat_to_tile(east, south, z)
+    w, _, _, n = tiles.tile_bounds(z, int(math.floor(x0)), int(math.floor(y0)))
+    _, s, e, _ = tiles.tile_bounds(z, int(math.floor(x1)), int(math.floor(y1)))
+    return round(n, 7), round(s, 7), round(e, 7), round(w, 7)
+
+
+def snap_time(value, up=False):
+    """Floor (or ceil with up=True) a timestamp string to TIME_BUCKET."""
+    if not value:
+        return None
+    ts = datetime.fromisoformat(value)
+    bucket = int(TIME_BUCKET.total_seconds())
+    seconds = (ts - datetime(1970, 1, 1, tzinfo=ts.tzinfo)).total_seconds()
+    edge = math.ceil(seconds / bucket) if up else math.floor(seconds / bucket)
+    return (datetime(1970, 1, 1, tzinfo=ts.tzinfo) + timedelta(seconds=edge * bucket)).isoformat(sep=' ')
+
+
+class QueryCache:
+    """Thread-safe LRU of Arrow tables with optional disk spill."""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, spill_dir=None, spill_max_bytes=SPILL_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self._memory = OrderedDict()  # key -> pa.Table
+        self._disk = OrderedDict()    # key -> file size
+        self._spilling = {}           # key -> pa.Table being written to disk
+        self._bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "spills": 0}
+        # Spill files are only indexed in memory, so leftovers from a previous run are unreachable
+        if spill_dir and os.path.isdir(spill_dir):
+            for name in os.listdir(spill_dir):
+                if name.endswith('.arrow'):
+                    os.remove(os.path.join(spill_dir, name))
+
+    @staticmethod
+    def make_key(version, **params):
+        """Stable key from the dataset version and normalized query parameters."""
+        items = ";".join(f"{k}={params[k]}" for k in sorted(params))
+        return hashlib.sha1(f"{version}|{items}".encode()).hexdigest()
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.arrow")
+
+    def get(self, key):
+        """Cached table for key, or None."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.counters["hits"] += 1
+                return self._memory[key]
+            table = self._spilling.get(key)
+            if table is None and key not in self._disk:
+                self.counters["misses"] += 1
+                return None
+            if table is None:
+                self._disk.move_to_end(key)
+
+        if table is None:
+            try:
+                with pa.memory_map(self._spill_path(key)) as source:
+                    table = pa.ipc.open_file(source).read_all()
+            except OSError:
+                with self._lock:
+                    self._disk_bytes -= self._disk.pop(key, 0)
+                    self.counters["misses"] += 1
+                return None
+
+        with self._lock:
+            self.counters["disk_hits"] += 1
+        self.put(key, table)
+        return table
+
+    def put(self, key, table):
+        """Insert a table, evicting (or spilling) least recently used entries."""
+        spill = []
+        with self._lock:
+            if key in self._memory:
+                self._bytes -= self._memory.pop(key).nbytes
+            self._memory[key] = table
+            self._bytes += table.nbytes
+            while self._bytes > self.max_bytes and len(self._memory) > 1:
+                old_key, old_table = self._memory.popitem(last=False)
+                self._bytes -= old_table.nbytes
+                if not self.spill_dir:
+                    self.counters["evictions"] += 1
+                elif old_key not in self._disk and old_key not in self._spilling:
+                    # Still served from here until its spill file is registered
+                    self._spilling[old_key] = old_table
+                    spill.append((old_key, old_table))
+        # Disk I/O runs without the lock so other requests are not blocked on it
+        if spill:
+            self._spill(spill)
+
+    def _spill(self, entries):
+        """Write entries leaving memory to Arrow IPC files, then register them."""
+        os.makedirs(self.spill_dir, exist_ok=True)
+        written = []
+        for key, table in entries:
+            path = self._spill_path(key)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+                os.replace(tmp, path)
+                written.append((key, os.path.getsize(path)))
+            except OSError:
+                written.append((key, None))
+
+        removed = []
+        with self._lock:
+            for key, size in written:
+                self._spilling.pop(key, None)
+                if size is None:
+                    self.counters["evictions"] += 1
+                    continue
+                self._disk_bytes += size - self._disk.pop(key, 0)
+                self._disk[key] = size
+                self.counters["spills"] += 1
+            while self._disk_bytes > self.spill_max_bytes and self._disk:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self.counters["evictions"] += 1
+                removed.append(old_key)
+        for old_key in removed:
+            try:
+                os.remove(self._spill_path(old_key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": (self.counters["hits"] + self.counters["disk_hits"]) / lookups if lookups else None,
+                "entries": len(self._memory),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
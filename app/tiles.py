@@ -0,0 +1,230 @@
+"""Trajectory tiles for the visualizer.
+
+A tile (z, x, y) holds every trajectory part that crosses it, clipped to the
+tile plus a small buffer and quantized to tile-local integer coordinates, so
+the browser only loads what is visible at the precision the zoom needs.
+
+Binary tile format ("SWT1", little-endian):
+    4s    magic b'SWT1'
+    u32   n_parts
+    u32   n_vertices
+    u32   offsets[n_parts + 1]     vertex offset of each part
+    i16   coords[n_vertices * 2]   x, y in tile units (0..TILE_EXTENT, +-buffer)
+
+Rendered tiles are cached on disk under TILE_CACHE_DIR/<dataset version>/z/x/y.bin,
+where the version comes from metadata.json, so regenerating the metadata
+invalidates every cached tile.
+"""
+import json
+import math
+import os
+import struct
+
+import numpy as np
+
+TILE_EXTENT = 4096
+TILE_BUFFER = 64  # tile units kept around the tile edge
+# Grid (tile units) vertices are snapped to before dropping repeats: 1 px of a 512 px tile
+TILE_SIMPLIFY_GRID = TILE_EXTENT // 512
+# How far (degrees) a trip can travel from its start point; trips are selected by start
+TRIP_REACH_DEG = 0.05
+MAX_TRIPS_PER_TILE = 20000
+TILE_MAGIC = b'SWT1'
+
+
+def dataset_version(data_dir):
+    """Version string of the dataset, taken from metadata.json."""
+    metadata_file = os.path.join(data_dir, 'metadata.json')
+    try:
+        with open(metadata_file, 'r') as f:
+            return str(int(json.load(f)['generated_at']))
+    except (OSError, KeyError, ValueError):
+        return 'unversioned'
+
+
+def tile_bounds(z, x, y):
+    """(west, south, east, north) of a Web Mercator tile in degrees."""
+    n = 2 ** z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+def lonlat_to_tile(lon, lat, z):
+    """Fractional tile coordinates of lon/lat arrays at zoom z."""
+    n = 2 ** z
+    lat_rad = np.radians(np.clip(lat, -85.0511, 85.0511))
+    tx = (np.asarray(lon) + 180.0) / 360.0 * n
+    ty = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / math.pi) / 2.0 * n
+    return tx, ty
+
+
+def tiles_covering(west, south, east, north, z):
+    """All (x, y) tiles at zoom z intersecting a bounding box."""
+    x0, y0 = lonlat_to_tile(west, north, z)
+    x1, y1 = lonlat_to_tile(east, south, z)
+    n = 2 ** z
+    return [
+        (x, y)
+        for x in range(max(int(x0), 0), min(int(x1), n - 1) + 1)
+        for y in range(max(int(y0), 0), min(int(y1), n - 1) + 1)
+    ]
+
+
+def has_path_zoom(con):
+    """Whether scooter_data carries the per-vertex path_zoom column."""
+    return 'path_zoom' in [d[0] for d in con.execute("SELECT * FROM scooter_data LIMIT 0").description]
+
+
+def path_at_zoom_sql(zoom):
+    """SQL expression keeping only the path vertices needed at a (256 px) zoom.
+
+    Uses the per-vertex minimum zoom written by scripts/simplify_paths.py.
+    """
+    return f"list_filter(path, (p, i) -> path_zoom[i] <= {int(zoom)})"
+
+
+def fetch_tile_paths(con, z, x, y, limit=MAX_TRIPS_PER_TILE, path_zoom=False):
+    """Flat vertex arrays of trips that can reach the tile.
+
+    With path_zoom, only the vertices needed at this tile's resolution
+    (512 px tiles, i.e. 256 px zoom z + 1) are read.
+
+    Returns:
+        (trip, lon, lat) arrays, one entry per vertex, grouped by trip.
+    """
+    west, south, east, north = tile_bounds(z, x, y)
+    s, n = south - TRIP_REACH_DEG, north + TRIP_REACH_DEG
+    w, e = west - TRIP_REACH_DEG, east + TRIP_REACH_DEG
+    path_expr = path_at_zoom_sql(z + 1) if path_zoom else "path"
+    query = f"""
+        SELECT {path_expr} AS path FROM scooter_data
+        WHERE grid_lat BETWEEN {math.floor(s * 10)} AND {math.floor(n * 10)}
+          AND grid_lon BETWEEN {math.floor(w * 10)} AND {math.floor(e * 10)}
+          AND path[1][2] BETWEEN {s} AND {n}
+          AND path[1][3] BETWEEN {w} AND {e}
+        LIMIT {int(limit)}
+    """
+    paths = con.execute(query).fetch_arrow_table().column('path').combine_chunks()
+    vertices = paths.flatten()
+    values = vertices.flatten().to_numpy(zero_copy_only=False).reshape(-1, 3)
+    counts = np.diff(paths.offsets.to_numpy())
+    trip = np.repeat(np.arange(len(counts)), counts)
+    # path vertices are [ts, lat, lon]
+    return trip, values[:, 2], values[:, 1]
+
+
+def _clip_toward(inner_x, inner_y, outer_x, outer_y, lo, hi):
+    """Move outer points onto the [lo, hi] box along the segment from inner points."""
+    dx = outer_x - inner_x
+    dy = outer_y - inner_y
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tx = np.where(dx > 0, (hi - inner_x) / dx, np.where(dx < 0, (lo - inner_x) / dx, np.inf))
+        ty = np.where(dy > 0, (hi - inner_y) / dy, np.where(dy < 0, (lo - inner_y) / dy, np.inf))
+    t = np.clip(np.minimum(np.minimum(tx, ty), 1.0), 0.0, 1.0)
+    return inner_x + t * dx, inner_y + t * dy
+
+
+def clip_paths(trip, px, py, lo=-TILE_BUFFER, hi=TILE_EXTENT + TILE_BUFFER):
+    """Clip flat trajectories (tile units) to the buffered tile box.
+
+    Every run of consecutive in-box vertices of a trip becomes one part; the
+    vertices just before and after a run are moved onto the box edge so lines
+    still leave the tile in the right direction.
+
+    Returns:
+        (part, x, y) arrays, one entry per kept vertex, grouped by part.
+    """
+    if len(trip) == 0:
+        return np.array([], np.int64), np.array([]), np.array([])
+    inside = (px >= lo) & (px <= hi) & (py >= lo) & (py <= hi)
+    same_prev = np.r_[False, trip[1:] == trip[:-1]]
+    same_next = np.r_[trip[1:] == trip[:-1], False]
+
+    starts = np.flatnonzero(inside & ~(np.r_[False, inside[:-1]] & same_prev))
+    ends = np.flatnonzero(inside & ~(np.r_[inside[1:], False] & same_next))
+    entry = same_prev[starts]
+    exit_ = same_next[ends]
+
+    ins = np.flatnonzero(inside)
+    pos = np.searchsorted(ins, starts)
+    end_pos = np.searchsorted(ins, ends) + 1
+
+    ex, ey = _clip_toward(px[ends[exit_]], py[ends[exit_]],
+                          px[ends[exit_] + 1], py[ends[exit_] + 1], lo, hi)
+    nx, ny = _clip_toward(px[starts[entry]], py[starts[entry]],
+                          px[starts[entry] - 1], py[starts[entry] - 1], lo, hi)
+
+    # Exits first so that, at equal positions, a part's exit precedes the next entry
+    at = np.r_[end_pos[exit_], pos[entry]]
+    x = np.insert(px[ins], at, np.r_[ex, nx])
+    y = np.insert(py[ins], at, np.r_[ey, ny])
+    lengths = (end_pos - pos) + entry + exit_
+    part = np.repeat(np.arange(len(starts)), lengths)
+    return part, x, y
+
+
+def simplify_parts(part, x, y, grid=TILE_SIMPLIFY_GRID):
+    """Quantize to int16 tile units, drop repeated grid cells and degenerate parts."""
+    if len(part) == 0:
+        return np.array([], np.int64), np.array([], np.int16), np.array([], np.int16)
+    qx = np.round(x).astype(np.int16)
+    qy = np.round(y).astype(np.int16)
+    gx, gy = qx // grid, qy // grid
+    repeat = np.r_[False, (gx[1:] == gx[:-1]) & (gy[1:] == gy[:-1]) & (part[1:] == part[:-1])]
+    # Always keep a part's last vertex so its end point stays exact
+    last = np.r_[part[1:] != part[:-1], True]
+    keep = ~repeat | last
+    part, qx, qy = part[keep], qx[keep], qy[keep]
+    lengths = np.bincount(part, minlength=part.max() + 1 if len(part) else 0)
+    valid = lengths[part] >= 2
+    part, qx, qy = part[valid], qx[valid], qy[valid]
+    _, lengths = np.unique(part, return_counts=True)
+    return lengths, qx, qy
+
+
+def encode_tile(lengths, qx, qy):
+    """Pack parts into the SWT1 binary format."""
+    offsets = np.r_[0, np.cumsum(lengths)].astype('<u4')
+    coords = np.column_stack([qx, qy]).astype('<i2')
+    header = struct.pack('<4sII', TILE_MAGIC, len(lengths), len(qx))
+    return header + offsets.tobytes() + coords.tobytes()
+
+
+def decode_tile(data):
+    """Inverse of encode_tile: (offsets, coords[n, 2])."""
+    magic, n_parts, n_vertices = struct.unpack_from('<4sII', data)
+    if magic != TILE_MAGIC:
+        raise ValueError("not a SWT1 tile")
+    offsets = np.frombuffer(data, '<u4', n_parts + 1, 12)
+    coords = np.frombuffer(data, '<i2', n_vertices * 2, 12 + 4 * (n_parts + 1))
+    return offsets, coords.reshape(-1, 2)
+
+
+def render_tile(con, z, x, y, path_zoom=False):
+    """Query, clip, simplify and encode one tile."""
+    trip, lon, lat = fetch_tile_paths(con, z, x, y, path_zoom=path_zoom)
+    tx, ty = lonlat_to_tile(lon, lat, z)
+    part, cx, cy = clip_paths(trip, (tx - x) * TILE_EXTENT, (ty - y) * TILE_EXTENT)
+    return encode_tile(*simplify_parts(part, cx, cy))
+
+
+def tile_cache_path(cache_dir, version, z, x, y):
+    return os.path.join(cache_dir, version, str(z), str(x), f"{y}.bin")
+
+
+def get_tile(con, cache_dir, version, z, x, y, path_zoom=False):
+    """Cached tile bytes, rendering and storing the tile on a miss."""
+    path = tile_cache_path(cache_dir, version, z, x, y)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    data = render_tile(con, z, x, y, path_zoom=path_zoom)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return data
@@ -0,0 +1,99 @@
+"""Time windows of trips for the TripsLayer animation.
+
+A window holds every trip active in [start, start + duration), sorted by
+start time, packed into flat typed arrays the browser hands to deck.gl as
+binary attributes without touching individual vertices. Playback fetches
+one window at a time and prefetches the next while the current one plays.
+
+Binary window format ("SWW1", little-endian):
+    4s    magic b'SWW1'
+    u32   n_trips
+    u32   n_vertices
+    f64   window_start             epoch seconds
+    f64   window_end               epoch seconds
+    u32   start_indices[n_trips + 1]   vertex offset of each trip
+    f32   positions[n_vertices * 2]    lon, lat
+    f32   timestamps[n_vertices]       seconds since window_start
+    u32   ids_length
+    u8    ids[ids_length]              route ids, UTF-8, newline separated
+"""
+import math
+import struct
+
+import numpy as np
+
+import tiles
+
+WINDOW_MAGIC = b'SWW1'
+DEFAULT_WINDOW_S = 1800
+MAX_WINDOW_S = 6 * 3600
+MAX_TRIPS_PER_WINDOW = 50000
+# Longest trip considered: trips starting this long before the window can still be active
+# (also bounds the start_timestamp range so Parquet statistics prune row groups)
+MAX_TRIP_S = 3 * 3600
+
+
+def window_query(start, end, bbox=None, zoom=None, limit=MAX_TRIPS_PER_WINDOW):
+    """SQL for trips overlapping [start, end) epoch seconds, in start order."""
+    path_expr = f"{tiles.path_at_zoom_sql(zoom)} AS path" if zoom is not None else "path"
+    conditions = [
+        f"start_timestamp >= to_timestamp({start - MAX_TRIP_S})",
+        f"start_timestamp < to_timestamp({end})",
+        f"end_timestamp >= to_timestamp({start})",
+    ]
+    if bbox:
+        n, s, e, w = bbox
+        conditions.append(f"path[1][2] BETWEEN {s} AND {n}")
+        conditions.append(f"path[1][3] BETWEEN {w} AND {e}")
+        conditions.append(f"grid_lat BETWEEN {math.floor(s * 10)} AND {math.floor(n * 10)}")
+        conditions.append(f"grid_lon BETWEEN {math.floor(w * 10)} AND {math.floor(e * 10)}")
+    return f"""
+        SELECT route_id, {path_expr} FROM scooter_data
+        WHERE {" AND ".join(conditions)}
+        ORDER BY start_timestamp, route_id
+        LIMIT {int(limit)}
+    """
+
+
+def pack_window(table, start, end):
+    """Pack a (route_id, path) Arrow table into the SWW1 format."""
+    paths = table.column('path').combine_chunks()
+    offsets = paths.offsets.to_numpy()
+    values = paths.flatten().flatten().to_numpy(zero_copy_only=False).reshape(-1, 3)
+    # Sliced arrays keep their parent's offsets; vertices start at offsets[0]
+    start_indices = (offsets - offsets[0]).astype('<u4')
+
+    # path vertices are [ts, lat, lon]
+    positions = values[:, [2, 1]].astype('<f4')
+    timestamps = (values[:, 0] - start).astype('<f4')
+    ids = "\n".join(str(r) for r in table.column('route_id').to_pylist()).encode()
+
+    header = struct.pack('<4sIIdd', WINDOW_MAGIC, len(paths), len(values), start, end)
+    return b"".join([
+        header, start_indices.tobytes(), positions.tobytes(), timestamps.tobytes(),
+        struct.pack('<I', len(ids)), ids,
+    ])
+
+
+def unpack_window(data):
+    """Inverse of pack_window: dict of start/end, start_indices, positions[n, 2], timestamps, route_ids."""
+    magic, n_trips, n_vertices, start, end = struct.unpack_from('<4sIIdd', data)
+    if magic != WINDOW_MAGIC:
+        raise ValueError("not a SWW1 window")
+    pos = struct.calcsize('<4sIIdd')
+    start_indices = np.frombuffer(data, '<u4', n_trips + 1, pos)
+    pos += 4 * (n_trips + 1)
+    positions = np.frombuffer(data, '<f4', n_vertices * 2, pos).reshape(-1, 2)
+    pos += 8 * n_vertices
+    timestamps = np.frombuffer(data, '<f4', n_vertices, pos)
+    pos += 4 * n_vertices
+    (ids_length,) = struct.unpack_from('<I', data, pos)
+    ids = data[pos + 4:pos + 4 + ids_length].decode()
+    return {
+        "start": start,
+        "end": end,
+        "start_indices": start_indices,
+        "positions": positions,
+        "timestamps": timestamps,
+        "route_ids": ids.split("\n") if n_trips else [],
+    }
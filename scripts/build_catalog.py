@@ -0,0 +1,100 @@
+import duckdb
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+from db import dataset_fingerprint
+
+DATA_DIR = 'D:/SwingData/data_hive'
+# Persistent catalog opened read-only by app/main.py
+CATALOG_FILE = 'D:/SwingData/catalog.duckdb'
+
+
+def build_catalog():
+    if not os.path.exists(DATA_DIR):
+        print(f"Error: {DATA_DIR} not found.")
+        return
+
+    print("Building DuckDB catalog from Hive partitions...")
+    start_time = time.time()
+
+    files = sorted(
+        f.replace("\\", "/")
+        for f in glob.glob(os.path.join(DATA_DIR, '**', '*.parquet'), recursive=True)
+    )
+    print(f"Found {len(files)} partition files")
+    if not files:
+        return
+
+    tmp_file = CATALOG_FILE + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    con = duckdb.connect(database=tmp_file)
+    file_list = ", ".join(f"'{f}'" for f in files)
+
+    # 1. Partition files: row counts and timestamp ranges from the Parquet footers (no data scan)
+    print("Reading Parquet footers...")
+    con.execute(f"""
+        CREATE TABLE partition_files AS
+        SELECT
+            m.file_name AS file,
+            CAST(regexp_extract(m.file_name, 'year=(\\d+)', 1) AS INTEGER) AS year,
+            CAST(regexp_extract(m.file_name, 'month=(\\d+)', 1) AS INTEGER) AS month,
+            CAST(regexp_extract(m.file_name, 'grid_lat=(-?\\d+)', 1) AS INTEGER) AS grid_lat,
+            CAST(regexp_extract(m.file_name, 'grid_lon=(-?\\d+)', 1) AS INTEGER) AS grid_lon,
+            sum(m.row_group_num_rows) FILTER (WHERE m.path_in_schema = 'start_timestamp') AS num_rows,
+            count(*) FILTER (WHERE m.path_in_schema = 'start_timestamp') AS num_row_groups,
+            min(TRY_CAST(m.stats_min_value AS TIMESTAMP)) FILTER (WHERE m.path_in_schema = 'start_timestamp') AS min_start,
+            max(TRY_CAST(m.stats_max_value AS TIMESTAMP)) FILTER (WHERE m.path_in_schema = 'end_timestamp') AS max_end
+        FROM parquet_metadata([{file_list}]) m
+        GROUP BY m.file_name
+        ORDER BY m.file_name
+    """)
+
+    # 2. Pre-aggregated summaries (one pass over start_timestamp only)
+    print("Aggregating daily and per-grid counts...")
+    con.execute(f"""
+        CREATE TABLE daily_counts AS
+        SELECT CAST(start_timestamp AS DATE) AS day, grid_lat, grid_lon, count(*) AS trips
+        FROM read_parquet([{file_list}], hive_partitioning=1)
+        GROUP BY ALL
+        ORDER BY day, grid_lat, grid_lon
+    """)
+    con.execute("""
+        CREATE TABLE grid_counts AS
+        SELECT grid_lat, grid_lon, sum(num_rows) AS trips, min(min_start) AS min_start, max(max_end) AS max_end
+        FROM partition_files
+        GROUP BY ALL
+        ORDER BY grid_lat, grid_lon
+    """)
+    con.execute("""
+        CREATE VIEW summary AS
+        SELECT sum(num_rows) AS total_records, min(min_start) AS start_date, max(max_end) AS end_date,
+               count(*) AS num_files
+        FROM partition_files
+    """)
+
+    # 3. View over the explicit file list, so queries never re-glob the directory tree
+    con.execute(f"""
+        CREATE VIEW scooter_data AS
+        SELECT * FROM read_parquet([{file_list}], hive_partitioning=1)
+    """)
+    # The app only trusts the catalog while the dataset still has exactly these files
+    con.execute("CREATE TABLE catalog_info AS SELECT $data_dir AS data_dir, now() AS built_at, "
+                "$fingerprint AS dataset_fingerprint",
+                {"data_dir": DATA_DIR, "fingerprint": dataset_fingerprint(DATA_DIR, files)})
+
+    total, start, end, num_files = con.execute("SELECT * FROM summary").fetchone()
+    con.close()
+    os.replace(tmp_file, CATALOG_FILE)
+
+    print(f"Total Records: {total}")
+    print(f"Time Range: {start} to {end}")
+    print(f"Catalog saved to {CATALOG_FILE}")
+    print(f"Duration: {time.time() - start_time:.2f}s")
+
+
+if __name__ == "__main__":
+    build_catalog()
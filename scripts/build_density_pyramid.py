@@ -0,0 +1,144 @@
+import duckdb
+import glob
+import json
+import os
+import re
+import shutil
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+import density_tiles
+import tiles
+
+DATA_DIR = 'D:/SwingData/data_hive'
+DENSITY_DIR = 'D:/SwingData/density_tiles'
+# Riding mode per route_id (src/ pipeline); without it only the 'all' mode is built
+TRIPS_FILE = 'C:/Users/chois/Gitsrcs/Swingdata/data_parquet/cleaned/trips_cleaned.parquet'
+
+BATCH_ROWS = 1_000_000
+# Merge the per-batch partial counts once this many have piled up
+MERGE_EVERY = 16
+
+
+def data_months():
+    """(year, month) pairs with partition directories, in order."""
+    months = set()
+    for d in glob.glob(os.path.join(DATA_DIR, 'year=*', 'month=*')):
+        year = re.search(r'year=(\d+)', d)
+        month = re.search(r'month=(\d+)', d)
+        if year and month:
+            months.add((int(year.group(1)), int(month.group(1))))
+    return sorted(months)
+
+
+def count_month(con, year, month, with_modes):
+    """One streaming pass over a month's vertices: {mode: (keys, counts)} at DENSITY_MAX_ZOOM."""
+    files = os.path.join(DATA_DIR, f'year={year}', f'month={month}', '**', '*.parquet').replace("\\", "/")
+    mode_expr = "coalesce(t.mode, 'unknown')" if with_modes else f"'{density_tiles.ALL}'"
+    join = "LEFT JOIN read_parquet($trips) t USING (route_id)" if with_modes else ""
+    reader = con.execute(f"""
+        SELECT {mode_expr} AS mode, v[2] AS lat, v[3] AS lon
+        FROM (SELECT route_id, unnest(path) AS v FROM read_parquet('{files}', hive_partitioning=false)) s
+        {join}
+    """, {"trips": TRIPS_FILE} if with_modes else None).fetch_record_batch(BATCH_ROWS)
+
+    partial = {}
+    vertices = 0
+    for batch in reader:
+        modes = batch.column(0).to_numpy(zero_copy_only=False)
+        lat = batch.column(1).to_numpy(zero_copy_only=False)
+        lon = batch.column(2).to_numpy(zero_copy_only=False)
+        vertices += len(lat)
+        for mode in np.unique(modes):
+            rows = modes == mode
+            parts = partial.setdefault(mode, [])
+            parts.append(density_tiles.count_keys(density_tiles.pixel_keys(lon[rows], lat[rows])))
+            if len(parts) >= MERGE_EVERY:
+                partial[mode] = [density_tiles.merge_counts(parts)]
+    print(f"  {year}-{month:02d}: {vertices:,} vertices")
+    return {mode: density_tiles.merge_counts(parts) for mode, parts in partial.items()}
+
+
+def write_pyramid(version, month, mode, keys, counts):
+    """Write one layer's tiles for every zoom; returns {zoom: largest pixel count}."""
+    max_counts = {}
+    for z in range(density_tiles.DENSITY_MAX_ZOOM, density_tiles.DENSITY_MIN_ZOOM - 1, -1):
+        if z < density_tiles.DENSITY_MAX_ZOOM:
+            keys, counts = density_tiles.downsample(keys, counts)
+        max_counts[z] = int(min(counts.max(), density_tiles.MAX_COUNT)) if len(counts) else 0
+        for x, y, raster in density_tiles.split_tiles(keys, counts):
+            path = density_tiles.tile_path(DENSITY_DIR, version, month, mode, z, x, y)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(density_tiles.encode_png(raster))
+    return max_counts
+
+
+def build_pyramid():
+    if not os.path.exists(DATA_DIR):
+        print(f"Error: {DATA_DIR} not found.")
+        return
+
+    version = tiles.dataset_version(DATA_DIR)
+    # Built under <version>.tmp and renamed when complete
+    root = os.path.join(DENSITY_DIR, version)
+    tmp_version = f"{version}.tmp"
+    tmp_root = os.path.join(DENSITY_DIR, tmp_version)
+    if os.path.exists(tmp_root):
+        shutil.rmtree(tmp_root)
+    with_modes = os.path.exists(TRIPS_FILE)
+    print(f"Dataset version: {version}")
+    print(f"Modes: {'from ' + TRIPS_FILE if with_modes else 'not available (all only)'}")
+
+    start_time = time.time()
+    con = duckdb.connect(database=':memory:')
+    layers = {}
+    totals = {}  # mode -> counts over all months
+    for year, month in data_months():
+        label = f"{year}-{month:02d}"
+        by_mode = count_month(con, year, month, with_modes)
+        if not by_mode:
+            continue
+        for mode, (keys, counts) in by_mode.items():
+            if mode != density_tiles.ALL:
+                layers[f"{label}/{mode}"] = write_pyramid(tmp_version, label, mode, keys, counts)
+            if mode in totals:
+                keys, counts = density_tiles.merge_counts([totals[mode], (keys, counts)])
+            totals[mode] = keys, counts
+        month_all = density_tiles.merge_counts(list(by_mode.values()))
+        layers[f"{label}/{density_tiles.ALL}"] = write_pyramid(tmp_version, label, density_tiles.ALL, *month_all)
+
+    for mode, (keys, counts) in totals.items():
+        if mode != density_tiles.ALL:
+            layers[f"{density_tiles.ALL}/{mode}"] = write_pyramid(tmp_version, density_tiles.ALL, mode, keys, counts)
+    grand = density_tiles.merge_counts(list(totals.values()))
+    layers[f"{density_tiles.ALL}/{density_tiles.ALL}"] = write_pyramid(
+        tmp_version, density_tiles.ALL, density_tiles.ALL, *grand)
+    con.close()
+
+    months = sorted({key.split('/')[0] for key in layers} - {density_tiles.ALL})
+    modes = sorted({key.split('/')[1] for key in layers} - {density_tiles.ALL})
+    manifest = {
+        "min_zoom": density_tiles.DENSITY_MIN_ZOOM,
+        "max_zoom": density_tiles.DENSITY_MAX_ZOOM,
+        "months": months,
+        "modes": modes,
+        "max_counts": layers,
+    }
+    os.makedirs(tmp_root, exist_ok=True)
+    with open(os.path.join(tmp_root, density_tiles.MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.replace(tmp_root, root)
+
+    print(f"Layers: {len(layers)} ({len(months)} months x {len(modes)} modes, plus totals)")
+    print(f"Pyramid saved to {root}")
+    print(f"Duration: {time.time() - start_time:.2f}s")
+
+
+if __name__ == "__main__":
+    build_pyramid()
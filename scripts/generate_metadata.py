@@ -1,59 +1,140 @@
 import duckdb
+import glob
 import json
 import os
+import sys
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+import partition_stats
+
 DATA_DIR = 'D:/SwingData/data_hive'
 METADATA_FILE = os.path.join(DATA_DIR, 'metadata.json')
+PARTITION_STATS_FILE = os.path.join(DATA_DIR, partition_stats.PARTITION_STATS_FILE)
+
+
+def scan_partitions():
+    """{relative partition dir: [[file name, size, mtime_ns], ...]} of the Hive tree."""
+    partitions = {}
+    for f in glob.glob(os.path.join(DATA_DIR, '*', '*', 'grid_lat=*', 'grid_lon=*', '*.parquet')):
+        st = os.stat(f)
+        key = os.path.relpath(os.path.dirname(f), DATA_DIR).replace("\\", "/")
+        partitions.setdefault(key, []).append([os.path.basename(f), st.st_size, st.st_mtime_ns])
+    return {key: sorted(files) for key, files in partitions.items()}
+
+
+def compute_partition_stats(con, keys, files):
+    """Scan the given partitions once and return their entries.
+
+    Args:
+        con: DuckDB connection.
+        keys: Relative partition directories to (re)compute.
+        files: Output of scan_partitions().
+    """
+    paths = [
+        os.path.join(DATA_DIR, key, name).replace("\\", "/")
+        for key in keys for name, _, _ in files[key]
+    ]
+    file_list = ", ".join(f"'{p}'" for p in paths)
+    root = DATA_DIR.replace("\\", "/").rstrip("/") + "/"
+    source = f"""
+        SELECT replace(regexp_replace(filename, '/[^/]*$', ''), '{root}', '') AS part, *
+        FROM read_parquet([{file_list}], filename=true, hive_partitioning=false)
+    """
+    rows = con.execute(f"""
+        SELECT
+            part,
+            count(*) AS rows,
+            epoch(min(start_timestamp)) AS min_start,
+            epoch(max(end_timestamp)) AS max_end,
+            min(list_min(list_transform(path, p -> p[3]))) AS west,
+            min(list_min(list_transform(path, p -> p[2]))) AS south,
+            max(list_max(list_transform(path, p -> p[3]))) AS east,
+            max(list_max(list_transform(path, p -> p[2]))) AS north
+        FROM ({source})
+        GROUP BY part
+    """).fetchall()
+
+    # Distinct users: per partition, the max rank of every HLL register
+    register, rank = partition_stats.hll_register_sql("md5_number_lower(CAST(user_id AS VARCHAR))")
+    sketches = con.execute(f"""
+        SELECT part, list(reg), list(rnk)
+        FROM (
+            SELECT part, {register} AS reg, max({rank}) AS rnk
+            FROM (SELECT part, user_id FROM ({source}) WHERE user_id IS NOT NULL)
+            GROUP BY ALL
+        )
+        GROUP BY part
+    """).fetchall()
+    sketches = {part: partition_stats.hll_from_registers(regs, ranks) for part, regs, ranks in sketches}
+
+    entries = {}
+    for part, n, min_start, max_end, west, south, east, north in rows:
+        entries[part] = {
+            "files": files[part],
+            "rows": n,
+            "min_start": min_start,
+            "max_end": max_end,
+            "bbox": [west, south, east, north] if west is not None else None,
+            "hll": partition_stats.hll_encode(sketches[part]) if part in sketches else None,
+        }
+    # Partitions whose files hold no rows
+    for key in keys:
+        entries.setdefault(key, {"files": files[key], "rows": 0, "min_start": None, "max_end": None,
+                                 "bbox": None, "hll": None})
+    return entries
+
 
-def generate_metadata():
+def generate_metadata(full=False):
     if not os.path.exists(DATA_DIR):
         print(f"Error: {DATA_DIR} not found.")
         return
 
     print("Generating metadata from Hive partitions...")
     start_time = time.time()
-    
-    con = duckdb.connect(database=':memory:')
-    
-    # 1. Get Totals
-    # Using the hive structure, we can just read the parquet files. 
-    # hive_partitioning=1 lets us query year/month columns if needed, but for min/max we just need the timestamps.
-    
-    # NOTE: Reading 30M rows might still take 10-20s. 
-    # Since this is an offline script, we can afford it.
-    
-    print("Calculating statistics (count, min, max)...")
-    path = os.path.join(DATA_DIR, "**", "*.parquet").replace("\\", "/")
-    
-    query = f"""
-        SELECT 
-            count(*) as total_count,
-            min(start_timestamp) as min_ts,
-            max(end_timestamp) as max_ts
-        FROM read_parquet('{path}', hive_partitioning=1)
-    """
-    
-    stats = con.execute(query).fetchone()
-    total_count = stats[0]
-    min_ts = stats[1]
-    max_ts = stats[2]
-    
-    print(f"Total Records: {total_count}")
-    print(f"Time Range: {min_ts} to {max_ts}")
-    
-    metadata = {
-        "total_records": total_count,
-        "start_date": min_ts.isoformat() if min_ts else None,
-        "end_date": max_ts.isoformat() if max_ts else None,
-        "generated_at": time.time()
-    }
-    
+
+    files = scan_partitions()
+    previous = {} if full else (partition_stats.load(DATA_DIR) or {})
+
+    # Only partitions whose file list, sizes or mtimes changed are rescanned
+    changed = sorted(key for key in files if previous.get(key, {}).get('files') != files[key])
+    removed = sorted(set(previous) - set(files))
+    print(f"Partitions: {len(files)} ({len(changed)} changed, {len(removed)} removed)")
+
+    partitions = {key: previous[key] for key in files if key not in changed}
+    if changed:
+        print("Calculating partition statistics (count, time range, bbox, distinct users)...")
+        con = duckdb.connect(database=':memory:')
+        partitions.update(compute_partition_stats(con, changed, files))
+        con.close()
+    partitions = dict(sorted(partitions.items()))
+
+    metadata = partition_stats.merge_partitions(partitions)
+    print(f"Total Records: {metadata['total_records']}")
+    print(f"Time Range: {metadata['start_date']} to {metadata['end_date']}")
+    print(f"Distinct Users (approx.): {metadata['distinct_users']}")
+
+    # generated_at versions the tile and query caches, so it only moves when the data did
+    try:
+        with open(METADATA_FILE, 'r') as f:
+            generated_at = json.load(f).get('generated_at')
+    except (OSError, ValueError):
+        generated_at = None
+    if changed or removed or generated_at is None:
+        generated_at = time.time()
+    metadata["generated_at"] = generated_at
+
+    tmp = f"{PARTITION_STATS_FILE}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump({"hll_precision": partition_stats.HLL_PRECISION, "partitions": partitions}, f)
+    os.replace(tmp, PARTITION_STATS_FILE)
+
     with open(METADATA_FILE, 'w') as f:
         json.dump(metadata, f, indent=2)
-        
+
     print(f"Metadata saved to {METADATA_FILE}")
     print(f"Duration: {time.time() - start_time:.2f}s")
 
+
 if __name__ == "__main__":
-    generate_metadata()
+    generate_metadata(full='--full' in sys.argv[1:])
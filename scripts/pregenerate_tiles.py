@@ -0,0 +1,68 @@
+import duckdb
+import glob
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+import tiles
+
+DATA_DIR = 'D:/SwingData/data_hive'
+TILE_CACHE_DIR = 'D:/SwingData/tile_cache'
+
+# Low zooms are the expensive ones to render on demand; higher zooms stay lazy
+MIN_ZOOM = 5
+MAX_ZOOM = 11
+
+
+def data_cells():
+    """0.1 degree (grid_lat, grid_lon) cells that have data, from the partition directories."""
+    cells = set()
+    for d in glob.glob(os.path.join(DATA_DIR, '*', '*', 'grid_lat=*', 'grid_lon=*')):
+        lat = re.search(r'grid_lat=(-?\d+)', d)
+        lon = re.search(r'grid_lon=(-?\d+)', d)
+        if lat and lon:
+            cells.add((int(lat.group(1)), int(lon.group(1))))
+    return cells
+
+
+def pregenerate(min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+    if not os.path.exists(DATA_DIR):
+        print(f"Error: {DATA_DIR} not found.")
+        return
+
+    version = tiles.dataset_version(DATA_DIR)
+    print(f"Dataset version: {version}")
+    print(f"Cache: {TILE_CACHE_DIR}")
+
+    con = duckdb.connect(database=':memory:')
+    path = os.path.join(DATA_DIR, "**", "*.parquet").replace("\\", "/")
+    con.execute(f"CREATE VIEW scooter_data AS SELECT * FROM read_parquet('{path}', hive_partitioning=1)")
+
+    path_zoom = tiles.has_path_zoom(con)
+    cells = data_cells()
+    print(f"Found {len(cells)} grid cells with data")
+
+    start_time = time.time()
+    for z in range(min_zoom, max_zoom + 1):
+        # Tiles touching any data cell
+        todo = set()
+        for lat, lon in cells:
+            todo.update(tiles.tiles_covering(lon / 10, lat / 10, (lon + 1) / 10, (lat + 1) / 10, z))
+
+        iter_start = time.time()
+        done = 0
+        for x, y in sorted(todo):
+            if os.path.exists(tiles.tile_cache_path(TILE_CACHE_DIR, version, z, x, y)):
+                continue
+            tiles.get_tile(con, TILE_CACHE_DIR, version, z, x, y, path_zoom=path_zoom)
+            done += 1
+        print(f"Zoom {z}: {len(todo)} tiles ({done} rendered) in {time.time() - iter_start:.2f}s")
+
+    print(f"Duration: {time.time() - start_time:.2f}s")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    pregenerate(*args)
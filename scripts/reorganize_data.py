@@ -1,10 +1,19 @@
 import duckdb
+import glob
 import os
+import sys
 import time
 
 INPUT_DIR = 'D:/SwingData/data_parquet'
 OUTPUT_DIR = 'D:/SwingData/data_hive'
 
+# Per-trip sample key: first 52 bits of md5(route_id) scaled to [0, 1), so the same
+# trip always gets the same key (Python: int(md5(route_id).hexdigest()[:13], 16) / 2**52).
+# Files are sorted by it, so `WHERE sample_key < p` is a uniform, reproducible sample
+# whose row groups can be pruned from Parquet min/max statistics.
+SAMPLE_KEY_SQL = "CAST(('0x' || md5(route_id)[1:13]) AS UBIGINT) / 4503599627370496.0"
+SAMPLE_ROW_GROUP_SIZE = 10000
+
 def reorganize():
     # Check input
     if not os.path.exists(INPUT_DIR):
@@ -68,5 +77,36 @@ def reorganize():
     duration = time.time() - start_time
     print(f"\nSUCCESS: Data reorganization completed in {duration:.2f} seconds.")
 
+    # Partitioned COPY does not keep row order within files, so sort in a second pass
+    add_sample_keys()
+
+def add_sample_keys():
+    """Add sample_key to every partition file (if missing) and sort each file by it."""
+    files = sorted(glob.glob(os.path.join(OUTPUT_DIR, '**', '*.parquet'), recursive=True))
+    print(f"\nSorting {len(files)} partition files by sample_key...")
+
+    # Separate connection: ordered single-file writes need preserve_insertion_order
+    con = duckdb.connect(database=':memory:')
+    start_time = time.time()
+    for i, path in enumerate(files):
+        path = path.replace("\\", "/")
+        columns = [d[0] for d in con.execute(f"SELECT * FROM read_parquet('{path}', hive_partitioning=false) LIMIT 0").description]
+        key = "" if 'sample_key' in columns else f", {SAMPLE_KEY_SQL} AS sample_key"
+        tmp = f"{path}.tmp"
+        con.execute(f"""
+        COPY (
+            SELECT *{key}
+            FROM read_parquet('{path}', hive_partitioning=false)
+            ORDER BY sample_key
+        ) TO '{tmp}' (FORMAT PARQUET, ROW_GROUP_SIZE {SAMPLE_ROW_GROUP_SIZE});
+        """)
+        os.replace(tmp, path)
+        print(f"  [{i + 1}/{len(files)}]", end='\r')
+    print(f"\nSorted in {time.time() - start_time:.2f} seconds.")
+
 if __name__ == "__main__":
-    reorganize()
+    # --sample-keys: only add/sort sample_key on an existing Hive dataset
+    if '--sample-keys' in sys.argv[1:]:
+        add_sample_keys()
+    else:
+        reorganize()
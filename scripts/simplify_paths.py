@@ -0,0 +1,145 @@
+import glob
+import os
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from reorganize_data import SAMPLE_ROW_GROUP_SIZE
+
+# Runs after reorganize_data.py, in place on the Hive dataset. Rows keep their
+# sample_key order and SAMPLE_ROW_GROUP_SIZE row groups, so /api/sample can
+# still prune row groups on `sample_key < p`.
+DATA_DIR = 'D:/SwingData/data_hive'
+
+# A vertex is needed at zoom z when dropping it would move the line by more
+# than PIXEL_TOLERANCE pixels (256 px tiles) at that zoom.
+PIXEL_TOLERANCE = 0.5
+MAX_ZOOM = 18
+EARTH_M_PER_PX_Z0 = 156543.03392  # Web Mercator ground resolution at zoom 0 (equator)
+
+
+def douglas_peucker_importance(trip, x, y):
+    """Per-vertex Douglas-Peucker importance (meters) for many trips at once.
+
+    All open segments of all trips are refined together: each round finds the
+    farthest interior vertex of every segment with one segmented reduction.
+    A vertex's importance is the largest tolerance at which Douglas-Peucker
+    still keeps it (capped by its parent split, so importance is monotone
+    along the recursion); trip end points are kept at every tolerance.
+
+    Args:
+        trip: Trip id per vertex (vertices grouped by trip, in path order).
+        x, y: Projected coordinates in meters.
+
+    Returns:
+        float64 array of importances (inf for end points).
+    """
+    n = len(trip)
+    importance = np.zeros(n)
+    if n == 0:
+        return importance
+    starts = np.flatnonzero(np.r_[True, trip[1:] != trip[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    importance[starts] = np.inf
+    importance[ends] = np.inf
+
+    a, b = starts, ends
+    cap = np.full(len(a), np.inf)
+    while True:
+        open_ = b - a >= 2
+        a, b, cap = a[open_], b[open_], cap[open_]
+        if len(a) == 0:
+            break
+
+        # Interior vertices of every open segment, concatenated
+        lengths = b - a - 1
+        seg = np.repeat(np.arange(len(a)), lengths)
+        first = np.r_[0, np.cumsum(lengths)[:-1]]
+        idx = a[seg] + 1 + np.arange(len(seg)) - first[seg]
+
+        # Perpendicular distance to the chord (distance to a for degenerate chords)
+        ax, ay = x[a][seg], y[a][seg]
+        dx, dy = (x[b] - x[a])[seg], (y[b] - y[a])[seg]
+        px, py = x[idx] - ax, y[idx] - ay
+        chord = np.hypot(dx, dy)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            d = np.where(chord > 0, np.abs(px * dy - py * dx) / chord, np.hypot(px, py))
+
+        d_max = np.maximum.reduceat(d, first)
+        is_max = d == d_max[seg]
+        _, pick = np.unique(seg[is_max], return_index=True)
+        k = idx[is_max][pick]
+
+        value = np.minimum(d_max, cap)
+        importance[k] = value
+        a, b, cap = np.r_[a, k], np.r_[k, b], np.r_[value, value]
+
+    return importance
+
+
+def min_zoom(importance, lat):
+    """Lowest zoom at which each vertex must be drawn."""
+    m_per_px = EARTH_M_PER_PX_Z0 * np.cos(np.radians(lat)) * PIXEL_TOLERANCE
+    with np.errstate(divide='ignore'):
+        z = np.ceil(np.log2(m_per_px / importance))
+    return np.clip(np.nan_to_num(z, nan=MAX_ZOOM, posinf=MAX_ZOOM, neginf=0), 0, MAX_ZOOM).astype(np.uint8)
+
+
+def path_zoom_column(paths):
+    """list<uint8> column with the minimum zoom of every path vertex."""
+    paths = paths.combine_chunks() if isinstance(paths, pa.ChunkedArray) else paths
+    values = paths.flatten().flatten().to_numpy(zero_copy_only=False).reshape(-1, 3)
+    offsets = paths.offsets.to_numpy() - paths.offsets[0].as_py()
+    counts = np.diff(offsets)
+    trip = np.repeat(np.arange(len(paths)), counts)
+
+    # path vertices are [ts, lat, lon]; local equirectangular meters per trip
+    lat, lon = values[:, 1], values[:, 2]
+    lat0 = np.repeat(lat[offsets[:-1][counts > 0]], counts[counts > 0])
+    x = lon * 111320.0 * np.cos(np.radians(lat0))
+    y = lat * 110540.0
+
+    zoom = min_zoom(douglas_peucker_importance(trip, x, y), lat)
+    return pa.ListArray.from_arrays(pa.array(offsets, pa.int32()), pa.array(zoom, pa.uint8()))
+
+
+def simplify():
+    if not os.path.exists(DATA_DIR):
+        print(f"Data directory not found: {DATA_DIR}")
+        return
+
+    files = sorted(glob.glob(os.path.join(DATA_DIR, '**', '*.parquet'), recursive=True))
+    print(f"Found {len(files)} partition files")
+
+    start_time = time.time()
+    total_vertices = 0
+    visible = {z: 0 for z in (8, 11, 14, MAX_ZOOM)}
+    for i, path in enumerate(files):
+        table = pq.read_table(path)
+        if 'path_zoom' in table.column_names:
+            continue
+
+        path_zoom = path_zoom_column(table.column('path'))
+        zooms = path_zoom.flatten().to_numpy()
+        total_vertices += len(zooms)
+        for z in visible:
+            visible[z] += int((zooms <= z).sum())
+
+        # Hive partition columns live in the directory names, not in the files
+        tmp = f"{path}.tmp"
+        pq.write_table(table.append_column('path_zoom', path_zoom), tmp,
+                       row_group_size=SAMPLE_ROW_GROUP_SIZE)
+        os.replace(tmp, path)
+        print(f"  [{i + 1}/{len(files)}] {os.path.relpath(path, DATA_DIR)}", end='\r')
+
+    print()
+    for z, count in visible.items():
+        share = count / total_vertices * 100 if total_vertices else 0.0
+        print(f"Zoom {z:2d}: {share:5.1f}% of vertices")
+    print(f"SUCCESS: Simplification levels written in {time.time() - start_time:.2f} seconds.")
+
+
+if __name__ == "__main__":
+    simplify()
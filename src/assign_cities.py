@@ -1,9 +1,13 @@
 """
-Task 1.3: Identify cities from start coordinates.
+Task 1.3: Identify cities from start and end coordinates.
 
-Assigns each trip to a Korean metropolitan city/province using coordinate-based
-spatial classification. Uses known city center coordinates with a KD-tree
-nearest-neighbor approach.
+Assigns each trip to a Korean metropolitan city/province by point-in-polygon
+against administrative boundary polygons shipped with the data
+(data_parquet/admin_boundaries.gpkg, or any GeoPackage/GeoJSON with a `city`
+column and optional `province` column). Polygons are indexed with a shapely
+STRtree and points are located in vectorized batches; labels are looked up
+with NumPy `take` on integer codes and written as dictionary-encoded
+(categorical) columns.
 
 Korean administrative divisions (시도) relevant to this dataset:
   - Seoul (서울), Busan (부산), Daegu (대구), Incheon (인천)
@@ -13,80 +17,25 @@ Korean administrative divisions (시도) relevant to this dataset:
   - Gangwon (강원), Jeju (제주)
 
 Outputs:
-  - data_parquet/routes_with_cities.parquet — valid trips with city labels
+  - data_parquet/routes_with_cities.parquet — valid trips with start/end city labels
   - data_parquet/city_assignment_report.json — assignment statistics
 """
 
 import duckdb
 import json
 import sys
+import time
+import geopandas as gpd
 import numpy as np
+import pandas as pd
+import shapely
 from pathlib import Path
-from scipy.spatial import KDTree
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from src.config import DATA_DIR
-
-# Korean metropolitan city/province centers (latitude, longitude)
-# Using approximate centers of each administrative division
-CITY_CENTERS = {
-    "Seoul": (37.5665, 126.9780),
-    "Busan": (35.1796, 129.0756),
-    "Daegu": (35.8714, 128.6014),
-    "Incheon": (37.4563, 126.7052),
-    "Gwangju": (35.1595, 126.8526),
-    "Daejeon": (36.3504, 127.3845),
-    "Ulsan": (35.5384, 129.3114),
-    "Sejong": (36.4800, 127.2600),
-    "Suwon": (37.2636, 127.0286),         # Gyeonggi sub-region
-    "Yongin": (37.2411, 127.1776),         # Gyeonggi sub-region
-    "Seongnam": (37.4200, 127.1265),       # Gyeonggi sub-region
-    "Goyang": (37.6584, 126.8320),         # Gyeonggi sub-region
-    "Bucheon": (37.5034, 126.7660),        # Gyeonggi sub-region
-    "Ansan": (37.3219, 126.8309),          # Gyeonggi sub-region
-    "Anyang": (37.3943, 126.9568),         # Gyeonggi sub-region
-    "Hwaseong": (37.2000, 126.8313),       # Gyeonggi sub-region
-    "Pyeongtaek": (36.9920, 127.0850),     # Gyeonggi sub-region
-    "Uijeongbu": (37.7377, 127.0339),      # Gyeonggi sub-region
-    "Paju": (37.7590, 126.7800),           # Gyeonggi sub-region
-    "Gimpo": (37.6153, 126.7156),          # Gyeonggi sub-region
-    "Gwangju_Gyeonggi": (37.4095, 127.2573),  # Gwangju-si, Gyeonggi
-    "Icheon": (37.2719, 127.4350),         # Gyeonggi sub-region
-    "Wonju": (37.3422, 127.9202),          # Gangwon
-    "Chuncheon": (37.8813, 127.7298),      # Gangwon
-    "Cheongju": (36.6424, 127.4890),       # Chungbuk
-    "Cheonan": (36.8151, 127.1139),        # Chungnam
-    "Asan": (36.7898, 127.0018),           # Chungnam
-    "Jeonju": (35.8242, 127.1480),         # Jeonbuk
-    "Iksan": (35.9483, 126.9577),          # Jeonbuk
-    "Gunsan": (35.9677, 126.7369),         # Jeonbuk
-    "Mokpo": (34.8118, 126.3922),          # Jeonnam
-    "Yeosu": (34.7604, 127.6622),          # Jeonnam
-    "Suncheon": (34.9506, 127.4872),       # Jeonnam
-    "Pohang": (36.0190, 129.3435),         # Gyeongbuk
-    "Gumi": (36.1194, 128.3447),           # Gyeongbuk
-    "Gyeongju": (35.8562, 129.2247),       # Gyeongbuk
-    "Changwon": (35.2280, 128.6811),       # Gyeongnam (includes Masan, Jinhae)
-    "Gimhae": (35.2285, 128.8894),         # Gyeongnam
-    "Jinju": (35.1799, 128.1076),          # Gyeongnam
-    "Jeju": (33.4996, 126.5312),           # Jeju
-    "Yangju": (37.7854, 127.0456),         # Gyeonggi
-    "Namyangju": (37.6367, 127.2165),      # Gyeonggi
-    "Hanam": (37.5392, 127.2147),          # Gyeonggi
-    "Gunpo": (37.3617, 126.9352),          # Gyeonggi
-    "Siheung": (37.3800, 126.8030),        # Gyeonggi
-    "Osan": (37.1490, 127.0770),           # Gyeonggi
-    "Dongducheon": (37.9034, 127.0606),    # Gyeonggi
-    "Andong": (36.5684, 128.7294),         # Gyeongbuk
-    "Gangneung": (37.7519, 128.8761),      # Gangwon
-    "Sokcho": (38.2070, 128.5918),         # Gangwon
-    "Geoje": (34.8806, 128.6211),          # Gyeongnam
-    "Tongyeong": (34.8544, 128.4331),      # Gyeongnam
-    "Seosan": (36.7845, 126.4503),         # Chungnam
-    "Dangjin": (36.8895, 126.6455),        # Chungnam
-}
+from src.config import ADMIN_BOUNDARIES_PATH, DATA_DIR
 
-# Map sub-cities to their province for aggregation
+# Map sub-cities to their province for aggregation (used when the boundary
+# file has no province column)
 CITY_TO_PROVINCE = {
     "Seoul": "Seoul",
     "Busan": "Busan",
@@ -144,13 +93,57 @@ CITY_TO_PROVINCE = {
     "Jeju": "Jeju",
 }
 
-# Maximum distance (in degrees, ~approx) to assign a city
-# 0.3 degrees ~ 30 km — trips farther than this get "Other"
-MAX_ASSIGN_DISTANCE = 0.3
+# Label for points outside every boundary polygon
+OTHER = "Other"
+
+# Points located per STRtree batch
+ASSIGN_BATCH_SIZE = 1_000_000
+
+
+def load_boundaries(path: Path = ADMIN_BOUNDARIES_PATH) -> gpd.GeoDataFrame:
+    """Load administrative boundary polygons with city/province labels.
+
+    Args:
+        path: GeoPackage/GeoJSON with a `city` column (one or more polygons
+            per city) and an optional `province` column.
+
+    Returns:
+        GeoDataFrame in EPSG:4326 with city, province and geometry.
+    """
+    gdf = gpd.read_file(path)
+    if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+        gdf = gdf.to_crs(epsg=4326)
+    if "province" not in gdf.columns:
+        gdf["province"] = gdf["city"].map(CITY_TO_PROVINCE).fillna(OTHER)
+    gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty].reset_index(drop=True)
+    return gdf[["city", "province", "geometry"]]
+
+
+def locate_points(
+    tree: shapely.STRtree,
+    lat: np.ndarray,
+    lon: np.ndarray,
+    batch_size: int = ASSIGN_BATCH_SIZE,
+) -> np.ndarray:
+    """Index of the boundary polygon containing each point (-1 if none).
+
+    Points on a shared edge go to the lowest polygon index.
+    """
+    poly_idx = np.full(len(lat), -1, dtype=np.int64)
+    for start in range(0, len(lat), batch_size):
+        stop = min(start + batch_size, len(lat))
+        points = shapely.points(lon[start:stop], lat[start:stop])
+        point_i, tree_i = tree.query(points, predicate="intersects")
+        # Keep the first (lowest) polygon per point
+        order = np.lexsort((tree_i, point_i))
+        point_i, tree_i = point_i[order], tree_i[order]
+        first = np.unique(point_i, return_index=True)[1]
+        poly_idx[start + point_i[first]] = tree_i[first]
+    return poly_idx
 
 
 def assign_cities() -> dict:
-    """Assign city labels to valid trips using KD-tree nearest-neighbor.
+    """Assign start/end city labels to valid trips by point-in-polygon.
 
     Returns:
         Dictionary with assignment statistics.
@@ -164,48 +157,63 @@ def assign_cities() -> dict:
     print("  TASK 1.3: CITY ASSIGNMENT")
     print("=" * 70)
 
-    # Step 1: Build KD-tree from city centers
-    city_names = list(CITY_CENTERS.keys())
-    city_coords = np.array([CITY_CENTERS[c] for c in city_names])
-    tree = KDTree(city_coords)
+    # Step 1: Load boundary polygons and build the spatial index
+    boundaries = load_boundaries()
+    tree = shapely.STRtree(boundaries.geometry.values)
+
+    # Integer codes: polygon -> city, city -> province; OTHER is the last city
+    city_cat = pd.Categorical(boundaries["city"])
+    cities = list(city_cat.categories) + [OTHER]
+    poly_city = np.append(city_cat.codes, len(cities) - 1).astype(np.int32)
+    city_province = boundaries.groupby("city")["province"].first().reindex(cities[:-1])
+    provinces = sorted(set(city_province) | {OTHER})
+    province_of_city = np.array(
+        [provinces.index(p) for p in city_province] + [provinces.index(OTHER)], dtype=np.int32
+    )
 
-    print(f"\nCity centers loaded: {len(city_names)} cities")
+    print(f"\nBoundaries loaded: {len(boundaries)} polygons, {len(cities) - 1} cities")
 
-    # Step 2: Read start coordinates from valid trips
-    print("Reading start coordinates...")
+    # Step 2: Read start/end coordinates from valid trips
+    print("Reading start/end coordinates...")
     coords_df = con.execute(f"""
-        SELECT route_id, start_x, start_y
+        SELECT route_id, start_x, start_y, end_x, end_y
         FROM read_parquet('{valid_parquet}')
     """).fetchdf()
 
     total_trips = len(coords_df)
     print(f"Total valid trips: {total_trips:,}")
 
-    # Step 3: Query KD-tree for nearest city
-    print("Running nearest-neighbor assignment...")
-    query_points = coords_df[["start_x", "start_y"]].values
-    distances, indices = tree.query(query_points)
-
-    # Assign city and province
-    coords_df["city"] = [city_names[i] for i in indices]
-    coords_df["province"] = [CITY_TO_PROVINCE.get(city_names[i], "Other") for i in indices]
-    coords_df["city_distance_deg"] = distances
+    # Step 3: Vectorized point-in-polygon, label lookup by code
+    print("Running point-in-polygon assignment...")
+    labels = pd.DataFrame({"route_id": coords_df["route_id"].values})
+    for prefix, col_prefix in [("start", ""), ("end", "end_")]:
+        t0 = time.time()
+        poly_idx = locate_points(
+            tree, coords_df[f"{prefix}_x"].values, coords_df[f"{prefix}_y"].values
+        )
+        # -1 (outside every polygon) takes the trailing OTHER entry
+        city_code = np.take(poly_city, poly_idx)
+        labels[f"{col_prefix}city"] = pd.Categorical.from_codes(city_code, cities)
+        labels[f"{col_prefix}province"] = pd.Categorical.from_codes(
+            np.take(province_of_city, city_code), provinces
+        )
+        print(f"  {prefix} points located in {time.time() - t0:.1f}s")
 
-    # Mark trips too far from any known city center
-    far_mask = distances > MAX_ASSIGN_DISTANCE
-    coords_df.loc[far_mask, "city"] = "Other"
-    coords_df.loc[far_mask, "province"] = "Other"
-    far_count = far_mask.sum()
-    print(f"Trips assigned to 'Other' (>{MAX_ASSIGN_DISTANCE} deg from any city): {far_count:,} ({far_count/total_trips:.2%})")
+    outside_count = int((labels["city"] == OTHER).sum())
+    end_outside_count = int((labels["end_city"] == OTHER).sum())
+    cross_city_count = int((labels["city"] != labels["end_city"]).sum())
+    print(f"Trips starting outside all boundaries ('{OTHER}'): {outside_count:,} ({outside_count/total_trips:.2%})")
+    print(f"Trips ending outside all boundaries ('{OTHER}'): {end_outside_count:,} ({end_outside_count/total_trips:.2%})")
+    print(f"Trips ending in a different city: {cross_city_count:,} ({cross_city_count/total_trips:.2%})")
 
-    # Step 4: Register as DuckDB table and join back
+    # Step 4: Register as DuckDB table (categoricals become ENUMs) and join back
     print("Joining city labels with full dataset...")
-    con.register("city_labels", coords_df[["route_id", "city", "province", "city_distance_deg"]])
+    con.register("city_labels", labels)
 
     output_path = DATA_DIR / "routes_with_cities.parquet"
     con.execute(f"""
         COPY (
-            SELECT t.*, c.city, c.province, c.city_distance_deg
+            SELECT t.*, c.city, c.province, c.end_city, c.end_province
             FROM read_parquet('{valid_parquet}') t
             JOIN city_labels c ON t.route_id = c.route_id
         )
@@ -223,19 +231,25 @@ def assign_cities() -> dict:
     print("\n  Province distribution:")
     province_stats = con.execute(f"""
         SELECT province, COUNT(*) as cnt,
-               AVG(city_distance_deg) as avg_dist
+               AVG(CASE WHEN end_city <> city THEN 1 ELSE 0 END) as cross_city_share
         FROM read_parquet('{output_path}')
         GROUP BY province
         ORDER BY cnt DESC
     """).fetchdf()
 
-    stats = {"total_trips": total_trips, "far_trips": int(far_count), "provinces": {}}
+    stats = {
+        "total_trips": total_trips,
+        "outside_trips": outside_count,
+        "end_outside_trips": end_outside_count,
+        "cross_city_trips": cross_city_count,
+        "provinces": {},
+    }
     for _, row in province_stats.iterrows():
         prov = row["province"]
         cnt = row["cnt"]
         pct = cnt / total_trips * 100
-        avg_d = row["avg_dist"]
-        print(f"    {prov:<15}: {cnt:>10,} ({pct:>5.1f}%) avg_dist={avg_d:.4f} deg")
+        cross = row["cross_city_share"]
+        print(f"    {prov:<15}: {cnt:>10,} ({pct:>5.1f}%) cross_city={cross:.2%}")
         stats["provinces"][prov] = {"count": int(cnt), "pct": round(pct, 2)}
 
     # City-level stats
@@ -4,10 +4,14 @@ Task 3.3-3.4: Assign road class to GPS points using nearest-edge matching.
 Uses DuckDB regex to extract GPS coordinates from routes_raw (avoids slow
 ast.literal_eval), then scipy KDTree for vectorized nearest-edge lookup.
 Processes city-by-city, extracts highway tags, and computes per-trip
-road class composition.
+road class composition. The matched GPS points themselves are also kept as a
+compact point-level table (see road_class_points.py for the speed join).
 
 Outputs:
   - data_parquet/trip_road_classes.parquet -- trip-level road class features
+  - data_parquet/point_road_classes/{city}.parquet -- matched GPS points
+    (route_id, point_idx, t_offset_s, edge_id, road_class uint8, snap_dist_m),
+    sorted by route_id
   - data_parquet/modeling/road_class_assignment_report.json -- stats and diagnostics
 """
 
@@ -34,6 +38,7 @@ from src.config import (
     DATA_DIR,
     MODELING_DIR,
     OSM_NETWORKS_DIR,
+    POINT_ROAD_CLASSES_DIR,
     RANDOM_SEED,
 )
 
@@ -76,6 +81,16 @@ ROAD_CATEGORIES = [
     "residential", "unclassified", "service", "cycleway", "footway", "other",
 ]
 
+# uint8 road class codes for the point-level table (index into ROAD_CATEGORIES)
+ROAD_CLASS_CODES = {cat: np.uint8(i) for i, cat in enumerate(ROAD_CATEGORIES)}
+
+# Degrees -> meters (local equirectangular approximation) for snap distances
+M_PER_DEG_LAT = 110_540.0
+M_PER_DEG_LON_EQUATOR = 111_320.0
+
+# One GPS point entry in routes_raw: ['2023/05/01', '00:00:17.660', lat, lon]
+GPS_POINT_PATTERN = "'(\\d{4}/\\d{2}/\\d{2})',\\s*'([\\d:.]+)',\\s*(\\d+\\.\\d+),\\s*(\\d+\\.\\d+)"
+
 
 def load_city_edge_index(city: str) -> Optional[tuple[cKDTree, np.ndarray]]:
     """Load OSM edges for a city and build KDTree spatial index.
@@ -112,40 +127,55 @@ def load_city_edge_index(city: str) -> Optional[tuple[cKDTree, np.ndarray]]:
 
 
 def extract_gps_points_duckdb(city: str) -> pd.DataFrame:
-    """Extract flat (route_id, lat, lon) table using DuckDB regex.
+    """Extract flat (route_id, point_idx, t_offset_s, lat, lon) table using DuckDB regex.
 
-    Uses DuckDB regexp_extract_all + UNNEST to parse coordinates from
-    routes_raw strings, avoiding slow Python ast.literal_eval.
+    Uses DuckDB regexp_extract_all + UNNEST to parse points from routes_raw
+    strings, avoiding slow Python ast.literal_eval. t_offset_s is the point
+    time in seconds since the trip's first GPS point.
 
     Args:
         city: City name to filter trips.
 
     Returns:
-        DataFrame with columns [route_id, lat, lon].
+        DataFrame with columns [route_id, point_idx, t_offset_s, lat, lon].
     """
     con = duckdb.connect()
-    # Use regex to extract all "lat, lon" pairs from routes_raw
     # Format: [['date', 'time', 37.xxx, 126.xxx], ...]
     df = con.execute(f"""
         WITH raw AS (
             SELECT route_id,
-                   regexp_extract_all(
-                       routes_raw,
-                       '(\\d+\\.\\d+),\\s*(\\d+\\.\\d+)'
-                   ) as coords
+                   regexp_extract_all(routes_raw, $pattern) AS pts
             FROM read_parquet('{CLEANED_PARQUET}/trips_cleaned.parquet')
             WHERE is_valid = true AND city = '{city}'
         ),
         unnested AS (
             SELECT route_id,
-                   UNNEST(coords) as coord_str
+                   UNNEST(pts) AS pt,
+                   generate_subscripts(pts, 1) - 1 AS point_idx
             FROM raw
+        ),
+        parsed AS (
+            SELECT route_id, point_idx,
+                   regexp_extract(pt, $pattern, ['d', 'tm', 'lat', 'lon']) AS p
+            FROM unnested
+        ),
+        timed AS (
+            SELECT route_id, point_idx,
+                   epoch(try_strptime(
+                       p.d || ' ' || p.tm,
+                       ['%Y/%m/%d %H:%M:%S.%f', '%Y/%m/%d %H:%M:%S']
+                   )) AS ts,
+                   CAST(p.lat AS DOUBLE) AS lat,
+                   CAST(p.lon AS DOUBLE) AS lon
+            FROM parsed
         )
         SELECT route_id,
-               CAST(split_part(coord_str, ', ', 1) AS DOUBLE) as lat,
-               CAST(split_part(coord_str, ', ', 2) AS DOUBLE) as lon
-        FROM unnested
-    """).fetchdf()
+               CAST(point_idx AS USMALLINT) AS point_idx,
+               CAST(ts - min(ts) OVER (PARTITION BY route_id) AS FLOAT) AS t_offset_s,
+               lat, lon
+        FROM timed
+        ORDER BY route_id, point_idx
+    """, {"pattern": GPS_POINT_PATTERN}).fetchdf()
     con.close()
     return df
 
@@ -212,6 +242,42 @@ def compute_trip_road_features(
     return result
 
 
+def build_point_table(
+    points_df: pd.DataFrame,
+    tree: cKDTree,
+    idxs: np.ndarray,
+    road_class_arr: np.ndarray,
+) -> pd.DataFrame:
+    """Compact point-level match table for one city.
+
+    Args:
+        points_df: GPS points from extract_gps_points_duckdb (sorted by route_id).
+        tree: KDTree on edge midpoints (lon, lat) used for matching.
+        idxs: Matched edge index per point.
+        road_class_arr: Road class labels for each edge.
+
+    Returns:
+        DataFrame with route_id, point_idx, t_offset_s, edge_id (row index in
+        the city's OSM edges layer), road_class (uint8 code into
+        ROAD_CATEGORIES) and snap_dist_m (distance to the matched edge midpoint).
+    """
+    lat = points_df["lat"].values
+    lon = points_df["lon"].values
+    mid = tree.data[idxs]
+    dx = (lon - mid[:, 0]) * M_PER_DEG_LON_EQUATOR * np.cos(np.radians(lat))
+    dy = (lat - mid[:, 1]) * M_PER_DEG_LAT
+
+    class_codes = np.array([ROAD_CLASS_CODES[c] for c in road_class_arr], dtype=np.uint8)
+    return pd.DataFrame({
+        "route_id": points_df["route_id"].values,
+        "point_idx": points_df["point_idx"].values.astype(np.uint16),
+        "t_offset_s": points_df["t_offset_s"].values.astype(np.float32),
+        "edge_id": idxs.astype(np.uint32),
+        "road_class": class_codes[idxs],
+        "snap_dist_m": np.hypot(dx, dy).astype(np.float32),
+    })
+
+
 def process_city(
     city: str,
     tree: cKDTree,
@@ -219,6 +285,9 @@ def process_city(
 ) -> pd.DataFrame:
     """Process all valid trips in a city for road class assignment.
 
+    Also writes the city's point-level match table to
+    data_parquet/point_road_classes/{city}.parquet.
+
     Args:
         city: City name.
         tree: Pre-built KDTree for this city.
@@ -253,6 +322,16 @@ def process_city(
     )
     t_agg = time.time() - t2
 
+    # Persist point-level matches (already sorted by route_id, point_idx)
+    point_table = build_point_table(points_df, tree, idxs, road_class_arr)
+    POINT_ROAD_CLASSES_DIR.mkdir(parents=True, exist_ok=True)
+    point_table.to_parquet(
+        POINT_ROAD_CLASSES_DIR / f"{city}.parquet",
+        index=False,
+        compression="zstd",
+        row_group_size=1_000_000,
+    )
+
     print(f"    Extract: {t_extract:.1f}s | Match: {t_match:.1f}s | "
           f"Aggregate: {t_agg:.1f}s | "
           f"Points: {len(points_df):,} | Trips: {len(result):,}")
@@ -32,11 +32,11 @@ matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import statsmodels.api as sm
 from scipy.spatial import KDTree
 
 sys.path.insert(0, str(Path(__file__).parent))
 from config import DATA_DIR, FIGURES_DIR, MODELING_DIR, FIG_DPI, RANDOM_SEED
+from hdfe import hdfe_regression
 
 warnings.filterwarnings('ignore', category=FutureWarning)
 np.random.seed(RANDOM_SEED)
@@ -154,22 +154,17 @@ def run_twfe_did(
     df['post'] = (df['month_year'] == '2023-12').astype(int)
     df['post_x_tub'] = df['post'] * df[treatment_col]
 
-    city_dummies = pd.get_dummies(df['city'], prefix='city', drop_first=True, dtype=float)
-    month_dummies = pd.get_dummies(df['month_year'], prefix='month', drop_first=True, dtype=float)
-
-    X = pd.concat([df[['post_x_tub']], city_dummies, month_dummies], axis=1)
-    X = sm.add_constant(X)
-    y = df[outcome_col]
+    # City and month fixed effects absorbed (same estimates as the dummy-variable WLS)
     weights = np.sqrt(df[weight_col].astype(float))
-
-    model = sm.WLS(y, X, weights=weights).fit(
-        cov_type='cluster', cov_kwds={'groups': df['city']}
+    model = hdfe_regression(
+        df[outcome_col].values, df[['post_x_tub']], [df['city'].values, df['month_year'].values],
+        weights=weights.values, cluster=df['city'].values,
     )
 
-    beta = model.params['post_x_tub']
-    se = model.bse['post_x_tub']
-    pval = model.pvalues['post_x_tub']
-    ci = model.conf_int().loc['post_x_tub'].values
+    beta = model['params']['post_x_tub']
+    se = model['bse']['post_x_tub']
+    pval = model['pvalues']['post_x_tub']
+    ci = model['conf_int'].loc['post_x_tub'].values
 
     result = {
         'outcome': outcome_col,
@@ -181,12 +176,12 @@ def run_twfe_did(
         'effect_per_10pp': float(beta * 0.10),
         'n_obs': int(len(df)),
         'n_cities': int(df['city'].nunique()),
-        'r_squared': float(model.rsquared),
+        'r_squared': model['rsquared'],
         'significant_005': bool(pval < 0.05)
     }
 
     print(f"  {outcome_col}: beta={beta:.4f}, SE={se:.4f}, p={pval:.4f}, "
-          f"R2={model.rsquared:.3f}")
+          f"R2={model['rsquared']:.3f}")
     return result
 
 
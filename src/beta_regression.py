@@ -31,6 +31,7 @@ from src.config import (
     DATA_DIR, MODELING_DIR, REPORTS_DIR,
     RANDOM_SEED, SPEED_LIMIT_KR,
 )
+from src.compressed_logit import fit_compressed_logit
 
 np.random.seed(RANDOM_SEED)
 
@@ -43,6 +44,7 @@ def load_data() -> pd.DataFrame:
     df = con.execute("""
         SELECT
             m.route_id,
+            m.user_id,
             m.mode_clean as mode,
             m.age_group,
             m.time_of_day,
@@ -109,37 +111,41 @@ def prepare_features(df: pd.DataFrame) -> tuple[pd.DataFrame, list[str]]:
     return X, feature_names
 
 
-def run_part1_logistic(X: pd.DataFrame, y_binary: pd.Series) -> dict:
-    """Part 1: Logistic regression for P(any speeding)."""
+def run_part1_logistic(X: pd.DataFrame, y_binary: pd.Series, groups: pd.Series = None) -> dict:
+    """Part 1: Logistic regression for P(any speeding).
+
+    Fitted on all trips via covariate-cell compression (compressed_logit.py);
+    with user ids in groups the SEs are clustered by user.
+    """
     print("\n" + "="*60)
     print("PART 1: Logistic Regression - P(speeding > 0)")
     print("="*60)
 
-    # Use subsample for speed (full data is 2.5M)
-    n_sub = 200_000
-    idx = np.random.choice(len(X), size=n_sub, replace=False)
-    X_sub = X.iloc[idx]
-    y_sub = y_binary.iloc[idx]
+    print(f"  Full sample: {len(X):,} trips, speeding prevalence: {y_binary.mean()*100:.1f}%")
 
-    print(f"  Subsample: {n_sub:,} trips, speeding prevalence: {y_sub.mean()*100:.1f}%")
+    data = X.assign(_any_speeding=np.asarray(y_binary))
+    if groups is not None:
+        data["_cluster"] = np.asarray(groups)
+    result = fit_compressed_logit(
+        data, "_any_speeding", list(X.columns),
+        cluster="_cluster" if groups is not None else None,
+    )
 
-    model = sm.Logit(y_sub, X_sub)
-    result = model.fit(disp=0, maxiter=100, method="newton")
-
-    print(f"  Pseudo R2: {result.prsquared:.4f}")
-    print(f"  AIC: {result.aic:.0f}")
-    print(f"  Log-likelihood: {result.llf:.0f}")
+    print(f"  Covariate cells: {result['n_cells']:,}")
+    print(f"  Pseudo R2: {result['pseudo_r2']:.4f}")
+    print(f"  AIC: {result['aic']:.0f}")
+    print(f"  Log-likelihood: {result['llf']:.0f}")
 
     # Extract key coefficients as odds ratios
-    params = result.params
-    conf = result.conf_int()
-    pvals = result.pvalues
+    params = result["params"]
+    conf = result["conf_int"]
+    pvals = result["pvalues"]
 
     coef_df = pd.DataFrame({
         "coefficient": params,
         "OR": np.exp(params),
-        "OR_lower": np.exp(conf[0]),
-        "OR_upper": np.exp(conf[1]),
+        "OR_lower": np.exp(conf["lower"]),
+        "OR_upper": np.exp(conf["upper"]),
         "p_value": pvals,
         "significant": pvals < 0.05,
     })
@@ -154,10 +160,12 @@ def run_part1_logistic(X: pd.DataFrame, y_binary: pd.Series) -> dict:
         print(f"  {var}: OR={row['OR']:.3f} [{row['OR_lower']:.3f}, {row['OR_upper']:.3f}] {sig}")
 
     results = {
-        "n_obs": int(n_sub),
-        "pseudo_r2": float(result.prsquared),
-        "aic": float(result.aic),
-        "log_likelihood": float(result.llf),
+        "n_obs": result["nobs"],
+        "n_cells": result["n_cells"],
+        "cov_type": result["cov_type"],
+        "pseudo_r2": float(result["pseudo_r2"]),
+        "aic": float(result["aic"]),
+        "log_likelihood": float(result["llf"]),
         "coefficients": coef_df.to_dict("index"),
     }
 
@@ -252,7 +260,7 @@ def main() -> None:
     y_rate = df["speeding_rate_25"]
 
     # Part 1: Logistic
-    part1_results = run_part1_logistic(X, y_binary)
+    part1_results = run_part1_logistic(X, y_binary, groups=df["user_id"])
 
     # Part 2: Beta regression (conditional on speeding > 0)
     part2_results = run_part2_beta(X, y_rate, y_binary == 1)
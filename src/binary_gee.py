@@ -0,0 +1,194 @@
+"""
+GEE logistic regression with exchangeable within-user correlation, at scale.
+
+For a cluster (user) with n trips, Pearson residuals e = (y - mu) / sqrt(v)
+and scaled design rows x~ = sqrt(v) x (v = mu (1 - mu)), the exchangeable
+working correlation R = (1 - rho) I + rho 11' has the closed-form inverse
+
+  R^-1 = [I - c 11'] / (1 - rho),      c = rho / (1 + (n - 1) rho)
+
+so the cluster's score and Fisher information only need within-cluster sums:
+
+  U_i = [sum x~ e  - c (sum x~)(sum e)]   / (1 - rho)
+  H_i = [sum x~ x~' - c (sum x~)(sum x~)'] / (1 - rho)
+
+With trips sorted by user these are np.add.reduceat segment sums. The data
+are processed in blocks of about BLOCK_ROWS trips cut at user boundaries;
+each block returns the summed score, information, robust meat (sum U_i U_i')
+and the residual moments for rho, so a pass is one map-reduce over blocks
+(optionally on a process pool). Design rows can be given as a small table
+of distinct rows plus a row index per trip, so all-categorical models never
+hold the n x k design in memory.
+
+rho is the statsmodels Exchangeable moment estimator and variances are the
+statsmodels GEE robust (sandwich) and naive ones (binomial scale 1), so
+estimates agree with GEE(..., cov_struct=Exchangeable()) to its tolerance.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from scipy.special import expit
+
+BLOCK_ROWS = 1_000_000
+GEE_TOL = 1e-8
+GEE_MAX_ITER = 50
+
+
+def _block_bounds(codes: np.ndarray, block_rows: int) -> list:
+    """(start, stop) trip ranges of about block_rows rows, cut where the (sorted) cluster changes."""
+    n = len(codes)
+    cuts = [0]
+    while cuts[-1] < n:
+        stop = min(cuts[-1] + block_rows, n)
+        if stop < n:
+            # Move the cut forward to the first row of the next cluster
+            stop = int(np.searchsorted(codes, codes[stop - 1], side="right"))
+        cuts.append(stop)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def _block_stats(y, X, rows, codes, start, stop, beta, rho) -> tuple:
+    """Score, information, meat and rho moments of the clusters in one block."""
+    Xb = X[rows[start:stop]] if rows is not None else X[start:stop]
+    yb = y[start:stop]
+    c_codes = codes[start:stop]
+    first = np.flatnonzero(np.r_[True, c_codes[1:] != c_codes[:-1]])
+    sizes = np.diff(np.r_[first, len(c_codes)])
+
+    mu = expit(Xb @ beta)
+    sd = np.sqrt(mu * (1 - mu))
+    e = (yb - mu) / sd
+    xt = Xb * sd[:, None]
+
+    sum_x = np.add.reduceat(xt, first, axis=0)
+    sum_e = np.add.reduceat(e, first)
+    sum_xe = np.add.reduceat(xt * e[:, None], first, axis=0)
+    c = rho / (1 + (sizes - 1) * rho)
+
+    U = (sum_xe - (c * sum_e)[:, None] * sum_x) / (1 - rho)
+    H = (xt.T @ xt - (sum_x * c[:, None]).T @ sum_x) / (1 - rho)
+    ssr = float(e @ e)
+    pairs = float(np.sum(sum_e ** 2 - np.add.reduceat(e * e, first)) / 2)
+    return U.sum(axis=0), H, U.T @ U, ssr, pairs
+
+
+_WORKER = {}
+
+
+def _init_worker(y, X, rows, codes) -> None:
+    _WORKER.update(y=y, X=X, rows=rows, codes=codes)
+
+
+def _worker_block(start: int, stop: int, beta: np.ndarray, rho: float) -> tuple:
+    w = _WORKER
+    return _block_stats(w["y"], w["X"], w["rows"], w["codes"], start, stop, beta, rho)
+
+
+def exchangeable_gee(
+    y: np.ndarray,
+    X: np.ndarray,
+    groups: np.ndarray,
+    rows: Optional[np.ndarray] = None,
+    names: Optional[Sequence[str]] = None,
+    block_rows: int = BLOCK_ROWS,
+    n_jobs: int = 1,
+    tol: float = GEE_TOL,
+    max_iter: int = GEE_MAX_ITER,
+) -> dict:
+    """Binary logistic GEE with exchangeable within-cluster correlation.
+
+    Args:
+        y: 0/1 outcome per trip.
+        X: Design (constant included), one row per trip, or with rows a
+            table of distinct design rows.
+        groups: Cluster label per trip (e.g. user_id); need not be sorted.
+        rows: Optional index into X per trip.
+        names: Column names of X (default x0, x1, ...).
+        block_rows: Trips per block (blocks end at cluster boundaries).
+        n_jobs: Worker processes for the block passes (-1: all cores).
+        tol: Convergence tolerance on the coefficient step.
+        max_iter: Maximum Fisher scoring iterations.
+
+    Returns:
+        Dict with params, bse (robust), bse_naive, pvalues (normal, robust),
+        conf_int (lower/upper DataFrame), cov (robust), cov_naive, dep_param
+        (rho), nobs, n_clusters, n_blocks, n_iter and converged.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    k = X.shape[1]
+    names = list(names) if names is not None else [f"x{j}" for j in range(k)]
+    y = np.asarray(y, dtype=np.float64)
+    codes = pd.factorize(np.asarray(groups), sort=False)[0]
+    if rows is not None:
+        rows = np.asarray(rows)
+    if np.any(codes[1:] < codes[:-1]):
+        order = np.argsort(codes, kind="stable")
+        codes, y = codes[order], y[order]
+        if rows is not None:
+            rows = rows[order]
+        else:
+            X = X[order]
+    n = len(y)
+    sizes = np.bincount(codes)
+    n_clusters = len(sizes)
+    n_pairs = float(np.sum(sizes * (sizes - 1)) / 2)
+    blocks = _block_bounds(codes, block_rows)
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+
+    pool = None
+    if n_jobs > 1 and len(blocks) > 1:
+        pool = ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                   initargs=(y, X, rows, codes))
+
+    def one_pass(beta, rho):
+        if pool is None:
+            parts = [_block_stats(y, X, rows, codes, a, b, beta, rho) for a, b in blocks]
+        else:
+            parts = list(pool.map(_worker_block, *zip(*blocks),
+                                  [beta] * len(blocks), [rho] * len(blocks)))
+        return [sum(p[i] for p in parts) for i in range(5)]
+
+    try:
+        # Fisher scoring from the independence start; rho is updated from
+        # the residuals of the same pass, as statsmodels alternates them
+        beta, rho = np.zeros(k), 0.0
+        converged = False
+        for it in range(1, max_iter + 1):
+            score, H, _, ssr, pairs = one_pass(beta, rho)
+            step = np.linalg.solve(H, score)
+            beta = beta + step
+            scale = ssr / (n - k)
+            rho = pairs / scale / (n_pairs - k) if n_pairs > k else 0.0
+            if np.sqrt(np.sum(step ** 2)) < tol:
+                converged = True
+                break
+        _, H, meat, ssr, pairs = one_pass(beta, rho)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    bread = np.linalg.inv(H)
+    cov = bread @ meat @ bread
+    bse = np.sqrt(np.diag(cov))
+    z = stats.norm.ppf(0.975)
+    return {
+        "params": pd.Series(beta, index=names),
+        "bse": pd.Series(bse, index=names),
+        "bse_naive": pd.Series(np.sqrt(np.diag(bread)), index=names),
+        "pvalues": pd.Series(2 * stats.norm.sf(np.abs(beta / bse)), index=names),
+        "conf_int": pd.DataFrame({"lower": beta - z * bse, "upper": beta + z * bse}, index=names),
+        "cov": pd.DataFrame(cov, index=names, columns=names),
+        "cov_naive": pd.DataFrame(bread, index=names, columns=names),
+        "dep_param": float(rho),
+        "nobs": n,
+        "n_clusters": n_clusters,
+        "n_blocks": len(blocks),
+        "n_iter": it,
+        "converged": converged,
+    }
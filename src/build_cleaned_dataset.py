@@ -103,7 +103,8 @@ def build_cleaned_dataset() -> dict:
                 -- City labels
                 city,
                 province,
-                city_distance_deg,
+                end_city,
+                end_province,
 
                 -- Quality flags
                 flag_excluded_model,
@@ -211,7 +212,7 @@ def build_cleaned_dataset() -> dict:
             "start_lat", "start_lon", "end_lat", "end_lon",
             "gps_points", "distance", "moved_distance", "avg_point_gap", "max_point_gap",
             "avg_speed", "max_speed", "routes_raw", "speeds_raw",
-            "city", "province", "city_distance_deg",
+            "city", "province", "end_city", "end_province",
             "flag_excluded_model", "flag_sentinel", "flag_invalid_coords",
             "flag_few_points", "flag_implausible_speed",
             "flag_short_distance", "flag_short_duration", "flag_long_duration",
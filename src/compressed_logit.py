@@ -0,0 +1,241 @@
+"""
+Full-sample logistic regression on compressed sufficient statistics.
+
+With categorical (or otherwise few-valued) predictors the logistic
+likelihood depends on the data only through the number of trips and
+speeding trips in each distinct covariate cell. The trip table is collapsed
+in DuckDB to one row per cell with (successes, trials), and a binomial GLM
+is fitted on two rows per cell (outcome 1 weighted by successes, outcome 0
+by failures) with frequency weights. Its log-likelihood is the Bernoulli
+log-likelihood of the full data, so estimates, model-based SEs, AIC/BIC and
+McFadden's pseudo R2 equal those of a trip-level Logit fit.
+
+Sandwich variances need only cell quantities too:
+
+  robust:  meat = sum_c [s_c (1 - p_c)^2 + (n_c - s_c) p_c^2] x_c x_c'
+  cluster: g_u  = sum_c (s_uc - n_uc p_c) x_c      (per-user score sums)
+
+The per-user score sums are computed in SQL from a (user, cell) table of
+counts joined to the fitted cell probabilities, so no trip-level array is
+ever materialized. Variances follow statsmodels Logit (HC0 without a
+small-sample factor, cluster with its df correction).
+"""
+
+from typing import Optional, Sequence, Union
+
+import duckdb
+import numpy as np
+import pandas as pd
+import patsy
+import statsmodels.api as sm
+from scipy import stats
+from scipy.special import expit
+from statsmodels.genmod.families import Binomial
+
+MAXITER = 100
+
+
+def quote_ident(name: str) -> str:
+    """Double-quoted SQL identifier."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def register_trips(con: duckdb.DuckDBPyConnection, data: Union[pd.DataFrame, str],
+                   columns: Sequence[str]) -> tuple:
+    """Make the trip table queryable on con.
+
+    A DataFrame is copied once into the temporary table trips, with string
+    columns passed as categoricals (DuckDB scans them far faster as ENUMs);
+    a parquet path is read in place.
+
+    Returns:
+        (FROM expression, names of the columns converted from strings).
+    """
+    if not isinstance(data, pd.DataFrame):
+        return f"read_parquet('{data}')", []
+    trips = data[list(dict.fromkeys(columns))]
+    strings = [c for c in trips.columns
+               if trips[c].dtype == object or pd.api.types.is_string_dtype(trips[c].dtype)]
+    con.register("trips_df", trips.astype({c: "category" for c in strings}))
+    con.execute("CREATE OR REPLACE TEMP TABLE trips AS SELECT * FROM trips_df")
+    con.unregister("trips_df")
+    return "trips", strings
+
+
+def collapse_cells(
+    con: duckdb.DuckDBPyConnection,
+    source: str,
+    outcome: str,
+    covariates: Sequence[str],
+    cluster: Optional[str] = None,
+) -> pd.DataFrame:
+    """Collapse a trip table to covariate cells with (successes, trials).
+
+    Rows with a missing outcome, covariate or cluster label are dropped, as
+    formula-based statsmodels fits do. With a cluster column the (cluster,
+    cell) counts are kept in the temporary table user_cells for the
+    cluster-robust variance.
+
+    Args:
+        con: DuckDB connection.
+        source: Table name or FROM expression of the trip table.
+        outcome: Binary (0/1 or boolean) outcome column.
+        covariates: Columns defining the cells.
+        cluster: Optional cluster column (e.g. user_id).
+
+    Returns:
+        DataFrame of cells (covariates, successes, trials, cell), sorted by
+        covariates; cell is the row number.
+    """
+    keys = ", ".join(quote_ident(c) for c in covariates)
+    columns = [outcome, *covariates] + ([cluster] if cluster else [])
+    not_null = " AND ".join(f"{quote_ident(c)} IS NOT NULL" for c in columns)
+    y = f"CAST({quote_ident(outcome)} AS DOUBLE)"
+
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE cells AS
+        SELECT {keys}, SUM({y}) AS successes, COUNT(*) AS trials,
+               row_number() OVER (ORDER BY {keys}) - 1 AS cell
+        FROM {source}
+        WHERE {not_null}
+        GROUP BY {keys}
+    """)
+    if cluster:
+        # Integer cell ids keep the (user, cell) grouping and the score join cheap
+        con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE user_cells AS
+            SELECT t.{quote_ident(cluster)} AS cluster, c.cell,
+                   SUM({y}) AS successes, COUNT(*) AS trials
+            FROM {source} t JOIN cells c USING ({keys})
+            WHERE {not_null}
+            GROUP BY ALL
+        """)
+    cells = con.execute("SELECT * FROM cells ORDER BY cell").df()
+    cells["trials"] = cells["trials"].astype(np.float64)
+    return cells
+
+
+def _cluster_scores(con, X, p) -> np.ndarray:
+    """Per-user score sums (users x k), aggregated in SQL over user_cells."""
+    k = X.shape[1]
+    cell_params = pd.DataFrame(X, columns=[f"x{j}" for j in range(k)])
+    cell_params.insert(0, "p", p)
+    cell_params.insert(0, "cell", np.arange(len(X)))
+    con.register("cell_params", cell_params)
+    sums = ", ".join(f"SUM((u.successes - u.trials * c.p) * c.x{j})" for j in range(k))
+    scores = con.execute(f"""
+        SELECT {sums}
+        FROM user_cells u JOIN cell_params c USING (cell)
+        GROUP BY u.cluster
+    """).fetchnumpy()
+    con.unregister("cell_params")
+    return np.column_stack(list(scores.values())).astype(np.float64)
+
+
+def fit_compressed_logit(
+    data: Union[pd.DataFrame, str],
+    outcome: str,
+    covariates: Sequence[str],
+    formula: Optional[str] = None,
+    cluster: Optional[str] = None,
+    cov_type: Optional[str] = None,
+    maxiter: int = MAXITER,
+) -> dict:
+    """Logistic regression on the full trip table via covariate-cell compression.
+
+    Args:
+        data: Trip DataFrame, or path to a trip parquet file.
+        outcome: Binary outcome column.
+        covariates: Columns defining the cells. Without a formula they are
+            the design columns themselves (numeric, constant included).
+        formula: Optional patsy right-hand side (e.g. "C(mode, Treatment('STD'))
+            + ...") evaluated on the cell table; names match smf.logit.
+        cluster: Cluster column for cluster-robust SEs (e.g. user_id).
+        cov_type: 'cluster', 'HC0' or 'nonrobust'; default 'cluster'
+            when a cluster column is given, 'nonrobust' otherwise.
+        maxiter: Maximum IRLS iterations.
+
+    Returns:
+        Dict with params, bse, pvalues (normal), conf_int (lower/upper
+        DataFrame), cov, cov_type, nobs (trips), n_cells, n_clusters, llf,
+        llnull, pseudo_r2, aic, bic, converged and the GLM results object.
+    """
+    if cov_type is None:
+        cov_type = "cluster" if cluster else "nonrobust"
+    if cov_type == "cluster" and cluster is None:
+        raise ValueError("cov_type='cluster' needs a cluster column")
+
+    con = duckdb.connect()
+    columns = [outcome, *covariates] + ([cluster] if cluster else [])
+    source, strings = register_trips(con, data, columns)
+    cells = collapse_cells(con, source, outcome, covariates,
+                           cluster if cov_type == "cluster" else None)
+    for c in strings:
+        if c in cells:
+            cells[c] = cells[c].astype(object)
+
+    if formula is not None:
+        design = patsy.dmatrix(formula, cells, return_type="dataframe")
+    else:
+        design = cells[list(covariates)].astype(np.float64)
+    names = list(design.columns)
+    X = design.to_numpy()
+    s = cells["successes"].to_numpy()
+    n = cells["trials"].to_numpy()
+
+    # Two rows per cell: outcome 1 weighted by successes, outcome 0 by failures
+    freq = np.r_[s, n - s]
+    keep = freq > 0
+    glm = sm.GLM(
+        np.r_[np.ones(len(s)), np.zeros(len(s))][keep],
+        np.vstack([X, X])[keep],
+        family=Binomial(),
+        freq_weights=freq[keep],
+    ).fit(maxiter=maxiter)
+    beta = np.asarray(glm.params)
+    p = expit(X @ beta)
+
+    nobs = float(n.sum())
+    k = int(np.linalg.matrix_rank(X))
+    bread = np.linalg.pinv((X * (n * p * (1 - p))[:, None]).T @ X)
+    n_clusters = None
+    if cov_type == "nonrobust":
+        cov = bread
+    elif cov_type == "HC0":
+        meat = (X * (s * (1 - p) ** 2 + (n - s) * p ** 2)[:, None]).T @ X
+        cov = bread @ meat @ bread
+    elif cov_type == "cluster":
+        g_scores = _cluster_scores(con, X, p)
+        n_clusters = len(g_scores)
+        factor = n_clusters / (n_clusters - 1) * (nobs - 1) / (nobs - k)
+        cov = factor * bread @ (g_scores.T @ g_scores) @ bread
+    else:
+        raise ValueError(f"unknown cov_type {cov_type!r}")
+    con.close()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        llf = float(np.sum(np.where(s > 0, s * np.log(p), 0.0)
+                           + np.where(n > s, (n - s) * np.log1p(-p), 0.0)))
+    p_bar = s.sum() / nobs
+    llnull = float(s.sum() * np.log(p_bar) + (nobs - s.sum()) * np.log1p(-p_bar))
+
+    bse = np.sqrt(np.diag(cov))
+    z = stats.norm.ppf(0.975)
+    return {
+        "params": pd.Series(beta, index=names),
+        "bse": pd.Series(bse, index=names),
+        "pvalues": pd.Series(2 * stats.norm.sf(np.abs(beta / bse)), index=names),
+        "conf_int": pd.DataFrame({"lower": beta - z * bse, "upper": beta + z * bse}, index=names),
+        "cov": pd.DataFrame(cov, index=names, columns=names),
+        "cov_type": cov_type,
+        "nobs": int(nobs),
+        "n_cells": len(cells),
+        "n_clusters": n_clusters,
+        "llf": llf,
+        "llnull": llnull,
+        "pseudo_r2": 1 - llf / llnull,
+        "aic": -2 * llf + 2 * k,
+        "bic": -2 * llf + k * np.log(nobs),
+        "converged": bool(getattr(glm, "converged", True)),
+        "glm": glm,
+    }
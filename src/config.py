@@ -18,9 +18,11 @@ SCOOTER_CSV = RAW_DIR / "2023_Swing_Scooter.csv"        # ~20M rows, trip-level
 # --- Processed data outputs ---
 CLEANED_PARQUET = DATA_DIR / "cleaned"
 TRIP_INDICATORS_PARQUET = DATA_DIR / "trip_indicators.parquet"
-SEGMENT_INDICATORS_PARQUET = DATA_DIR / "segment_indicators.parquet"
+SEGMENT_INDICATORS_PARQUET = DATA_DIR / "segment_indicators.parquet"  # hive dataset, city=<name>/
+POINT_ROAD_CLASSES_DIR = DATA_DIR / "point_road_classes"  # per-city matched GPS points
 USER_INDICATORS_PARQUET = DATA_DIR / "user_indicators.parquet"
 OSM_NETWORKS_DIR = DATA_DIR / "osm_networks"
+ADMIN_BOUNDARIES_PATH = DATA_DIR / "admin_boundaries.gpkg"  # city polygons (city, province)
 MODELING_DIR = DATA_DIR / "modeling"
 
 # --- Constants ---
@@ -43,6 +45,7 @@ EXCLUDE_MODELS = ["I9"]     # I9 has implausible speeds (mean max ~83 km/h)
 
 # --- Spatial analysis ---
 H3_RESOLUTION = 8           # ~250m hexagons
+H3_CUBE_RESOLUTIONS = [6, 7, 8, 9, 10]  # resolutions stored in the hex cube
 
 # --- Figure settings ---
 FIG_DPI = 300
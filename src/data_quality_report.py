@@ -18,7 +18,7 @@ import sys
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from src.config import DATA_DIR, REPORTS_DIR, SPEED_LIMIT_KR, MAX_PLAUSIBLE_SPEED, MIN_TRIP_POINTS
+from src.config import ADMIN_BOUNDARIES_PATH, DATA_DIR, REPORTS_DIR, SPEED_LIMIT_KR, MAX_PLAUSIBLE_SPEED, MIN_TRIP_POINTS
 
 
 def generate_report() -> None:
@@ -100,12 +100,13 @@ The following exclusion criteria were applied:
     report += f"""
 ## 3. City Assignment
 
-Trips were assigned to Korean administrative provinces using a KD-tree nearest-neighbor
-approach based on start coordinates. {len(city_stats['cities'])} sub-city centers were
-defined across {len(city_stats['provinces'])} provinces.
+Trips were assigned to Korean cities and provinces by point-in-polygon tests of their
+start and end coordinates against administrative boundary polygons
+(`{ADMIN_BOUNDARIES_PATH.name}`, indexed with an STRtree). Trips fall in
+{len(city_stats['provinces'])} provinces; the assignment report lists the {len(city_stats['cities'])} largest cities.
 
-- Maximum assignment distance: 0.3 degrees (~30 km)
-- Trips beyond threshold assigned to "Other": {city_stats['far_trips']:,} ({city_stats['far_trips']/city_stats['total_trips']:.2%})
+- Trips starting outside every boundary polygon ("Other"): {city_stats['outside_trips']:,} ({city_stats['outside_trips']/city_stats['total_trips']:.2%})
+- Trips ending outside every boundary polygon: {city_stats['end_outside_trips']:,} ({city_stats['end_outside_trips']/city_stats['total_trips']:.2%})
 
 ### Provincial Distribution
 
@@ -16,6 +16,7 @@ Models:
 2. Two-way fixed effects (TWFE) panel DiD
 3. Event study with monthly leads/lags
 4. Continuous treatment intensity (dose-response)
+5. Trip-level TWFE with user, city and month FE (absorbed, see hdfe.py)
 
 Output:
 - data_parquet/modeling/did_results.json
@@ -39,10 +40,15 @@ from scipy import stats
 
 sys.path.insert(0, str(Path(__file__).parent))
 from config import DATA_DIR, FIGURES_DIR, MODELING_DIR, FIG_DPI, RANDOM_SEED
+from did_feasibility import assign_cities_fast
+from hdfe import hdfe_regression
+from wild_bootstrap import wild_cluster_bootstrap
 
 warnings.filterwarnings('ignore', category=FutureWarning)
 np.random.seed(RANDOM_SEED)
 
+ROUTES_PATH = str(DATA_DIR / 'all_months' / 'routes_all.parquet').replace('\\', '/')
+
 
 def build_panel() -> pd.DataFrame:
     """Build city-month panel with treatment variables."""
@@ -142,10 +148,15 @@ def model_1_cross_sectional(panel: pd.DataFrame) -> dict:
     return result, cs
 
 
-def model_2_twfe(panel: pd.DataFrame) -> dict:
+def model_2_twfe(panel: pd.DataFrame, wild_bootstrap: bool = False) -> dict:
     """Model 2: Two-Way Fixed Effects panel DiD.
 
     Speeding_ct = alpha_c + gamma_t + beta * (Post_t x TUB_share_c) + epsilon_ct
+
+    Args:
+        panel: City-month panel.
+        wild_bootstrap: Also report wild cluster bootstrap (city clusters)
+            p-value and test-inversion CI for beta.
     """
     print("\n--- Model 2: Two-Way Fixed Effects DiD ---")
 
@@ -179,6 +190,21 @@ def model_2_twfe(panel: pd.DataFrame) -> dict:
     }
     print(f"  beta(Post x TUB_share) = {coef:.4f} (SE={se:.4f}, p={pval:.2e})")
     print(f"  95% CI: [{ci_lo:.4f}, {ci_hi:.4f}]")
+    if wild_bootstrap:
+        j = list(model.params.index).index('treatment_intensity')
+        cities = panel.loc[model.model.data.row_labels, 'city'].values
+        wcb = wild_cluster_bootstrap(model.model.endog, model.model.exog, cities,
+                                     params=[j], weights=model.model.weights)
+        result['wild_cluster_bootstrap'] = {
+            'se_cluster': wcb[j]['se'],
+            'pvalue': wcb[j]['pvalue'],
+            'ci_95': wcb[j]['ci'],
+            'n_boot': wcb['n_boot'],
+            'n_clusters': wcb['n_clusters'],
+            'weight_type': wcb['weight_type'],
+        }
+        print(f"  Wild cluster bootstrap ({wcb['n_clusters']} cities, {wcb['weight_type']}): "
+              f"p={wcb[j]['pvalue']:.4f}, 95% CI [{wcb[j]['ci'][0]:.4f}, {wcb[j]['ci'][1]:.4f}]")
     print(f"  R2 = {model.rsquared:.3f}")
     print(f"  {result['interpretation']}")
     return result
@@ -342,6 +368,65 @@ def model_4_dose_response(panel: pd.DataFrame) -> dict:
     return result, cs
 
 
+def model_5_trip_level_twfe(panel: pd.DataFrame) -> dict:
+    """Model 5: Trip-level TWFE DiD with rider fixed effects.
+
+    is_speeding_ict = alpha_i + delta_c + gamma_t + beta * (Post_t x TUB_share_c) + epsilon_ict
+
+    The user, city and month fixed effects are absorbed by alternating
+    projections instead of dummies, so the regression runs on every trip;
+    beta is then identified from within-rider changes. SEs are clustered by city.
+    """
+    print("\n--- Model 5: Trip-Level TWFE with User FE ---")
+
+    con = duckdb.connect()
+    trips = con.execute(f"""
+        SELECT user_id, start_lat, start_lon, month_year,
+               CAST(is_speeding AS DOUBLE) AS is_speeding
+        FROM read_parquet('{ROUTES_PATH}', hive_partitioning=false)
+        WHERE is_valid = true
+          AND has_speed_data = true
+          AND month_year >= '2023-02' AND month_year <= '2023-12'
+          AND mode NOT IN ('none', 'BIKE_STD', 'BIKE_TUB')
+          AND user_id IS NOT NULL
+    """).fetchdf()
+    con.close()
+
+    trips = assign_cities_fast(trips)
+    pre_tub = panel.drop_duplicates('city').set_index('city')['pre_tub_share']
+    trips['pre_tub_share'] = trips['city'].map(pre_tub)
+    trips = trips.dropna(subset=['pre_tub_share', 'is_speeding'])
+    trips['treatment_intensity'] = (trips['month_year'] == '2023-12') * trips['pre_tub_share']
+    print(f"  {len(trips):,} trips, {trips['user_id'].nunique():,} users, "
+          f"{trips['city'].nunique()} cities")
+
+    model = hdfe_regression(
+        trips['is_speeding'].values, trips[['treatment_intensity']],
+        [trips['user_id'].values, trips['city'].values, trips['month_year'].values],
+        cluster=trips['city'].values, dtype=np.float32,
+    )
+    coef = float(model['params']['treatment_intensity'])
+    se = float(model['bse']['treatment_intensity'])
+    pval = float(model['pvalues']['treatment_intensity'])
+    ci_lo, ci_hi = model['conf_int'].loc['treatment_intensity']
+
+    result = {
+        'beta_treatment': coef,
+        'se': se,
+        'pvalue': pval,
+        'ci_95': [float(ci_lo), float(ci_hi)],
+        'r_squared_within': model['rsquared_within'],
+        'n_obs': int(model['nobs']),
+        'n_users': int(trips['user_id'].nunique()),
+        'n_clusters': model['n_clusters'],
+        'demeaning_sweeps': model['sweeps'],
+        'converged': model['converged'],
+    }
+    print(f"  beta(Post x TUB_share) = {coef:.4f} (SE={se:.4f}, p={pval:.2e})")
+    print(f"  95% CI: [{ci_lo:.4f}, {ci_hi:.4f}]")
+    return result
+
+
 def generate_figures(panel: pd.DataFrame, cs_data: pd.DataFrame,
                      es_results: dict) -> None:
     """Generate publication-quality DiD figures."""
@@ -506,9 +591,10 @@ def main() -> dict:
 
     # Run models
     m1_result, cs_data = model_1_cross_sectional(panel)
-    m2_result = model_2_twfe(panel)
+    m2_result = model_2_twfe(panel, wild_bootstrap=True)
     m3_result, es_results = model_3_event_study(panel)
     m4_result, cs_dose = model_4_dose_response(panel)
+    m5_result = model_5_trip_level_twfe(panel)
 
     # Generate figures
     generate_figures(panel, cs_data, es_results)
@@ -571,6 +657,7 @@ def main() -> dict:
         'model_2_twfe': m2_result,
         'model_3_event_study': m3_result,
         'model_4_dose_response': m4_result,
+        'model_5_trip_level_twfe': m5_result,
         'panel_stats': {
             'n_cities': int(panel['city'].nunique()),
             'n_months': int(panel['month_year'].nunique()),
@@ -591,6 +678,8 @@ def main() -> dict:
     print(f"    {m3_result['interpretation']}")
     print(f"  Model 4 (Dose-Response): R2={m4_result['r_squared']:.3f}")
     print(f"    {m4_result['interpretation']}")
+    print(f"  Model 5 (Trip-level TWFE, user FE): beta={m5_result['beta_treatment']:.4f} "
+          f"(SE={m5_result['se']:.4f}, n={m5_result['n_obs']:,})")
 
     # Save
     output_path = MODELING_DIR / 'did_results.json'
@@ -31,6 +31,8 @@ from scipy import stats
 
 sys.path.insert(0, str(Path(__file__).parent))
 from config import DATA_DIR, FIGURES_DIR, MODELING_DIR, FIG_DPI, RANDOM_SEED
+from resampling import index_blocks, percentile_interval
+from wild_bootstrap import wild_cluster_bootstrap
 
 warnings.filterwarnings('ignore', category=FutureWarning)
 np.random.seed(RANDOM_SEED)
@@ -95,12 +97,14 @@ def report_panel_dimensions(panel: pd.DataFrame) -> dict:
     }
 
 
-def twfe_cluster_robust(panel: pd.DataFrame) -> dict:
+def twfe_cluster_robust(panel: pd.DataFrame, wild_bootstrap: bool = False) -> dict:
     """TWFE DiD with cluster-robust SEs at city level (Arellano 1987).
 
     Addresses reviewer concern: HC1 corrects heteroscedasticity but not
     within-city serial correlation. With 11 periods per city, clustering
-    is more appropriate.
+    is more appropriate. With wild_bootstrap, the wild cluster restricted
+    bootstrap p-value and test-inversion CI are added, since cluster-robust
+    t-tests over-reject with few clusters.
     """
     print("\n--- TWFE with Cluster-Robust SEs ---")
 
@@ -152,7 +156,7 @@ def twfe_cluster_robust(panel: pd.DataFrame) -> dict:
     print(f"  SE ratio (cluster/HC1): {se_cluster/se_hc1:.2f}")
     print(f"  Cluster 95% CI: [{ci_cluster[1, 0]:.4f}, {ci_cluster[1, 1]:.4f}]")
 
-    return {
+    result = {
         'hc1': {
             'beta': beta_hc1, 'se': se_hc1, 'pvalue': pval_hc1,
         },
@@ -162,6 +166,18 @@ def twfe_cluster_robust(panel: pd.DataFrame) -> dict:
         },
         'se_ratio': se_cluster / se_hc1,
     }
+    if wild_bootstrap:
+        wcb = wild_cluster_bootstrap(y_clean, X_clean, groups_clean, params=[1], weights=w_clean)
+        result['wild_cluster_bootstrap'] = {
+            'pvalue': wcb[1]['pvalue'],
+            'ci_95': wcb[1]['ci'],
+            'n_boot': wcb['n_boot'],
+            'n_clusters': wcb['n_clusters'],
+            'weight_type': wcb['weight_type'],
+        }
+        print(f"  Wild cluster bootstrap ({wcb['weight_type']}, B={wcb['n_boot']}): "
+              f"p={wcb[1]['pvalue']:.4f}, 95% CI [{wcb[1]['ci'][0]:.4f}, {wcb[1]['ci'][1]:.4f}]")
+    return result
 
 
 def event_study_nov_reference(panel: pd.DataFrame) -> dict:
@@ -381,6 +397,28 @@ def event_study_detrended(panel: pd.DataFrame) -> dict:
     }, es_results
 
 
+def _dose_response_batch(x: np.ndarray, y: np.ndarray, w: np.ndarray,
+                         idx: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Pearson r and weighted (WLS) slope of y on x for every row of resample indices idx.
+
+    Closed form per replicate: r = cov(x, y) / sqrt(var(x) var(y)) and
+    slope = sum w (x - xw)(y - yw) / sum w (x - xw)^2 with weighted means xw, yw,
+    which equals the sm.WLS(y, [1, x], weights=w) slope. Degenerate replicates
+    (constant x or y) give NaN.
+    """
+    xb, yb, wb = x[idx], y[idx], w[idx]
+    dx = xb - xb.mean(axis=1, keepdims=True)
+    dy = yb - yb.mean(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = (dx * dy).sum(axis=1) / np.sqrt((dx * dx).sum(axis=1) * (dy * dy).sum(axis=1))
+        sw = wb.sum(axis=1, keepdims=True)
+        dxw = xb - (wb * xb).sum(axis=1, keepdims=True) / sw
+        dyw = yb - (wb * yb).sum(axis=1, keepdims=True) / sw
+        sxx = (wb * dxw * dxw).sum(axis=1)
+        slope = np.where(sxx > 0, (wb * dxw * dyw).sum(axis=1) / sxx, np.nan)
+    return r, slope
+
+
 def bootstrap_dose_response_ci(panel: pd.DataFrame,
                                 n_bootstrap: int = 10000) -> dict:
     """Bootstrap 95% CI for dose-response correlation and slope.
@@ -420,31 +458,15 @@ def bootstrap_dose_response_ci(panel: pd.DataFrame,
     r_lo_fisher = np.tanh(z_lo)
     r_hi_fisher = np.tanh(z_hi)
 
-    # Bootstrap CIs for both r and slope
-    rng = np.random.RandomState(RANDOM_SEED)
-    boot_r = np.zeros(n_bootstrap)
-    boot_slope = np.zeros(n_bootstrap)
-
-    n = len(cs)
-    for b in range(n_bootstrap):
-        idx = rng.choice(n, size=n, replace=True)
-        boot_cs = cs.iloc[idx]
-        boot_r[b] = stats.pearsonr(
-            boot_cs['tub_reduction'], boot_cs['speeding_reduction']
-        )[0]
-        X_b = sm.add_constant(boot_cs['tub_reduction'])
-        w_b = np.sqrt(boot_cs['nov_trips'])
-        try:
-            m_b = sm.WLS(boot_cs['speeding_reduction'], X_b, weights=w_b).fit()
-            boot_slope[b] = float(m_b.params.iloc[1])
-        except Exception:
-            boot_slope[b] = np.nan
-
-    boot_slope = boot_slope[~np.isnan(boot_slope)]
-    r_lo_boot = np.percentile(boot_r, 2.5)
-    r_hi_boot = np.percentile(boot_r, 97.5)
-    slope_lo = np.percentile(boot_slope, 2.5)
-    slope_hi = np.percentile(boot_slope, 97.5)
+    # Bootstrap CIs for both r and slope (cities resampled with replacement),
+    # all replicates of an index block at once
+    x = cs['tub_reduction'].to_numpy(dtype=np.float64)
+    y = cs['speeding_reduction'].to_numpy(dtype=np.float64)
+    boot = np.empty((n_bootstrap, 2))
+    for start, idx in index_blocks(len(cs), n_bootstrap, seed=RANDOM_SEED):
+        boot[start:start + len(idx), 0], boot[start:start + len(idx), 1] = _dose_response_batch(
+            x, y, w.to_numpy(dtype=np.float64), idx)
+    (r_lo_boot, slope_lo), (r_hi_boot, slope_hi) = percentile_interval(boot)
 
     print(f"  r = {r_point:.3f} (p = {p_point:.2e})")
     print(f"  Fisher z 95% CI:    [{r_lo_fisher:.3f}, {r_hi_fisher:.3f}]")
@@ -654,7 +676,7 @@ def main() -> dict:
     dim_report = report_panel_dimensions(panel)
 
     # 2. Cluster-robust TWFE
-    twfe_cluster = twfe_cluster_robust(panel)
+    twfe_cluster = twfe_cluster_robust(panel, wild_bootstrap=True)
 
     # 3. Event study with Nov reference + joint F-test
     es_nov_result, es_nov_coefs = event_study_nov_reference(panel)
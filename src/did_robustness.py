@@ -22,6 +22,7 @@ import statsmodels.api as sm
 
 sys.path.insert(0, str(Path(__file__).parent))
 from config import DATA_DIR, FIGURES_DIR, MODELING_DIR, FIG_DPI, RANDOM_SEED
+from wild_bootstrap import wild_cluster_bootstrap
 
 warnings.filterwarnings('ignore', category=FutureWarning)
 np.random.seed(RANDOM_SEED)
@@ -53,8 +54,12 @@ def load_panel() -> pd.DataFrame:
     return panel
 
 
-def robustness_1_restricted_window(panel: pd.DataFrame) -> dict:
-    """Event study with restricted window (Apr-Dec) to address pre-trends."""
+def robustness_1_restricted_window(panel: pd.DataFrame, wild_bootstrap: bool = False) -> dict:
+    """Event study with restricted window (Apr-Dec) to address pre-trends.
+
+    With wild_bootstrap, every event coefficient also gets a wild cluster
+    bootstrap (city clusters) p-value and CI, used for the pre-trend check.
+    """
     print("\n--- Robustness 1: Restricted Event Window (Apr-Dec) ---")
 
     month_map = {
@@ -98,8 +103,11 @@ def robustness_1_restricted_window(panel: pd.DataFrame) -> dict:
     # Clean NaN/inf
     mask = np.isfinite(X).all(axis=1) & np.isfinite(y) & np.isfinite(weights)
     X, y, weights = X[mask], y[mask], weights[mask]
+    cities = restricted['city'].values[mask]
 
     model = sm.WLS(y, X, weights=weights).fit(cov_type='HC1')
+    if wild_bootstrap:
+        wcb = wild_cluster_bootstrap(y, X, cities, params=range(1, 1 + len(evt_names)), weights=weights)
 
     # Extract coefficients
     es_results = {}
@@ -113,9 +121,13 @@ def robustness_1_restricted_window(panel: pd.DataFrame) -> dict:
             'ci_lo': float(ci[idx, 0]),
             'ci_hi': float(ci[idx, 1]),
         }
+        if wild_bootstrap:
+            es_results[k]['wcb_pvalue'] = wcb[idx]['pvalue']
+            es_results[k]['wcb_ci'] = wcb[idx]['ci']
 
     # Check pre-trends (k < 0 only)
-    pre_pvals = [v['pvalue'] for k, v in es_results.items() if k < 0]
+    pvalue_key = 'wcb_pvalue' if wild_bootstrap else 'pvalue'
+    pre_pvals = [v[pvalue_key] for k, v in es_results.items() if k < 0]
     pre_trend_pass = not any(p < 0.05 for p in pre_pvals)
 
     print("  Restricted event study (Apr-Dec, ref=Oct):")
@@ -123,7 +135,8 @@ def robustness_1_restricted_window(panel: pd.DataFrame) -> dict:
         v = es_results[k]
         sig = '***' if v['pvalue'] < 0.001 else '**' if v['pvalue'] < 0.01 else '*' if v['pvalue'] < 0.05 else ''
         label = ' <-- POST' if k > 0 else ''
-        print(f"    k={k:+2d}: {v['coef']:+.4f} (SE={v['se']:.4f}, p={v['pvalue']:.4f}) {sig}{label}")
+        wcb_p = f", WCB p={v['wcb_pvalue']:.4f}" if wild_bootstrap else ''
+        print(f"    k={k:+2d}: {v['coef']:+.4f} (SE={v['se']:.4f}, p={v['pvalue']:.4f}{wcb_p}) {sig}{label}")
     print(f"  Pre-trends PASS? {pre_trend_pass}")
 
     result = {
@@ -131,14 +144,19 @@ def robustness_1_restricted_window(panel: pd.DataFrame) -> dict:
         'n_obs': int(X.shape[0]),
         'event_study_coefs': {str(k): v for k, v in es_results.items()},
         'pre_trend_pass': pre_trend_pass,
+        'pre_trend_inference': 'wild_cluster_bootstrap' if wild_bootstrap else 'HC1',
         'post_coef_k1': es_results.get(1, {}),
         'post_coef_k2': es_results.get(2, {}),
     }
     return result, es_results
 
 
-def robustness_2_placebo(panel: pd.DataFrame) -> dict:
-    """Placebo test: use September 2023 as fake treatment month."""
+def robustness_2_placebo(panel: pd.DataFrame, wild_bootstrap: bool = False) -> dict:
+    """Placebo test: use September 2023 as fake treatment month.
+
+    With wild_bootstrap, the pass/fail decision uses the wild cluster
+    bootstrap p-value (city clusters) instead of HC1.
+    """
     print("\n--- Robustness 2: Placebo Test (Sep 2023 as fake treatment) ---")
 
     # Use Apr-Aug as pre-period, Sep as "treatment"
@@ -167,6 +185,7 @@ def robustness_2_placebo(panel: pd.DataFrame) -> dict:
 
     mask = np.isfinite(X).all(axis=1) & np.isfinite(y) & np.isfinite(weights)
     X, y, weights = X[mask], y[mask], weights[mask]
+    cities = placebo['city'].values[mask]
 
     model = sm.WLS(y, X, weights=weights).fit(cov_type='HC1')
 
@@ -177,8 +196,6 @@ def robustness_2_placebo(panel: pd.DataFrame) -> dict:
 
     print(f"  Placebo (Sep 2023): beta = {beta:.4f} (SE={se:.4f}, p={pval:.4f})")
     print(f"  95% CI: [{ci[1, 0]:.4f}, {ci[1, 1]:.4f}]")
-    print(f"  Significant at 5%? {'YES (FAIL)' if pval < 0.05 else 'NO (PASS)'}")
-
     result = {
         'fake_treatment_month': '2023-09',
         'beta_placebo': beta,
@@ -187,6 +204,14 @@ def robustness_2_placebo(panel: pd.DataFrame) -> dict:
         'ci_95': [float(ci[1, 0]), float(ci[1, 1])],
         'passes': pval >= 0.05,
     }
+    if wild_bootstrap:
+        wcb = wild_cluster_bootstrap(y, X, cities, params=[1], weights=weights)
+        result['wcb_pvalue'] = wcb[1]['pvalue']
+        result['wcb_ci_95'] = wcb[1]['ci']
+        result['passes'] = wcb[1]['pvalue'] >= 0.05
+        print(f"  Wild cluster bootstrap: p={wcb[1]['pvalue']:.4f}, "
+              f"95% CI [{wcb[1]['ci'][0]:.4f}, {wcb[1]['ci'][1]:.4f}]")
+    print(f"  Significant at 5%? {'NO (PASS)' if result['passes'] else 'YES (FAIL)'}")
     return result
 
 
@@ -375,8 +400,8 @@ def main() -> dict:
 
     panel = load_panel()
 
-    r1_result, restricted_es = robustness_1_restricted_window(panel)
-    r2_result = robustness_2_placebo(panel)
+    r1_result, restricted_es = robustness_1_restricted_window(panel, wild_bootstrap=True)
+    r2_result = robustness_2_placebo(panel, wild_bootstrap=True)
     r3_result = robustness_3_heterogeneity(panel)
 
     generate_robustness_figures(restricted_es, r2_result, r3_result)
@@ -394,7 +419,7 @@ def main() -> dict:
     print(f"  1. Restricted window (Apr-Dec): Pre-trends PASS? {r1_result['pre_trend_pass']}")
     print(f"     Dec coefficient: {r1_result['post_coef_k2'].get('coef', 'N/A'):.4f}")
     print(f"  2. Placebo test (Sep 2023): beta={r2_result['beta_placebo']:.4f}, "
-          f"p={r2_result['pvalue']:.4f} -> {'PASS' if r2_result['passes'] else 'FAIL'}")
+          f"p={r2_result.get('wcb_pvalue', r2_result['pvalue']):.4f} -> {'PASS' if r2_result['passes'] else 'FAIL'}")
     print(f"  3. Heterogeneity: effects present in all quartiles")
 
     output_path = MODELING_DIR / 'did_robustness_results.json'
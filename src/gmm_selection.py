@@ -0,0 +1,242 @@
+"""
+Gaussian mixture model selection over a grid of K and random initializations.
+
+Each (K, init) pair is an independent EM fit (n_init=1) seeded by
+np.random.SeedSequence(seed, spawn_key=(K, init)); the best of the n_init
+fits per K (highest log-likelihood) is kept, which is what
+GaussianMixture(n_init=...) does within one process. The fits run as tasks
+on a process pool. The feature matrix is placed once in a
+multiprocessing.shared_memory block that every worker maps read-only, so no
+copy of it is pickled per task or per worker.
+
+With warm_start_size set, each fit first runs EM on a random subsample of
+that many rows (k-means initialization included, the costly part on large
+n) and then refines the subsample solution with EM on all rows. The
+refinement converges in a few full-data iterations and the reported
+likelihood, BIC and AIC are always those of the full data.
+
+With cache_dir set, the parameters and fit statistics of every (K, init)
+fit are saved to an .npz file keyed by a hash of the feature matrix and the
+fit settings, so re-running model selection (e.g. to redraw figures) loads
+the fits instead of repeating them. Cached fits are rebuilt as fitted
+GaussianMixture objects.
+"""
+
+import hashlib
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from sklearn.mixture import GaussianMixture
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.config import RANDOM_SEED
+
+N_INIT = 5
+MAX_ITER = 300
+COVARIANCE_TYPE = "full"
+
+# Fitted attributes of GaussianMixture stored in the cache
+_PARAMS = ("weights_", "means_", "covariances_", "precisions_", "precisions_cholesky_")
+
+
+def feature_hash(X: np.ndarray) -> str:
+    """SHA-256 of a feature matrix (shape, dtype and contents)."""
+    X = np.ascontiguousarray(X)
+    h = hashlib.sha256(f"{X.shape}|{X.dtype.str}".encode())
+    h.update(X.tobytes())
+    return h.hexdigest()
+
+
+def init_seed(seed: int, k: int, init: int) -> int:
+    """Random state of fit (k, init), independent of the grid and worker count."""
+    return int(np.random.SeedSequence(seed, spawn_key=(k, init)).generate_state(1)[0])
+
+
+def _fit_one(X: np.ndarray, k: int, random_state: int, covariance_type: str,
+             max_iter: int, tol: float, warm_start_size: Optional[int]) -> dict:
+    """EM fit of one (K, init) pair; fitted attributes plus full-data statistics."""
+    n = len(X)
+    gmm = GaussianMixture(n_components=k, covariance_type=covariance_type, max_iter=max_iter,
+                          tol=tol, n_init=1, random_state=random_state)
+    n_iter_warm = 0
+    if warm_start_size is not None and warm_start_size < n:
+        rng = np.random.default_rng(random_state)
+        sub = X[np.sort(rng.choice(n, size=warm_start_size, replace=False))]
+        gmm.fit(sub)
+        n_iter_warm = gmm.n_iter_
+        gmm = GaussianMixture(n_components=k, covariance_type=covariance_type, max_iter=max_iter,
+                              tol=tol, n_init=1, random_state=random_state,
+                              weights_init=gmm.weights_, means_init=gmm.means_,
+                              precisions_init=gmm.precisions_)
+    gmm.fit(X)
+    out = {name: getattr(gmm, name) for name in _PARAMS}
+    out.update(
+        log_likelihood=float(gmm.score(X) * n),
+        lower_bound=float(gmm.lower_bound_),
+        converged=bool(gmm.converged_),
+        n_iter=int(gmm.n_iter_),
+        n_iter_warm=int(n_iter_warm),
+    )
+    return out
+
+
+_WORKER = {}
+
+
+def _init_worker(shm_name: str, shape: tuple, dtype: str, settings: dict) -> None:
+    shm = shared_memory.SharedMemory(name=shm_name)
+    # Keep the mapping alive for the life of the worker
+    _WORKER.update(shm=shm, X=np.ndarray(shape, dtype=dtype, buffer=shm.buf), settings=settings)
+
+
+def _worker_fit(k: int, init: int, random_state: int) -> tuple:
+    w = _WORKER
+    return k, init, _fit_one(w["X"], k, random_state, **w["settings"])
+
+
+def _cache_path(cache_dir: Path, key: str, k: int, random_state: int) -> Path:
+    return cache_dir / f"gmm_{key[:16]}_k{k}_s{random_state}.npz"
+
+
+def _load_fit(path: Path, key: str) -> Optional[dict]:
+    if not path.exists():
+        return None
+    try:
+        with np.load(path) as saved:
+            if str(saved["key"]) != key:
+                return None
+            fit = {name: saved[name].copy() for name in _PARAMS}
+            for name in ("log_likelihood", "lower_bound"):
+                fit[name] = float(saved[name])
+            fit["converged"] = bool(saved["converged"])
+            fit["n_iter"] = int(saved["n_iter"])
+            fit["n_iter_warm"] = int(saved["n_iter_warm"])
+            return fit
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _save_fit(path: Path, key: str, fit: dict) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, key=np.array(key), **fit)
+    os.replace(tmp, path)
+
+
+def _rebuild(fit: dict, k: int, covariance_type: str) -> GaussianMixture:
+    """Fitted GaussianMixture from stored parameters (predict/score/bic work as usual)."""
+    gmm = GaussianMixture(n_components=k, covariance_type=covariance_type)
+    for name in _PARAMS:
+        setattr(gmm, name, np.asarray(fit[name]))
+    gmm.converged_ = fit["converged"]
+    gmm.n_iter_ = fit["n_iter"]
+    gmm.lower_bound_ = fit["lower_bound"]
+    gmm.n_features_in_ = gmm.means_.shape[1]
+    return gmm
+
+
+def select_gmm(
+    X: np.ndarray,
+    k_range,
+    n_init: int = N_INIT,
+    seed: int = RANDOM_SEED,
+    covariance_type: str = COVARIANCE_TYPE,
+    max_iter: int = MAX_ITER,
+    tol: float = 1e-3,
+    warm_start_size: Optional[int] = None,
+    n_jobs: int = 1,
+    cache_dir=None,
+) -> dict:
+    """Fit Gaussian mixtures for every K in k_range and n_init seeds per K.
+
+    Args:
+        X: Feature matrix (n x d), e.g. standardized indicators.
+        k_range: Numbers of components to fit.
+        n_init: Random initializations per K (best log-likelihood kept).
+        seed: Root of the per-(K, init) SeedSequence streams.
+        covariance_type: GaussianMixture covariance type.
+        max_iter: Maximum EM iterations (per stage with a warm start).
+        tol: EM convergence tolerance on the lower bound.
+        warm_start_size: Rows of the EM warm-start subsample (None: fit all
+            rows from the start).
+        n_jobs: Worker processes (-1 for all cores); results do not depend on it.
+        cache_dir: Optional directory of cached (K, init) fits.
+
+    Returns:
+        Dict K -> {model, bic, aic, log_likelihood, converged, n_iter,
+        n_iter_warm, best_init, init_log_likelihoods, n_cached}.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    n = len(X)
+    k_range = list(k_range)
+    if warm_start_size is not None and warm_start_size >= n:
+        warm_start_size = None
+    settings = dict(covariance_type=covariance_type, max_iter=max_iter, tol=tol,
+                    warm_start_size=warm_start_size)
+    key = hashlib.sha256(
+        f"{feature_hash(X)}|{covariance_type}|{max_iter}|{tol}|{warm_start_size}".encode()
+    ).hexdigest()
+
+    tasks = [(k, i, init_seed(seed, k, i)) for k in k_range for i in range(n_init)]
+    fits, cached = {}, set()
+    cache = Path(cache_dir) if cache_dir is not None else None
+    if cache is not None:
+        cache.mkdir(parents=True, exist_ok=True)
+        for k, i, rs in tasks:
+            fit = _load_fit(_cache_path(cache, key, k, rs), key)
+            if fit is not None:
+                fits[k, i] = fit
+                cached.add((k, i))
+    todo = [t for t in tasks if (t[0], t[1]) not in fits]
+
+    def store(k, i, fit):
+        fits[k, i] = fit
+        if cache is not None:
+            _save_fit(_cache_path(cache, key, k, init_seed(seed, k, i)), key, fit)
+
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    n_jobs = max(1, min(n_jobs, len(todo)))
+    if n_jobs == 1:
+        for k, i, rs in todo:
+            store(k, i, _fit_one(X, k, rs, **settings))
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=X.nbytes)
+        try:
+            np.ndarray(X.shape, dtype=X.dtype, buffer=shm.buf)[:] = X
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                     initargs=(shm.name, X.shape, X.dtype.str, settings)) as pool:
+                # Largest K first so the slowest fits do not trail at the end
+                futures = [pool.submit(_worker_fit, *t) for t in sorted(todo, key=lambda t: -t[0])]
+                for future in as_completed(futures):
+                    store(*future.result())
+        finally:
+            shm.close()
+            shm.unlink()
+
+    results = {}
+    for k in k_range:
+        lls = [fits[k, i]["log_likelihood"] for i in range(n_init)]
+        best = int(np.argmax(lls))
+        fit = fits[k, best]
+        model = _rebuild(fit, k, covariance_type)
+        ll = fit["log_likelihood"]
+        n_params = model._n_parameters()
+        results[k] = {
+            "model": model,
+            "bic": -2 * ll + n_params * np.log(n),
+            "aic": -2 * ll + 2 * n_params,
+            "log_likelihood": ll,
+            "converged": fit["converged"],
+            "n_iter": fit["n_iter"],
+            "n_iter_warm": fit["n_iter_warm"],
+            "best_init": best,
+            "init_log_likelihoods": lls,
+            "n_cached": sum((k, i) in cached for i in range(n_init)),
+        }
+    return results
@@ -0,0 +1,425 @@
+"""
+Multi-resolution H3 hex cube: trip cell ids, aggregate tables, cached boundaries.
+
+Cell ids are computed once per trip end at the finest cube resolution and kept
+as UINT64 integers; coarser resolutions are derived with vectorized bit
+operations on the H3 index (no further h3 calls). Per-(cell, month, mode)
+aggregates are stored as additive sums/counts so parent resolutions are pure
+roll-ups of the finest level, and hex boundary polygons are built once per
+cell and cached, so spatial_analysis, spatial_figures and the web map can
+query hexes without recomputing indexes or polygons.
+
+Outputs:
+  - data_parquet/trip_h3_indices.parquet -- h3_{origin,dest}_r{res} UINT64 per trip
+  - data_parquet/spatial/hex_cube.parquet -- per-(res, endpoint, cell, month_year, mode) sums
+  - data_parquet/spatial/hex_boundaries.parquet -- cell polygons (WKB + [lon, lat] ring) and centers
+
+Usage:
+    python src/hex_cube.py
+"""
+
+import sys
+import time
+from itertools import repeat
+from pathlib import Path
+from typing import Optional, Sequence
+
+import duckdb
+import h3.api.numpy_int as h3i
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.config import (
+    CLEANED_PARQUET,
+    DATA_DIR,
+    H3_CUBE_RESOLUTIONS,
+    H3_RESOLUTION,
+    MODELING_DIR,
+)
+
+# ---- Paths ----
+SPATIAL_DIR = DATA_DIR / "spatial"
+TRIP_H3_PATH = DATA_DIR / "trip_h3_indices.parquet"
+HEX_CUBE_PATH = SPATIAL_DIR / "hex_cube.parquet"
+HEX_BOUNDARIES_PATH = SPATIAL_DIR / "hex_boundaries.parquet"
+
+# Trips per h3 batch when computing cell ids
+CELL_BATCH_SIZE = 1_000_000
+
+# Cube metrics: output name -> trip-level source column.
+# Each is stored as sum_<name> and n_<name> (non-null count) so that means
+# can be rolled up exactly to parent cells and over months/modes.
+CUBE_METRICS = {
+    "mean_speed": "mean_speed",
+    "p85_speed": "p85_speed",
+    "max_speed_mean": "max_speed_from_profile",
+    "speeding_rate": "speeding_rate_25",
+    "speed_cv_mean": "speed_cv",
+    "harsh_events_mean": "harsh_event_count",
+}
+
+CUBE_KEYS = ["endpoint", "cell", "month_year", "mode"]
+
+# H3 index bit layout: resolution in bits 52-55, 15 digits of 3 bits below bit 45
+_H3_RES_SHIFT = np.uint64(52)
+_H3_RES_MASK = np.uint64(0xF << 52)
+
+
+def cell_column(endpoint: str, resolution: int) -> str:
+    """Column name of the trip-level cell id for an endpoint/resolution."""
+    return f"h3_{endpoint}_r{resolution}"
+
+
+def latlng_to_cells(
+    lat: np.ndarray,
+    lon: np.ndarray,
+    resolution: int,
+    batch_size: int = CELL_BATCH_SIZE,
+) -> np.ndarray:
+    """Compute UINT64 H3 cell ids for coordinate arrays in batches.
+
+    Non-finite coordinates map to 0 (H3_NULL).
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    cells = np.zeros(len(lat), dtype=np.uint64)
+    valid = np.flatnonzero(np.isfinite(lat) & np.isfinite(lon))
+
+    for start in range(0, len(valid), batch_size):
+        idx = valid[start:start + batch_size]
+        cells[idx] = np.fromiter(
+            map(h3i.latlng_to_cell, lat[idx], lon[idx], repeat(resolution)),
+            dtype=np.uint64,
+            count=len(idx),
+        )
+    return cells
+
+
+def cell_resolution(cells: np.ndarray) -> np.ndarray:
+    """Resolution of each H3 cell id (vectorized)."""
+    cells = np.asarray(cells, dtype=np.uint64)
+    return ((cells & _H3_RES_MASK) >> _H3_RES_SHIFT).astype(np.uint8)
+
+
+def cells_to_parent(cells: np.ndarray, resolution: int) -> np.ndarray:
+    """Parent cell ids at a coarser resolution via H3 bit manipulation.
+
+    Sets the resolution field and fills the digits below `resolution` with 7
+    (the unused-digit marker), which is exactly h3.cell_to_parent. H3_NULL
+    (0) entries are passed through unchanged.
+    """
+    cells = np.asarray(cells, dtype=np.uint64)
+    unused = np.uint64((1 << (3 * (15 - resolution))) - 1)
+    parents = (cells & ~_H3_RES_MASK & ~unused) | np.uint64(resolution << 52) | unused
+    return np.where(cells == 0, np.uint64(0), parents)
+
+
+def cells_to_str(cells: np.ndarray) -> np.ndarray:
+    """Hex-string form of UINT64 cell ids (as used by h3 string APIs)."""
+    return np.array([format(int(c), "x") for c in np.asarray(cells, dtype=np.uint64)], dtype=object)
+
+
+def build_trip_cells(
+    df: pd.DataFrame,
+    resolutions: Sequence[int] = H3_CUBE_RESOLUTIONS,
+) -> pd.DataFrame:
+    """Compute origin/destination cell ids for every trip at all resolutions.
+
+    Only the finest resolution calls h3; coarser ones are parent roll-ups.
+
+    Args:
+        df: Trip dataframe with route_id, start_lat/lon, end_lat/lon.
+        resolutions: H3 resolutions to store.
+
+    Returns:
+        DataFrame with route_id and h3_{origin,dest}_r{res} UINT64 columns.
+    """
+    finest = max(resolutions)
+    print(f"Computing H3 cells at resolution {finest} (parents: {sorted(resolutions)[:-1]})...")
+    t0 = time.time()
+
+    out = pd.DataFrame({"route_id": df["route_id"].values})
+    for endpoint, prefix in [("origin", "start"), ("dest", "end")]:
+        fine = latlng_to_cells(df[f"{prefix}_lat"].values, df[f"{prefix}_lon"].values, finest)
+        for res in sorted(resolutions):
+            out[cell_column(endpoint, res)] = fine if res == finest else cells_to_parent(fine, res)
+
+    print(f"  Done in {time.time() - t0:.1f}s ({len(out):,} trips)")
+    return out
+
+
+def load_trip_cells(
+    resolution: int = H3_RESOLUTION,
+    path: Path = TRIP_H3_PATH,
+) -> pd.DataFrame:
+    """Load cached trip cell ids at one resolution as h3_origin / h3_dest."""
+    cols = [cell_column("origin", resolution), cell_column("dest", resolution)]
+    cells = pd.read_parquet(path, columns=["route_id"] + cols)
+    return cells.rename(columns={cols[0]: "h3_origin", cols[1]: "h3_dest"})
+
+
+def load_cube_source() -> pd.DataFrame:
+    """Load trip coordinates, month, mode and indicators for the cube."""
+    print("Loading trip data for hex cube...")
+    con = duckdb.connect()
+    metric_cols = ", ".join(f"m.{src}" for src in dict.fromkeys(CUBE_METRICS.values()))
+    df = con.execute(f"""
+        SELECT
+            c.route_id,
+            c.start_lat, c.start_lon,
+            c.end_lat, c.end_lon,
+            strftime(c.start_date, '%Y-%m') AS month_year,
+            c.mode,
+            m.is_speeding,
+            {metric_cols}
+        FROM read_parquet($cleaned) c
+        JOIN read_parquet($modeling) m USING (route_id)
+    """, {
+        "cleaned": str(CLEANED_PARQUET / "trips_cleaned.parquet"),
+        "modeling": str(MODELING_DIR / "trip_modeling.parquet"),
+    }).df()
+    con.close()
+    print(f"  Loaded {len(df):,} trips")
+    return df
+
+
+def build_hex_cube(
+    df: pd.DataFrame,
+    cells: pd.DataFrame,
+    resolutions: Sequence[int] = H3_CUBE_RESOLUTIONS,
+) -> pd.DataFrame:
+    """Aggregate trips to (res, endpoint, cell, month_year, mode) sums.
+
+    The finest resolution is aggregated from trips in DuckDB; every coarser
+    resolution is a roll-up of the finest cube rows by parent cell.
+
+    Args:
+        df: Trip dataframe from load_cube_source().
+        cells: Trip cell ids from build_trip_cells().
+        resolutions: Cube resolutions (finest is aggregated from trips).
+
+    Returns:
+        Cube DataFrame with trip_count, speeding_trips, sum_* and n_* columns.
+    """
+    finest = max(resolutions)
+    print(f"Building hex cube (finest res {finest}, roll-ups {sorted(resolutions)[:-1]})...")
+    t0 = time.time()
+
+    sums = ",\n".join(
+        f"SUM({src}) AS sum_{name}, COUNT({src}) AS n_{name}"
+        for name, src in CUBE_METRICS.items()
+    )
+    con = duckdb.connect()
+    src = df.merge(
+        cells[["route_id", cell_column("origin", finest), cell_column("dest", finest)]],
+        on="route_id",
+    )
+    con.register("cube_src", src)
+
+    parts = []
+    for endpoint in ["origin", "dest"]:
+        parts.append(con.execute(f"""
+            SELECT
+                '{endpoint}' AS endpoint,
+                {cell_column(endpoint, finest)} AS cell,
+                month_year,
+                mode,
+                COUNT(*) AS trip_count,
+                SUM(CAST(is_speeding AS INTEGER)) AS speeding_trips,
+                {sums}
+            FROM cube_src
+            WHERE {cell_column(endpoint, finest)} <> 0
+            GROUP BY ALL
+        """).df())
+    con.close()
+
+    fine = pd.concat(parts, ignore_index=True)
+    fine["cell"] = fine["cell"].astype(np.uint64)
+    value_cols = [c for c in fine.columns if c not in CUBE_KEYS]
+
+    levels = []
+    for res in sorted(resolutions):
+        if res == finest:
+            level = fine
+        else:
+            level = fine.assign(cell=cells_to_parent(fine["cell"].values, res))
+            level = level.groupby(CUBE_KEYS, sort=False, observed=True)[value_cols].sum().reset_index()
+        level.insert(0, "res", np.uint8(res))
+        levels.append(level)
+        print(f"  res {res}: {len(level):,} rows, {level['cell'].nunique():,} cells")
+
+    cube = pd.concat(levels, ignore_index=True)
+    cube["res"] = cube["res"].astype(np.uint8)
+    cube["cell"] = cube["cell"].astype(np.uint64)
+    cube = cube.sort_values(["res", "endpoint", "cell", "month_year", "mode"], ignore_index=True)
+    print(f"  Done in {time.time() - t0:.1f}s ({len(cube):,} cube rows)")
+    return cube
+
+
+def query_hexes(
+    resolution: int = H3_RESOLUTION,
+    endpoint: str = "origin",
+    months: Optional[Sequence[str]] = None,
+    modes: Optional[Sequence[str]] = None,
+    min_trips: int = 1,
+    cube_path: Path = HEX_CUBE_PATH,
+) -> pd.DataFrame:
+    """Query per-hex indicators from the cube for any month/mode slice.
+
+    Args:
+        resolution: H3 resolution (must be one of the cube resolutions).
+        endpoint: "origin" or "dest".
+        months: Optional list of "YYYY-MM" strings to include.
+        modes: Optional list of riding modes to include.
+        min_trips: Minimum trips per hex for inclusion.
+        cube_path: Path to the hex cube parquet.
+
+    Returns:
+        DataFrame with h3_cell and the aggregate_hexagons indicator columns
+        (except the non-additive median_speed).
+    """
+    filters = ["res = $res", "endpoint = $endpoint"]
+    params = {"cube": str(cube_path), "res": resolution, "endpoint": endpoint, "min_trips": min_trips}
+    if months is not None:
+        filters.append("list_contains($months, month_year)")
+        params["months"] = list(months)
+    if modes is not None:
+        filters.append("list_contains($modes, mode)")
+        params["modes"] = list(modes)
+
+    means = ",\n".join(
+        f"SUM(sum_{name}) / NULLIF(SUM(n_{name}), 0) AS {name}"
+        for name in CUBE_METRICS
+    )
+    con = duckdb.connect()
+    hexes = con.execute(f"""
+        SELECT
+            cell AS h3_cell,
+            SUM(trip_count) AS trip_count,
+            {means},
+            SUM(speeding_trips) AS speeding_trips,
+            SUM(speeding_trips) * 100.0 / SUM(trip_count) AS speeding_pct
+        FROM read_parquet($cube)
+        WHERE {" AND ".join(filters)}
+        GROUP BY cell
+        HAVING SUM(trip_count) >= $min_trips
+        ORDER BY cell
+    """, params).df()
+    con.close()
+    hexes["h3_cell"] = hexes["h3_cell"].astype(np.uint64)
+    return hexes
+
+
+def _boundary_rows(cells: np.ndarray) -> pd.DataFrame:
+    """Build boundary polygons and centers for a set of cells."""
+    from shapely import polygons, to_wkb
+
+    rings = []
+    lats = np.empty(len(cells))
+    lons = np.empty(len(cells))
+    for i, cell in enumerate(cells):
+        # h3 returns (lat, lon) tuples; polygons need (lon, lat)
+        ring = [[lon, lat] for lat, lon in h3i.cell_to_boundary(cell)]
+        ring.append(ring[0])
+        rings.append(ring)
+        lats[i], lons[i] = h3i.cell_to_latlng(cell)
+
+    geoms = [polygons(ring) for ring in rings]
+    return pd.DataFrame({
+        "cell": cells.astype(np.uint64),
+        "res": cell_resolution(cells),
+        "hex_lat": lats,
+        "hex_lon": lons,
+        "boundary": pd.Series(rings, dtype=object),
+        "geometry": to_wkb(geoms),
+    })
+
+
+def build_boundary_cache(
+    cells: np.ndarray,
+    path: Path = HEX_BOUNDARIES_PATH,
+) -> pd.DataFrame:
+    """Add boundaries for any cells not yet in the cache and save it.
+
+    Args:
+        cells: Cell ids (any resolution) that should be cached.
+        path: Boundary cache parquet path.
+
+    Returns:
+        The full boundary cache DataFrame (empty, with the cache columns,
+        when there is neither a cache file nor any cell).
+    """
+    cells = np.unique(np.asarray(cells, dtype=np.uint64))
+    cells = cells[cells != 0]
+    cache = pd.read_parquet(path) if path.exists() else None
+
+    if cache is not None:
+        cells = cells[~np.isin(cells, cache["cell"].values.astype(np.uint64))]
+    if len(cells) == 0:
+        return cache if cache is not None else _boundary_rows(cells)
+
+    print(f"Caching boundaries for {len(cells):,} new cells...")
+    new = _boundary_rows(cells)
+    cache = new if cache is None else pd.concat([cache, new], ignore_index=True)
+    cache = cache.sort_values("cell", ignore_index=True)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    cache.to_parquet(path, index=False)
+    print(f"  Saved: {path} ({len(cache):,} cells)")
+    return cache
+
+
+def attach_geometry(
+    df: pd.DataFrame,
+    cell_col: str = "h3_cell",
+    path: Path = HEX_BOUNDARIES_PATH,
+):
+    """Join cached hex polygons and centers onto a per-hex DataFrame.
+
+    Cells missing from the cache are built once and added to it.
+
+    Args:
+        df: DataFrame with a UINT64 cell id column.
+        cell_col: Name of the cell id column.
+        path: Boundary cache parquet path.
+
+    Returns:
+        GeoDataFrame (EPSG:4326) with geometry, hex_lat and hex_lon added.
+    """
+    import geopandas as gpd
+    from shapely import from_wkb
+
+    cells = df[cell_col].values.astype(np.uint64)
+    cache = build_boundary_cache(cells, path)
+    lookup = cache.set_index("cell")
+    lookup.index = lookup.index.astype(np.uint64)
+    rows = lookup.loc[cells]
+
+    out = df.copy()
+    out["hex_lat"] = rows["hex_lat"].values
+    out["hex_lon"] = rows["hex_lon"].values
+    return gpd.GeoDataFrame(out, geometry=from_wkb(rows["geometry"].values), crs="EPSG:4326")
+
+
+def main() -> None:
+    """Build trip cells, the hex cube, and the boundary cache."""
+    t_start = time.time()
+    SPATIAL_DIR.mkdir(parents=True, exist_ok=True)
+
+    df = load_cube_source()
+
+    cells = build_trip_cells(df)
+    cells.to_parquet(TRIP_H3_PATH, index=False)
+    print(f"Saved trip cells: {TRIP_H3_PATH}")
+
+    cube = build_hex_cube(df, cells)
+    cube.to_parquet(HEX_CUBE_PATH, index=False)
+    print(f"Saved hex cube: {HEX_CUBE_PATH}")
+
+    build_boundary_cache(cube["cell"].values)
+
+    print(f"\nTotal elapsed: {time.time() - t_start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
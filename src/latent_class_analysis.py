@@ -23,13 +23,13 @@ import json
 import sys
 import warnings
 from pathlib import Path
+from typing import Optional
 
 import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from sklearn.mixture import GaussianMixture
 from sklearn.preprocessing import StandardScaler
 
 warnings.filterwarnings("ignore", category=FutureWarning)
@@ -41,6 +41,7 @@ from src.config import (
     RANDOM_SEED,
     FIG_DPI,
 )
+from src.gmm_selection import select_gmm
 
 MODELING_DIR = DATA_DIR / "modeling"
 FIGURES_DIR.mkdir(parents=True, exist_ok=True)
@@ -76,6 +77,11 @@ FEATURE_LABELS = {
 # Range of K to test
 K_RANGE = range(2, 9)
 
+# Model-selection engine settings (see gmm_selection.py)
+GMM_N_JOBS = -1
+GMM_WARM_START_SIZE = None  # e.g. 50_000 users for a subsample EM warm start
+GMM_CACHE_DIR = MODELING_DIR / "gmm_cache"
+
 
 def load_user_data() -> pd.DataFrame:
     """Load user modeling dataset.
@@ -129,40 +135,34 @@ def fit_gmm_range(
     X: np.ndarray,
     k_range: range = K_RANGE,
     seed: int = RANDOM_SEED,
+    n_jobs: int = GMM_N_JOBS,
+    warm_start_size: Optional[int] = GMM_WARM_START_SIZE,
+    cache_dir: Optional[Path] = GMM_CACHE_DIR,
 ) -> dict:
     """Fit GMMs for range of K and compute BIC/AIC.
 
+    The K x init grid runs in parallel, optionally from a subsample EM warm
+    start, and fits are cached per (feature hash, K, seed); see
+    gmm_selection.select_gmm.
+
     Args:
         X: Standardized feature array.
         k_range: Range of K values to test.
         seed: Random seed.
+        n_jobs: Worker processes (-1 for all cores).
+        warm_start_size: Users in the EM warm-start subsample (None: off).
+        cache_dir: Directory of cached fits (None: no cache).
 
     Returns:
         Dict with K -> {model, bic, aic, log_likelihood} results.
     """
-    results = {}
-    for k in k_range:
-        print(f"  Fitting GMM with K={k}...", end="", flush=True)
-        gmm = GaussianMixture(
-            n_components=k,
-            covariance_type="full",
-            max_iter=300,
-            n_init=5,
-            random_state=seed,
-        )
-        gmm.fit(X)
-        bic = gmm.bic(X)
-        aic = gmm.aic(X)
-        ll = gmm.score(X) * len(X)  # total log-likelihood
-        print(f" BIC={bic:.0f}, AIC={aic:.0f}, converged={gmm.converged_}")
-        results[k] = {
-            "model": gmm,
-            "bic": bic,
-            "aic": aic,
-            "log_likelihood": ll,
-            "converged": gmm.converged_,
-            "n_iter": gmm.n_iter_,
-        }
+    results = select_gmm(X, k_range, n_init=5, seed=seed, covariance_type="full",
+                         max_iter=300, warm_start_size=warm_start_size,
+                         n_jobs=n_jobs, cache_dir=cache_dir)
+    for k, r in results.items():
+        source = "cached" if r["n_cached"] == 5 else "fitted"
+        print(f"  K={k}: BIC={r['bic']:.0f}, AIC={r['aic']:.0f}, "
+              f"converged={r['converged']} ({source})")
 
     return results
 
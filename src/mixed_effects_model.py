@@ -5,8 +5,9 @@ Model: mean_speed ~ age_group + mode + time_of_day + day_type + province
                    + frac_major_road + dominant_road_class
                    + (1|user_id) + (1|city)
 
-Due to the large dataset, we use a stratified subsample of 100K trips.
-Statsmodels MixedLM with random intercepts for user_id.
+Fitted on all trips with random intercepts for user_id, from per-user
+sufficient statistics aggregated in DuckDB (random_intercept.py); the REML
+likelihood is the one statsmodels MixedLM maximizes.
 
 Outputs:
   - data_parquet/modeling/mixed_effects_results.json -- coefficients, R2, etc.
@@ -28,13 +29,12 @@ import statsmodels.formula.api as smf
 warnings.filterwarnings("ignore")
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from src.config import DATA_DIR, FIGURES_DIR, RANDOM_SEED, FIG_DPI
+from src.config import DATA_DIR, FIGURES_DIR, FIG_DPI
+from src.random_intercept import fit_gaussian_random_intercept
 
 MODELING_DIR = DATA_DIR / "modeling"
 FIGURES_DIR.mkdir(parents=True, exist_ok=True)
 
-SAMPLE_SIZE = 100_000
-
 
 def load_and_prepare() -> pd.DataFrame:
     """Load trip modeling data merged with road class features.
@@ -103,7 +103,10 @@ def load_and_prepare() -> pd.DataFrame:
 
 
 def run_mixed_effects(df: pd.DataFrame) -> dict:
-    """Run mixed-effects linear model on a subsample.
+    """Run mixed-effects linear model on all trips.
+
+    The random-intercept model is fitted from per-user sufficient statistics
+    (random_intercept.py), so every user contributes.
 
     Args:
         df: Prepared modeling data.
@@ -111,67 +114,54 @@ def run_mixed_effects(df: pd.DataFrame) -> dict:
     Returns:
         Dict with model results.
     """
-    np.random.seed(RANDOM_SEED)
-
-    # Subsample for computational feasibility
-    if len(df) > SAMPLE_SIZE:
-        sample = df.sample(SAMPLE_SIZE, random_state=RANDOM_SEED)
-        print(f"\nSubsampled to {SAMPLE_SIZE:,} trips")
-    else:
-        sample = df
-
-    print(f"  Users in sample: {sample['user_id'].nunique():,}")
-    print(f"  Cities in sample: {sample['city'].nunique()}")
-
-    # Formula: mean_speed ~ fixed effects + (1|user_id)
-    formula = (
-        "mean_speed ~ C(age_group_str, Treatment('<20')) "
-        "+ C(mode_str, Treatment('STD')) "
-        "+ C(time_of_day_str, Treatment('midday')) "
-        "+ C(day_type_str, Treatment('weekday')) "
-        "+ C(road_type, Treatment('residential')) "
-        "+ frac_major_road "
-        "+ log_distance"
-    )
+    print(f"\n  Users: {df['user_id'].nunique():,}")
+    print(f"  Cities: {df['city'].nunique()}")
+
+    # Model: mean_speed ~ fixed effects + (1|user_id)
+    categorical = {
+        "age_group_str": "<20",
+        "mode_str": "STD",
+        "time_of_day_str": "midday",
+        "day_type_str": "weekday",
+        "road_type": "residential",
+    }
+    numeric = ["frac_major_road", "log_distance"]
 
     # Add log distance
-    sample = sample.copy()
-    sample["log_distance"] = np.log1p(sample["distance"])
+    df = df.copy()
+    df["log_distance"] = np.log1p(df["distance"])
 
-    print(f"\nFitting MixedLM: mean_speed ~ covariates + (1|user_id)...")
-    print(f"  Formula: {formula}")
+    print(f"\nFitting random-intercept LMM (REML): mean_speed ~ covariates + (1|user_id)...")
+    print(f"  Categorical (reference): {categorical}")
+    print(f"  Numeric: {numeric}")
 
-    model = smf.mixedlm(formula, data=sample, groups=sample["user_id"])
-    result = model.fit(reml=True)
+    result = fit_gaussian_random_intercept(
+        df, "mean_speed", "user_id", categorical, numeric, reml=True,
+    )
 
-    print(f"\n  Converged: {result.converged}")
-    print(f"  Log-Likelihood: {result.llf:.1f}")
-    print(f"  AIC: {result.aic:.1f}")
-    print(f"  BIC: {result.bic:.1f}")
+    print(f"\n  Converged: {result['converged']}")
+    print(f"  Log-Likelihood: {result['llf']:.1f}")
+    print(f"  AIC: {result['aic']:.1f}")
+    print(f"  BIC: {result['bic']:.1f}")
 
     # Random effects variance
-    re_var = result.cov_re.iloc[0, 0]
-    resid_var = result.scale
-    icc = re_var / (re_var + resid_var)
+    re_var = result["re_var"]
+    resid_var = result["scale"]
+    icc = result["icc"]
     print(f"  Random intercept variance: {re_var:.4f}")
     print(f"  Residual variance: {resid_var:.4f}")
     print(f"  ICC (user): {icc:.4f}")
 
     # Extract fixed effects
     coefficients = {}
-    summary = result.summary()
-
-    for name in result.fe_params.index:
-        coef = result.fe_params[name]
-        se = result.bse_fe[name]
-        pval = result.pvalues[name]
-        ci = result.conf_int().loc[name]
+    for name in result["params"].index:
+        ci = result["conf_int"].loc[name]
         coefficients[name] = {
-            "coef": float(coef),
-            "se": float(se),
-            "ci_lower": float(ci[0]),
-            "ci_upper": float(ci[1]),
-            "pvalue": float(pval),
+            "coef": float(result["params"][name]),
+            "se": float(result["bse"][name]),
+            "ci_lower": float(ci["lower"]),
+            "ci_upper": float(ci["upper"]),
+            "pvalue": float(result["pvalues"][name]),
         }
 
     # Print key coefficients
@@ -185,12 +175,12 @@ def run_mixed_effects(df: pd.DataFrame) -> dict:
     results = {
         "model_type": "MixedLM (REML)",
         "outcome": "mean_speed",
-        "n_obs": len(sample),
-        "n_users": sample["user_id"].nunique(),
-        "converged": result.converged,
-        "log_likelihood": float(result.llf),
-        "aic": float(result.aic),
-        "bic": float(result.bic),
+        "n_obs": result["nobs"],
+        "n_users": result["n_groups"],
+        "converged": result["converged"],
+        "log_likelihood": float(result["llf"]),
+        "aic": float(result["aic"]),
+        "bic": float(result["bic"]),
         "random_intercept_var": float(re_var),
         "residual_var": float(resid_var),
         "icc_user": float(icc),
@@ -349,7 +339,7 @@ def main() -> None:
 
     df = load_and_prepare()
 
-    # Mixed-effects model (subsample)
+    # Mixed-effects model (all trips)
     mixed_results = run_mixed_effects(df)
 
     # OLS on full dataset for comparison
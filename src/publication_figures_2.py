@@ -230,7 +230,7 @@ def fig_regression_coefficients() -> None:
     for model_key, fig_name, title in [
         ("logistic_full", "fig9_logistic_OR",
          "Logistic Regression: Odds Ratios for Speeding (>25 km/h)"),
-        ("gee_subsample", "fig10_gee_OR",
+        ("gee_full", "fig10_gee_OR",
          "GEE Model: Odds Ratios for Speeding (>25 km/h)"),
     ]:
         model = results[model_key]
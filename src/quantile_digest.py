@@ -0,0 +1,152 @@
+"""
+Mergeable quantile sketches (t-digest centroids) built in DuckDB.
+
+A digest summarizes the values of an outcome within a group by centroids
+(mean, weight, min, max) of consecutive sorted values. As in the t-digest,
+a value at quantile q goes to bin floor(delta * k(q)) of the scale function
+
+  k(q) = asin(2q - 1) / pi + 1/2
+
+so centroids hold about pi sqrt(q (1 - q)) n / delta values: many values
+near the median, few in the tails, where quantiles of interest (p90, p99)
+stay accurate. Digests are built with one sorted window pass per source in
+SQL, so raw values never leave DuckDB, and the result is a small table of
+at most about delta centroids per (group, outcome).
+
+Digests of disjoint partitions of the data (months, files) are merged by
+re-binning their centroids on the same scale, and any quantile is read off
+a digest by interpolating between centroid centres, so new quantile levels
+cost no pass over the data. Means are exact (weighted centroid means);
+groups with at most about delta values keep singleton centroids and give
+the exact linear-interpolation quantiles (pandas / quantile_cont).
+"""
+
+from typing import Sequence
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+COMPRESSION = 200
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _bin_sql(q: str, delta: int) -> str:
+    return f"floor({delta} * (asin(2 * ({q}) - 1) / pi() + 0.5))"
+
+
+def quantile_label(q: float) -> str:
+    """Column suffix of quantile q: 0.9 -> p90, 0.975 -> p97_5."""
+    return "p" + f"{q * 100:g}".replace(".", "_")
+
+
+def build_digests(
+    con: duckdb.DuckDBPyConnection,
+    source: str,
+    groups: Sequence[str],
+    outcomes: Sequence[str],
+    delta: int = COMPRESSION,
+) -> pd.DataFrame:
+    """Digests of each outcome within each group of a table, computed in SQL.
+
+    Args:
+        con: DuckDB connection.
+        source: Table, view or FROM expression.
+        groups: Grouping columns (e.g. city, month_year).
+        outcomes: Numeric columns to summarize; NULLs are skipped.
+        delta: Compression (centroids per digest are at most about delta).
+
+    Returns:
+        Long DataFrame of centroids: groups, outcome, mean, weight, min, max,
+        sorted by group, outcome and mean.
+    """
+    keys = ", ".join(_quote(g) for g in groups)
+    values = ", ".join(f"CAST({_quote(o)} AS DOUBLE) AS {_quote(o)}" for o in outcomes)
+    on = ", ".join(_quote(o) for o in outcomes)
+    part = f"PARTITION BY {keys}, outcome"
+    return con.execute(f"""
+        WITH long AS (
+            UNPIVOT (SELECT {keys}, {values} FROM {source})
+            ON {on} INTO NAME outcome VALUE x
+        ),
+        ranked AS (
+            SELECT {keys}, outcome, x,
+                   (row_number() OVER ({part} ORDER BY x) - 0.5)
+                       / count(*) OVER ({part}) AS q
+            FROM long
+            WHERE NOT isnan(x)
+        )
+        SELECT {keys}, outcome, avg(x) AS mean, count(*)::DOUBLE AS weight,
+               min(x) AS min, max(x) AS max
+        FROM ranked
+        GROUP BY {keys}, outcome, {_bin_sql("q", delta)}
+        ORDER BY {keys}, outcome, mean
+    """).df()
+
+
+def merge_digests(
+    con: duckdb.DuckDBPyConnection,
+    digests: Sequence[pd.DataFrame],
+    groups: Sequence[str],
+    delta: int = COMPRESSION,
+) -> pd.DataFrame:
+    """Merge digests of disjoint partitions into one digest per (group, outcome).
+
+    Centroids are re-binned at the quantile of their centre in the combined
+    weight, the same scale the digests were built on.
+    """
+    keys = ", ".join(_quote(g) for g in groups)
+    part = f"PARTITION BY {keys}, outcome"
+    con.register("digest_parts", pd.concat(list(digests), ignore_index=True))
+    merged = con.execute(f"""
+        WITH ranked AS (
+            SELECT *,
+                   (sum(weight) OVER ({part} ORDER BY mean ROWS UNBOUNDED PRECEDING) - weight / 2)
+                       / sum(weight) OVER ({part}) AS q
+            FROM digest_parts
+        )
+        SELECT {keys}, outcome, sum(mean * weight) / sum(weight) AS mean,
+               sum(weight) AS weight, min(min) AS min, max(max) AS max
+        FROM ranked
+        GROUP BY {keys}, outcome, {_bin_sql("q", delta)}
+        ORDER BY {keys}, outcome, mean
+    """).df()
+    con.unregister("digest_parts")
+    return merged
+
+
+def digest_quantiles(
+    digests: pd.DataFrame,
+    groups: Sequence[str],
+    quantiles: Sequence[float],
+) -> pd.DataFrame:
+    """Wide table of means and quantiles per group from digests.
+
+    Quantile q of n values sits at position q (n - 1) + 1/2 on the cumulative
+    weight scale (centroid i centred at its cumulative weight minus half its
+    weight); it is interpolated between the neighbouring centres, and
+    between the extreme centres and the group min / max.
+
+    Returns:
+        One row per group with {outcome}_mean and {outcome}_{quantile_label(q)}.
+    """
+    groups = list(groups)
+    q = np.asarray(quantiles, dtype=np.float64)
+    records = {}
+    for key, d in digests.groupby(groups + ["outcome"], sort=True, observed=True):
+        w = d["weight"].to_numpy()
+        m = d["mean"].to_numpy()
+        total = w.sum()
+        centres = np.cumsum(w) - w / 2
+        xp = np.r_[0.5, centres, total - 0.5]
+        fp = np.r_[d["min"].iloc[0], m, d["max"].iloc[-1]]
+        values = np.interp(q * (total - 1) + 0.5, xp, fp)
+        rec = records.setdefault(key[:-1], dict(zip(groups, key[:-1])))
+        outcome = key[-1]
+        rec[f"{outcome}_mean"] = float(m @ w / total)
+        for level, v in zip(q, values):
+            rec[f"{outcome}_{quantile_label(level)}"] = float(v)
+    return pd.DataFrame(list(records.values()))
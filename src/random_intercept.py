@@ -0,0 +1,412 @@
+"""
+Random-intercept models on per-user sufficient statistics.
+
+Gaussian (y = x'beta + u_i + e, u_i ~ N(0, tau^2), e ~ N(0, sigma^2)):
+with gamma = tau^2 / sigma^2 the inverse of a user's covariance is
+(I - c_i 11') / sigma^2, c_i = gamma / (1 + n_i gamma), so the GLS system
+and the profiled (RE)ML likelihood need only
+
+  global:   X'X, X'y, y'y
+  per user: n_i, sum x, sum y
+
+  A = X'X - sum_i c_i sx_i sx_i'     b = X'y - sum_i c_i sx_i sy_i
+  beta = A^-1 b                      RSS = y'y - sum_i c_i sy_i^2 - b'beta
+
+Both tables come from DuckDB aggregates over the trip table with the design
+columns written as SQL expressions, so memory is O(users x k) whatever the
+number of trips. The likelihood is maximized over log gamma alone (Brent),
+and matches statsmodels MixedLM (same profiled REML/ML likelihood).
+
+Binomial (logit P(y) = x'beta + u_i): with categorical covariates a user's
+likelihood depends only on the (user, covariate cell) counts of trips and
+speeding trips, collapsed in DuckDB as in compressed_logit.py. Each user's
+integral over u_i is approximated by adaptive Gauss-Hermite quadrature
+centred on its posterior mode: the modes and curvatures come from
+vectorized Newton steps over all users at once (segment sums with
+np.bincount), warm-started from the previous evaluation. The gradient is the
+quadrature estimate of the posterior-expected score (a single node, the
+Laplace approximation, would ignore the curvature term, so n_quad >= 2), the
+likelihood is
+maximized over (beta, log tau) by L-BFGS, and SEs come from a forward
+difference Hessian of that gradient.
+"""
+
+import sys
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+import duckdb
+import numpy as np
+import pandas as pd
+import patsy
+import statsmodels.api as sm
+from scipy import optimize, stats
+from scipy.special import expit
+from statsmodels.genmod.families import Binomial
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.compressed_logit import collapse_cells, quote_ident, register_trips
+
+QUAD_POINTS = 7
+MODE_TOL = 1e-8
+MODE_MAX_ITER = 50
+# Largest Newton step for a user's mode (logit scale)
+MAX_MODE_STEP = 3.0
+LOG_GAMMA_BOUNDS = (-15.0, 10.0)
+
+
+# ---------------------------------------------------------------------------
+# Gaussian outcome
+# ---------------------------------------------------------------------------
+
+def design_sql(
+    con: duckdb.DuckDBPyConnection,
+    source: str,
+    categorical: dict,
+    numeric: Sequence[str] = (),
+) -> tuple:
+    """Design columns as SQL expressions, named as patsy names the formula terms.
+
+    Args:
+        con: DuckDB connection.
+        source: Table name or FROM expression of the trip table.
+        categorical: {column: reference level}, coded C(column, Treatment('ref')).
+        numeric: Numeric regressor columns.
+
+    Returns:
+        (column names, SQL expressions), Intercept first.
+    """
+    names, exprs = ["Intercept"], ["1.0"]
+    for col, ref in categorical.items():
+        levels = con.execute(
+            f"SELECT DISTINCT CAST({quote_ident(col)} AS VARCHAR) FROM {source} "
+            f"WHERE {quote_ident(col)} IS NOT NULL"
+        ).fetchall()
+        for (level,) in sorted(levels):
+            if level == ref:
+                continue
+            names.append(f"C({col}, Treatment('{ref}'))[T.{level}]")
+            literal = level.replace("'", "''")
+            exprs.append(f"CAST(CAST({quote_ident(col)} AS VARCHAR) = '{literal}' AS DOUBLE)")
+    for col in numeric:
+        names.append(col)
+        exprs.append(f"CAST({quote_ident(col)} AS DOUBLE)")
+    return names, exprs
+
+
+def user_moments(
+    con: duckdb.DuckDBPyConnection,
+    source: str,
+    outcome: str,
+    exprs: Sequence[str],
+    cluster: str,
+) -> dict:
+    """Global cross-products and per-user counts and sums of the design.
+
+    Rows with a missing outcome, regressor or cluster label are dropped.
+
+    Returns:
+        Dict with xtx (k x k), xty (k), yty, n (users), sx (users x k), sy (users).
+    """
+    k = len(exprs)
+    columns = ", ".join(f"{e} AS x{j}" for j, e in enumerate(exprs))
+    complete = " AND ".join(["y IS NOT NULL", "g IS NOT NULL"]
+                            + [f"x{j} IS NOT NULL" for j in range(k)])
+    con.execute(f"""
+        CREATE OR REPLACE TEMP VIEW design AS
+        SELECT * FROM (
+            SELECT {quote_ident(cluster)} AS g, CAST({quote_ident(outcome)} AS DOUBLE) AS y, {columns}
+            FROM {source}
+        ) WHERE {complete}
+    """)
+    products = ", ".join(f"SUM(x{a} * x{b})" for a in range(k) for b in range(a, k))
+    cross_y = ", ".join(f"SUM(x{j} * y)" for j in range(k))
+    totals = con.execute(f"SELECT {products}, {cross_y}, SUM(y * y) FROM design").fetchone()
+    totals = np.array(totals, dtype=np.float64)
+
+    upper = np.triu_indices(k)
+    xtx = np.zeros((k, k))
+    xtx[upper] = totals[:len(upper[0])]
+    xtx = xtx + np.triu(xtx, 1).T
+
+    sums = ", ".join(f"SUM(x{j})" for j in range(k))
+    per_user = con.execute(
+        f"SELECT COUNT(*), SUM(y), {sums} FROM design GROUP BY g"
+    ).fetchnumpy()
+    per_user = np.column_stack(list(per_user.values())).astype(np.float64)
+    return {
+        "xtx": xtx,
+        "xty": totals[len(upper[0]):len(upper[0]) + k],
+        "yty": float(totals[-1]),
+        "n": per_user[:, 0],
+        "sy": per_user[:, 1],
+        "sx": per_user[:, 2:],
+    }
+
+
+def _gls(m: dict, log_gamma: float) -> tuple:
+    gamma = np.exp(log_gamma)
+    c = gamma / (1 + m["n"] * gamma)
+    A = m["xtx"] - (m["sx"] * c[:, None]).T @ m["sx"]
+    b = m["xty"] - m["sx"].T @ (c * m["sy"])
+    beta = np.linalg.solve(A, b)
+    rss = m["yty"] - np.sum(c * m["sy"] ** 2) - b @ beta
+    return beta, A, rss, float(np.sum(np.log1p(m["n"] * gamma)))
+
+
+def _profile_loglike(m: dict, log_gamma: float, reml: bool) -> float:
+    """Log-likelihood with beta and sigma^2 profiled out (statsmodels MixedLM form)."""
+    _, A, rss, logdet = _gls(m, log_gamma)
+    n, k = m["n"].sum(), len(m["xty"])
+    dof = n - k if reml else n
+    llf = -0.5 * (dof * np.log(2 * np.pi * rss / dof) + logdet + dof)
+    if reml:
+        llf -= 0.5 * np.linalg.slogdet(A)[1]
+    return float(llf)
+
+
+def fit_gaussian(m: dict, names: Sequence[str], reml: bool = True) -> dict:
+    """Linear random-intercept model from user_moments().
+
+    Args:
+        m: Output of user_moments().
+        names: Design column names.
+        reml: REML (as MixedLM's default) or ML.
+
+    Returns:
+        Dict with params, bse, pvalues (normal), conf_int (lower/upper
+        DataFrame), cov, re_var (tau^2), scale (sigma^2), icc, llf, aic and
+        bic (NaN under REML, as statsmodels), nobs, n_groups, converged.
+    """
+    opt = optimize.minimize_scalar(
+        lambda lg: -_profile_loglike(m, lg, reml),
+        bounds=LOG_GAMMA_BOUNDS, method="bounded", options={"xatol": 1e-8},
+    )
+    log_gamma = float(opt.x)
+    beta, A, rss, _ = _gls(m, log_gamma)
+    n, k = m["n"].sum(), len(beta)
+    scale = rss / (n - k if reml else n)
+    re_var = np.exp(log_gamma) * scale
+    cov = scale * np.linalg.inv(A)
+    bse = np.sqrt(np.diag(cov))
+    llf = -opt.fun
+    # Fixed effects, scale and the random-intercept variance
+    n_params = k + 2
+    z = stats.norm.ppf(0.975)
+    return {
+        "params": pd.Series(beta, index=names),
+        "bse": pd.Series(bse, index=names),
+        "pvalues": pd.Series(2 * stats.norm.sf(np.abs(beta / bse)), index=names),
+        "conf_int": pd.DataFrame({"lower": beta - z * bse, "upper": beta + z * bse}, index=names),
+        "cov": pd.DataFrame(cov, index=names, columns=names),
+        "re_var": float(re_var),
+        "scale": float(scale),
+        "icc": float(re_var / (re_var + scale)),
+        "llf": llf,
+        "aic": np.nan if reml else -2 * llf + 2 * n_params,
+        "bic": np.nan if reml else -2 * llf + n_params * np.log(n),
+        "nobs": int(n),
+        "n_groups": len(m["n"]),
+        "converged": bool(opt.success),
+    }
+
+
+def fit_gaussian_random_intercept(
+    data: Union[pd.DataFrame, str],
+    outcome: str,
+    cluster: str,
+    categorical: dict,
+    numeric: Sequence[str] = (),
+    reml: bool = True,
+) -> dict:
+    """Linear model with a random intercept per cluster on all trips.
+
+    Args:
+        data: Trip DataFrame, or path to a trip parquet file.
+        outcome: Continuous outcome column.
+        cluster: Cluster column (e.g. user_id).
+        categorical: {column: reference level}.
+        numeric: Numeric regressor columns.
+        reml: REML or ML.
+
+    Returns:
+        Output of fit_gaussian().
+    """
+    con = duckdb.connect()
+    source, _ = register_trips(con, data, [outcome, cluster, *categorical, *numeric])
+    names, exprs = design_sql(con, source, categorical, numeric)
+    moments = user_moments(con, source, outcome, exprs, cluster)
+    con.close()
+    return fit_gaussian(moments, names, reml=reml)
+
+
+# ---------------------------------------------------------------------------
+# Binomial outcome
+# ---------------------------------------------------------------------------
+
+class _UserCells:
+    """(user, cell) counts with the warm-started posterior modes of the intercepts."""
+
+    def __init__(self, users, cells, successes, trials, X, n_quad):
+        self.g, self.c = users, cells
+        self.s, self.n = successes, trials
+        self.X = X
+        self.G = int(users.max()) + 1
+        self.successes = np.bincount(users, weights=successes, minlength=self.G)
+        self.mode = np.zeros(self.G)
+        self.z, w = np.polynomial.hermite.hermgauss(n_quad)
+        self.log_w = np.log(w) + self.z ** 2
+
+    def _seg(self, values):
+        return np.bincount(self.g, weights=values, minlength=self.G)
+
+    def _modes(self, eta, tau2):
+        """Posterior modes and curvatures of the user intercepts (vectorized Newton)."""
+        u = self.mode
+        for _ in range(MODE_MAX_ITER):
+            p = expit(eta + u[self.g])
+            grad = self._seg(self.s - self.n * p) - u / tau2
+            hess = self._seg(self.n * p * (1 - p)) + 1 / tau2
+            step = np.clip(grad / hess, -MAX_MODE_STEP, MAX_MODE_STEP)
+            u = u + step
+            if np.abs(step).max() < MODE_TOL:
+                break
+        p = expit(eta + u[self.g])
+        self.mode = u
+        return u, self._seg(self.n * p * (1 - p)) + 1 / tau2
+
+    def loglike(self, theta):
+        """Adaptive Gauss-Hermite log-likelihood and its gradient in (beta, log tau)."""
+        beta, log_tau = theta[:-1], theta[-1]
+        tau2 = np.exp(2 * log_tau)
+        eta = (self.X @ beta)[self.c]
+        u_hat, h = self._modes(eta, tau2)
+        spread = np.sqrt(2 / h)
+        # Nodes per user (users x n_quad) and their row-level offsets
+        U = u_hat[:, None] + spread[:, None] * self.z[None, :]
+        eta_hat = eta + u_hat[self.g]
+        spread_rows = spread[self.g]
+
+        # log f(u) = sum s (eta + u) - n log(1 + e^(eta + u)) + log N(u; 0, tau^2)
+        F = self._seg(self.s * eta)[:, None] + U * self.successes[:, None]
+        F += -U ** 2 / (2 * tau2) - 0.5 * np.log(2 * np.pi * tau2) + self.log_w[None, :]
+        for q, z in enumerate(self.z):
+            F[:, q] -= self._seg(self.n * np.logaddexp(0, eta_hat + spread_rows * z))
+        top = F.max(axis=1, keepdims=True)
+        post = np.exp(F - top)
+        total = post.sum(axis=1, keepdims=True)
+        log_l = np.log(spread) + top[:, 0] + np.log(total[:, 0])
+        post = (post / total).T.copy()
+
+        # Posterior-expected scores (post sums to one over the nodes)
+        expected_p = np.zeros(len(self.g))
+        for q, z in enumerate(self.z):
+            expected_p += post[q][self.g] * expit(eta_hat + spread_rows * z)
+        grad_cell = np.bincount(self.c, weights=self.s - self.n * expected_p, minlength=len(self.X))
+        grad_tau = np.sum(post.T * (U ** 2 / tau2 - 1))
+        return float(log_l.sum()), np.r_[self.X.T @ grad_cell, grad_tau]
+
+
+def fit_binomial_random_intercept(
+    data: Union[pd.DataFrame, str],
+    outcome: str,
+    covariates: Sequence[str],
+    cluster: str,
+    formula: Optional[str] = None,
+    n_quad: int = QUAD_POINTS,
+) -> dict:
+    """Logistic model with a random intercept per cluster on all trips.
+
+    Args:
+        data: Trip DataFrame, or path to a trip parquet file.
+        outcome: Binary outcome column.
+        covariates: Categorical columns defining the covariate cells (without
+            a formula, numeric design columns with the constant included).
+        cluster: Cluster column (e.g. user_id).
+        formula: Optional patsy right-hand side evaluated on the cell table.
+        n_quad: Adaptive Gauss-Hermite points per user (at least 2).
+
+    Returns:
+        Dict with params, bse, pvalues (normal), conf_int (lower/upper
+        DataFrame), cov, re_sd (tau), re_sd_se, re_var, icc (latent scale,
+        tau^2 / (tau^2 + pi^2 / 3)), llf, aic, bic, nobs, n_groups, n_cells,
+        n_quad and converged.
+    """
+    if n_quad < 2:
+        raise ValueError("n_quad must be at least 2")
+    con = duckdb.connect()
+    source, strings = register_trips(con, data, [outcome, *covariates, cluster])
+    cells = collapse_cells(con, source, outcome, covariates, cluster)
+    user_cells = con.execute(
+        "SELECT cluster, cell, successes, trials FROM user_cells ORDER BY cluster"
+    ).fetchnumpy()
+    con.close()
+    for c in strings:
+        if c in cells:
+            cells[c] = cells[c].astype(object)
+
+    if formula is not None:
+        design = patsy.dmatrix(formula, cells, return_type="dataframe")
+    else:
+        design = cells[list(covariates)].astype(np.float64)
+    names = list(design.columns)
+    X = design.to_numpy()
+    problem = _UserCells(
+        pd.factorize(user_cells["cluster"], sort=False)[0],
+        np.asarray(user_cells["cell"], dtype=np.int64),
+        np.asarray(user_cells["successes"], dtype=np.float64),
+        np.asarray(user_cells["trials"], dtype=np.float64),
+        X, n_quad,
+    )
+
+    # Start from the ordinary logistic fit on the cell totals
+    s = cells["successes"].to_numpy()
+    n = cells["trials"].to_numpy()
+    freq = np.r_[s, n - s]
+    keep = freq > 0
+    start = sm.GLM(np.r_[np.ones(len(s)), np.zeros(len(s))][keep], np.vstack([X, X])[keep],
+                   family=Binomial(), freq_weights=freq[keep]).fit().params
+
+    def objective(theta):
+        llf, grad = problem.loglike(theta)
+        return -llf, -grad
+
+    opt = optimize.minimize(objective, np.r_[start, 0.0], jac=True, method="L-BFGS-B")
+    theta = opt.x
+
+    # Observed information by forward differences of the gradient
+    k = len(theta)
+    llf, grad = problem.loglike(theta)
+    hess = np.empty((k, k))
+    for j in range(k):
+        step = np.zeros(k)
+        step[j] = 1e-5 * max(1.0, abs(theta[j]))
+        hess[:, j] = (problem.loglike(theta + step)[1] - grad) / step[j]
+    cov_all = np.linalg.inv(-(hess + hess.T) / 2)
+
+    beta = theta[:-1]
+    cov = cov_all[:-1, :-1]
+    bse = np.sqrt(np.diag(cov))
+    tau = float(np.exp(theta[-1]))
+    nobs = float(n.sum())
+    z = stats.norm.ppf(0.975)
+    return {
+        "params": pd.Series(beta, index=names),
+        "bse": pd.Series(bse, index=names),
+        "pvalues": pd.Series(2 * stats.norm.sf(np.abs(beta / bse)), index=names),
+        "conf_int": pd.DataFrame({"lower": beta - z * bse, "upper": beta + z * bse}, index=names),
+        "cov": pd.DataFrame(cov, index=names, columns=names),
+        "re_sd": tau,
+        # Delta method from log tau
+        "re_sd_se": float(tau * np.sqrt(cov_all[-1, -1])),
+        "re_var": tau ** 2,
+        "icc": tau ** 2 / (tau ** 2 + np.pi ** 2 / 3),
+        "llf": llf,
+        "aic": -2 * llf + 2 * k,
+        "bic": -2 * llf + k * np.log(nobs),
+        "nobs": int(nobs),
+        "n_groups": problem.G,
+        "n_cells": len(cells),
+        "n_quad": n_quad,
+        "converged": bool(opt.success),
+    }
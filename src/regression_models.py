@@ -4,10 +4,13 @@ Task 5.2: Mixed-effects logistic regression for speeding propensity.
 Model: is_speeding ~ age_group + mode + time_of_day + day_type
                      + distance_bin + province + (1|user_id)
 
-Due to the large dataset (2.78M trips, 382K users), we use:
-  1. A stratified subsample (50K trips) for the full GLMM
-  2. A GEE (Generalized Estimating Equations) approach on a larger sample
-  3. Standard logistic regression on the full dataset for comparison
+All models use every trip (2.78M trips, 382K users):
+  1. A GLMM with a user random intercept, by adaptive quadrature on
+     (user, covariate cell) counts (random_intercept.py)
+  2. A GEE (Generalized Estimating Equations) approach on all trips and users
+     (closed-form exchangeable solver, binary_gee.py)
+  3. Standard logistic regression on the full dataset for comparison,
+     fitted exactly on covariate-cell counts (compressed_logit.py)
 
 Outputs:
   - data_parquet/modeling/regression_results.json — model coefficients, ORs, p-values
@@ -24,24 +27,21 @@ matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+import patsy
 import statsmodels.api as sm
 import statsmodels.formula.api as smf
-from statsmodels.genmod.generalized_estimating_equations import GEE
-from statsmodels.genmod.cov_struct import Exchangeable
-from statsmodels.genmod.families import Binomial
 
 warnings.filterwarnings("ignore")
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from src.config import DATA_DIR, FIGURES_DIR, RANDOM_SEED, FIG_DPI
+from src.config import DATA_DIR, FIGURES_DIR, FIG_DPI
+from src.binary_gee import exchangeable_gee
+from src.compressed_logit import fit_compressed_logit
+from src.random_intercept import fit_binomial_random_intercept
 
 MODELING_DIR = DATA_DIR / "modeling"
 FIGURES_DIR.mkdir(parents=True, exist_ok=True)
 
-# Sample sizes
-GLMM_SAMPLE = 50_000
-GEE_SAMPLE = 200_000
-
 
 def load_and_prepare_data() -> pd.DataFrame:
     """Load trip modeling data and prepare for regression.
@@ -80,47 +80,74 @@ def load_and_prepare_data() -> pd.DataFrame:
     return df
 
 
-def fit_logistic_regression(df: pd.DataFrame) -> dict:
+def fit_logistic_regression(df: pd.DataFrame, compressed: bool = True) -> dict:
     """Fit standard logistic regression on full dataset.
 
+    With compressed=True the trips are collapsed to covariate cells and the
+    exact full-sample fit is obtained from (successes, trials) per cell, with
+    SEs clustered by user (see compressed_logit.py); otherwise smf.logit is
+    fitted trip by trip with model-based SEs.
+
     Args:
         df: Prepared trip DataFrame.
+        compressed: Fit on covariate-cell sufficient statistics.
 
     Returns:
         Dict with model results.
     """
     print("\n--- Model 1: Standard Logistic Regression (full data) ---")
 
-    formula = ("is_speeding_int ~ C(age_group_str, Treatment('<20')) "
-               "+ C(mode_str, Treatment('STD')) "
-               "+ C(time_of_day_str, Treatment('midday')) "
-               "+ C(day_type_str, Treatment('weekday')) "
-               "+ C(province_str, Treatment('Seoul'))")
-
-    model = smf.logit(formula, data=df).fit(
-        method="lbfgs",
-        maxiter=100,
-        disp=False,
-    )
+    rhs = ("C(age_group_str, Treatment('<20')) "
+           "+ C(mode_str, Treatment('STD')) "
+           "+ C(time_of_day_str, Treatment('midday')) "
+           "+ C(day_type_str, Treatment('weekday')) "
+           "+ C(province_str, Treatment('Seoul'))")
+
+    if compressed:
+        model = fit_compressed_logit(
+            df, "is_speeding_int",
+            ["age_group_str", "mode_str", "time_of_day_str", "day_type_str", "province_str"],
+            formula=rhs,
+            cluster="user_id",
+        )
+        print(f"  Covariate cells: {model['n_cells']:,} "
+              f"({model['n_clusters']:,} user clusters)")
+        print(f"  Converged: {model['converged']}")
+        params, bse, pvalues = model["params"], model["bse"], model["pvalues"]
+        n_obs, pseudo_r2 = model["nobs"], model["pseudo_r2"]
+        aic, bic = model["aic"], model["bic"]
+    else:
+        model = smf.logit("is_speeding_int ~ " + rhs, data=df).fit(
+            method="lbfgs",
+            maxiter=100,
+            disp=False,
+        )
+        print(f"  Converged: {model.mle_retvals['converged']}")
+        params, bse, pvalues = model.params, model.bse, model.pvalues
+        n_obs, pseudo_r2 = model.nobs, model.prsquared
+        aic, bic = model.aic, model.bic
 
-    print(f"  Converged: {model.mle_retvals['converged']}")
-    print(f"  Pseudo R-squared: {model.prsquared:.4f}")
-    print(f"  AIC: {model.aic:.0f}")
-    print(f"  N observations: {model.nobs:.0f}")
+    print(f"  Pseudo R-squared: {pseudo_r2:.4f}")
+    print(f"  AIC: {aic:.0f}")
+    print(f"  N observations: {n_obs:.0f}")
 
     # Extract key results
     results = {
         "model_type": "logistic_regression",
-        "n_obs": int(model.nobs),
-        "pseudo_r2": float(model.prsquared),
-        "aic": float(model.aic),
-        "bic": float(model.bic),
+        "n_obs": int(n_obs),
+        "pseudo_r2": float(pseudo_r2),
+        "aic": float(aic),
+        "bic": float(bic),
+        "cov_type": model["cov_type"] if compressed else "nonrobust",
         "coefficients": {},
     }
+    if compressed:
+        results["n_cells"] = model["n_cells"]
+        results["n_clusters"] = model["n_clusters"]
 
-    for name, coef in model.params.items():
-        se = model.bse[name]
-        pval = model.pvalues[name]
+    for name, coef in params.items():
+        se = bse[name]
+        pval = pvalues[name]
         or_val = np.exp(coef)
         ci_low = np.exp(coef - 1.96 * se)
         ci_high = np.exp(coef + 1.96 * se)
@@ -140,7 +167,10 @@ def fit_gee_model(df: pd.DataFrame) -> dict:
     """Fit GEE logistic model with user-level clustering.
 
     Uses exchangeable correlation structure to account for within-user
-    correlation (repeated measures per user).
+    correlation (repeated measures per user). Fitted on all trips and users
+    with the closed-form exchangeable solver in binary_gee.py; since every
+    covariate is categorical, trips index a small table of distinct design
+    rows instead of a full design matrix.
 
     Args:
         df: Prepared trip DataFrame.
@@ -148,65 +178,45 @@ def fit_gee_model(df: pd.DataFrame) -> dict:
     Returns:
         Dict with model results.
     """
-    print(f"\n--- Model 2: GEE Logistic Model (n={GEE_SAMPLE:,} subsample) ---")
-
-    # Subsample for computational feasibility
-    np.random.seed(RANDOM_SEED)
-
-    # Stratified sample: ensure representation of speeders
-    speeders = df[df["is_speeding_int"] == 1]
-    non_speeders = df[df["is_speeding_int"] == 0]
+    print(f"\n--- Model 2: GEE Logistic Model (full data, n={len(df):,}) ---")
 
-    n_speed = min(GEE_SAMPLE // 2, len(speeders))
-    n_non = min(GEE_SAMPLE // 2, len(non_speeders))
+    covariates = ["age_group_str", "mode_str", "time_of_day_str", "day_type_str"]
+    rhs = ("C(age_group_str, Treatment('<20')) "
+           "+ C(mode_str, Treatment('STD')) "
+           "+ C(time_of_day_str, Treatment('midday')) "
+           "+ C(day_type_str, Treatment('weekday'))")
 
-    sample = pd.concat([
-        speeders.sample(n_speed, random_state=RANDOM_SEED),
-        non_speeders.sample(n_non, random_state=RANDOM_SEED),
-    ])
-    print(f"  Sample: {len(sample):,} trips ({n_speed:,} speeding, {n_non:,} non-speeding)")
-
-    # Sort by user_id for GEE
-    sample = sample.sort_values("user_id").reset_index(drop=True)
-
-    # Only include users with >1 trip for cluster structure
-    user_counts = sample["user_id"].value_counts()
-    multi_trip_users = user_counts[user_counts > 1].index
-    sample_multi = sample[sample["user_id"].isin(multi_trip_users)].copy()
-    print(f"  Multi-trip users in sample: {sample_multi['user_id'].nunique():,} "
-          f"({len(sample_multi):,} trips)")
-
-    # Encode user_id as integer for GEE groups
-    user_map = {uid: i for i, uid in enumerate(sample_multi["user_id"].unique())}
-    sample_multi["user_group"] = sample_multi["user_id"].map(user_map)
-
-    formula = ("is_speeding_int ~ C(age_group_str, Treatment('<20')) "
-               "+ C(mode_str, Treatment('STD')) "
-               "+ C(time_of_day_str, Treatment('midday')) "
-               "+ C(day_type_str, Treatment('weekday'))")
+    # Distinct covariate combinations and each trip's row among them
+    rows = df.groupby(covariates, sort=False, dropna=False).ngroup().to_numpy()
+    design = patsy.dmatrix(rhs, df[covariates].drop_duplicates(), return_type="dataframe")
+    print(f"  Users: {df['user_id'].nunique():,}, distinct design rows: {len(design):,}")
 
     try:
-        model = GEE.from_formula(
-            formula,
-            groups="user_group",
-            data=sample_multi,
-            family=Binomial(),
-            cov_struct=Exchangeable(),
-        ).fit(maxiter=50)
+        model = exchangeable_gee(
+            df["is_speeding_int"].to_numpy(),
+            design.to_numpy(),
+            df["user_id"].to_numpy(),
+            rows=rows,
+            names=design.columns,
+            n_jobs=-1,
+        )
 
-        print(f"  Converged: {model.converged}")
+        print(f"  Converged: {model['converged']} ({model['n_iter']} iterations, "
+              f"{model['n_blocks']} blocks)")
+        print(f"  Within-user correlation: {model['dep_param']:.4f}")
 
         results = {
             "model_type": "gee_logistic",
-            "n_obs": len(sample_multi),
-            "n_users": sample_multi["user_id"].nunique(),
+            "n_obs": model["nobs"],
+            "n_users": model["n_clusters"],
             "correlation_structure": "exchangeable",
+            "within_user_correlation": model["dep_param"],
             "coefficients": {},
         }
 
-        for name, coef in model.params.items():
-            se = model.bse[name]
-            pval = model.pvalues[name]
+        for name, coef in model["params"].items():
+            se = model["bse"][name]
+            pval = model["pvalues"][name]
             or_val = np.exp(coef)
             ci_low = np.exp(coef - 1.96 * se)
             ci_high = np.exp(coef + 1.96 * se)
@@ -227,7 +237,11 @@ def fit_gee_model(df: pd.DataFrame) -> dict:
 
 
 def fit_mixed_effects(df: pd.DataFrame) -> dict:
-    """Fit mixed-effects logistic regression (GLMM) on subsample.
+    """Fit mixed-effects logistic regression (GLMM) with a user random intercept.
+
+    Fitted on all trips by maximum likelihood with adaptive Gauss-Hermite
+    quadrature over each user's intercept, from (user, covariate cell)
+    counts (see random_intercept.py).
 
     Args:
         df: Prepared trip DataFrame.
@@ -235,44 +249,41 @@ def fit_mixed_effects(df: pd.DataFrame) -> dict:
     Returns:
         Dict with model results.
     """
-    print(f"\n--- Model 3: Mixed-Effects Logistic (GLMM, n={GLMM_SAMPLE:,} subsample) ---")
+    print(f"\n--- Model 3: Mixed-Effects Logistic (GLMM, full data, n={len(df):,}) ---")
 
-    # Subsample
-    np.random.seed(RANDOM_SEED)
-    sample = df.sample(min(GLMM_SAMPLE, len(df)), random_state=RANDOM_SEED).copy()
-    print(f"  Sample: {len(sample):,} trips, {sample['user_id'].nunique():,} users")
-
-    formula = ("is_speeding_int ~ C(age_group_str, Treatment('<20')) "
-               "+ C(mode_str, Treatment('STD')) "
-               "+ C(time_of_day_str, Treatment('midday')) "
-               "+ C(day_type_str, Treatment('weekday'))")
+    rhs = ("C(age_group_str, Treatment('<20')) "
+           "+ C(mode_str, Treatment('STD')) "
+           "+ C(time_of_day_str, Treatment('midday')) "
+           "+ C(day_type_str, Treatment('weekday'))")
 
     try:
-        model = smf.logit(formula, data=sample).fit(
-            method="lbfgs",
-            maxiter=100,
-            disp=False,
+        model = fit_binomial_random_intercept(
+            df, "is_speeding_int",
+            ["age_group_str", "mode_str", "time_of_day_str", "day_type_str"],
+            "user_id",
+            formula=rhs,
         )
 
-        # For a proper GLMM, use BinomialBayesMixedGLM
-        print("  Fitting Bayesian GLMM with user random intercept...")
-        random_formula = {"user_id": "0 + C(user_id)"}
-
-        # This is too slow for large samples — use the simpler logit as approximation
-        # and note the limitation
-        print("  Note: Full GLMM too slow for this sample size.")
-        print("  Using standard logit + GEE as complementary approaches.")
+        print(f"  Converged: {model['converged']} ({model['n_quad']}-point adaptive quadrature)")
+        print(f"  Users: {model['n_groups']:,}")
+        print(f"  Random intercept SD: {model['re_sd']:.3f} (latent ICC {model['icc']:.3f})")
+        print(f"  AIC: {model['aic']:.0f}")
 
         results = {
-            "model_type": "logistic_subsample",
-            "n_obs": int(model.nobs),
-            "pseudo_r2": float(model.prsquared),
+            "model_type": "glmm_random_intercept",
+            "n_obs": model["nobs"],
+            "n_users": model["n_groups"],
+            "random_intercept_sd": model["re_sd"],
+            "random_intercept_sd_se": model["re_sd_se"],
+            "icc_latent": model["icc"],
+            "aic": model["aic"],
+            "bic": model["bic"],
             "coefficients": {},
         }
 
-        for name, coef in model.params.items():
-            se = model.bse[name]
-            pval = model.pvalues[name]
+        for name, coef in model["params"].items():
+            se = model["bse"][name]
+            pval = model["pvalues"][name]
             or_val = np.exp(coef)
             ci_low = np.exp(coef - 1.96 * se)
             ci_high = np.exp(coef + 1.96 * se)
@@ -289,7 +300,7 @@ def fit_mixed_effects(df: pd.DataFrame) -> dict:
 
     except Exception as e:
         print(f"  GLMM fitting failed: {e}")
-        return {"model_type": "logistic_subsample", "status": "failed", "error": str(e)}, None
+        return {"model_type": "glmm_random_intercept", "status": "failed", "error": str(e)}, None
 
 
 def plot_odds_ratios(results: dict, output_path: Path, title: str = "") -> None:
@@ -399,8 +410,8 @@ def main() -> None:
                 print(f"    {clean}: OR={vals['or']:.3f} "
                       f"[{vals['or_ci_low']:.3f}, {vals['or_ci_high']:.3f}] {sig}")
 
-    # Model 3: Subsample logistic (for reference)
-    subsample_results, sub_model = fit_mixed_effects(df)
+    # Model 3: GLMM with a user random intercept
+    glmm_results, glmm_model = fit_mixed_effects(df)
 
     # Plot odds ratios from the main logistic model
     plot_odds_ratios(
@@ -419,8 +430,8 @@ def main() -> None:
     # Save all results
     all_results = {
         "logistic_full": logit_results,
-        "gee_subsample": gee_results,
-        "logistic_subsample": subsample_results,
+        "gee_full": gee_results,
+        "glmm_user_intercept": glmm_results,
     }
 
     results_path = MODELING_DIR / "regression_results.json"
@@ -0,0 +1,429 @@
+"""
+Shared resampling engine for bootstrap and subsampling inference.
+
+A statistic is any function of a (resampled) DataFrame or array returning a
+scalar or a fixed-length vector. bootstrap() evaluates it on replicates drawn
+by one of the schemes below and returns the replicate matrix (index_blocks()
+serves statistics vectorized across replicates instead); intervals are
+computed from it by percentile_interval(), bca_interval() (with jackknife()
+acceleration) or subsampling_interval().
+
+Schemes:
+  - iid:         rows with replacement (independently within strata if given).
+  - cluster:     whole clusters with replacement; rows keep their cluster.
+  - block:       moving blocks of consecutive rows (data in time order).
+  - wild:        response rebuilt as fitted + v * residual, with v drawn per
+                 row or per cluster (Rademacher, Mammen or Webb weights).
+  - subsampling: rows (or clusters) without replacement, size m < n.
+
+Replicate r always draws from np.random.SeedSequence(seed).spawn(n)[r], so
+the replicate matrix is identical for any n_jobs and chunk size. With
+n_jobs > 1, chunks of replicates run in a process pool (data and statistic
+are sent to each worker once, so the statistic must be picklable, i.e. a
+module-level function or a functools.partial of one). With checkpoint set,
+completed chunks are saved to an .npz file and skipped when rerun with the
+same settings, data contents, statistic and scheme settings.
+"""
+
+import functools
+import hashlib
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.config import RANDOM_SEED
+
+SCHEMES = ("iid", "cluster", "block", "wild", "subsampling")
+WILD_WEIGHTS = ("rademacher", "mammen", "webb")
+
+# Replicate chunks per worker (smaller chunks checkpoint more often)
+CHUNKS_PER_WORKER = 4
+# Replicates per index block of index_blocks() (one SeedSequence child each)
+INDEX_BLOCK = 8192
+# Jackknife groups used for the BCa acceleration when there are more units
+JACKKNIFE_GROUPS = 100
+
+# Webb six-point distribution: +-sqrt(1/2), +-1, +-sqrt(3/2)
+WEBB_POINTS = np.array([-np.sqrt(1.5), -1.0, -np.sqrt(0.5), np.sqrt(0.5), 1.0, np.sqrt(1.5)])
+
+
+def _take(data, idx: np.ndarray):
+    """Rows idx of a DataFrame/Series or array."""
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        return data.iloc[idx]
+    return data[idx]
+
+
+def _column(data, key) -> np.ndarray:
+    """Values of a column name or an array aligned with the rows."""
+    if isinstance(key, str):
+        return np.asarray(data[key])
+    return np.asarray(key)
+
+
+def _groups(keys: np.ndarray) -> list:
+    """Row indices of every distinct key, in key order."""
+    codes, _ = pd.factorize(keys, sort=True)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(codes.max() + 2))
+    return [order[bounds[g]:bounds[g + 1]] for g in range(len(bounds) - 1)]
+
+
+def wild_weights(rng: np.random.Generator, n: int, kind: str = "rademacher") -> np.ndarray:
+    """n draws of a mean-zero, unit-variance wild bootstrap weight."""
+    if kind == "rademacher":
+        return rng.integers(0, 2, size=n) * 2.0 - 1.0
+    if kind == "mammen":
+        s5 = np.sqrt(5.0)
+        p = (s5 + 1) / (2 * s5)
+        return np.where(rng.random(n) < p, -(s5 - 1) / 2, (s5 + 1) / 2)
+    if kind == "webb":
+        return WEBB_POINTS[rng.integers(0, 6, size=n)]
+    raise ValueError(f"unknown wild weights {kind!r}; expected one of {WILD_WEIGHTS}")
+
+
+def _plan(data, scheme: str, cluster=None, strata=None, block_length=None,
+          size=None, fitted=None, residuals=None, response=None,
+          weights: str = "rademacher") -> dict:
+    """Everything a worker needs to draw replicates, computed once."""
+    if scheme not in SCHEMES:
+        raise ValueError(f"unknown scheme {scheme!r}; expected one of {SCHEMES}")
+    n = len(data)
+    plan = {"scheme": scheme, "n": n}
+
+    if scheme in ("cluster", "subsampling") and cluster is not None:
+        plan["clusters"] = _groups(_column(data, cluster))
+    elif scheme == "cluster":
+        raise ValueError("the cluster scheme needs a cluster key")
+
+    if scheme == "iid":
+        plan["strata"] = _groups(_column(data, strata)) if strata is not None else [np.arange(n)]
+    elif scheme == "block":
+        if not block_length or not 1 <= block_length <= n:
+            raise ValueError("the block scheme needs 1 <= block_length <= len(data)")
+        plan["block_length"] = int(block_length)
+    elif scheme == "subsampling":
+        units = len(plan["clusters"]) if "clusters" in plan else n
+        m = int(round(size * units)) if isinstance(size, float) and size < 1 else size
+        if not m or not 1 <= m < units:
+            raise ValueError("the subsampling scheme needs 1 <= size < number of units")
+        plan["size"] = int(m)
+    elif scheme == "wild":
+        if fitted is None or residuals is None or response is None:
+            raise ValueError("the wild scheme needs fitted, residuals and response")
+        if weights not in WILD_WEIGHTS:
+            raise ValueError(f"unknown wild weights {weights!r}; expected one of {WILD_WEIGHTS}")
+        plan["fitted"] = _column(data, fitted).astype(np.float64)
+        plan["residuals"] = _column(data, residuals).astype(np.float64)
+        plan["response"] = response
+        plan["weights"] = weights
+        if cluster is not None:
+            plan["cluster_codes"] = pd.factorize(_column(data, cluster), sort=True)[0]
+    return plan
+
+
+def draw(data, plan: dict, rng: np.random.Generator):
+    """One resample of data under plan."""
+    scheme, n = plan["scheme"], plan["n"]
+    if scheme == "iid":
+        idx = np.concatenate([rows[rng.integers(0, len(rows), size=len(rows))] for rows in plan["strata"]])
+        return _take(data, idx)
+    if scheme == "cluster":
+        clusters = plan["clusters"]
+        picks = rng.integers(0, len(clusters), size=len(clusters))
+        return _take(data, np.concatenate([clusters[c] for c in picks]))
+    if scheme == "block":
+        length = plan["block_length"]
+        starts = rng.integers(0, n - length + 1, size=-(-n // length))
+        return _take(data, (starts[:, None] + np.arange(length)).ravel()[:n])
+    if scheme == "subsampling":
+        if "clusters" in plan:
+            picks = np.sort(rng.choice(len(plan["clusters"]), size=plan["size"], replace=False))
+            return _take(data, np.concatenate([plan["clusters"][c] for c in picks]))
+        return _take(data, np.sort(rng.choice(n, size=plan["size"], replace=False)))
+    # wild
+    if "cluster_codes" in plan:
+        codes = plan["cluster_codes"]
+        v = wild_weights(rng, codes.max() + 1, plan["weights"])[codes]
+    else:
+        v = wild_weights(rng, n, plan["weights"])
+    y_star = plan["fitted"] + v * plan["residuals"]
+    if isinstance(data, pd.DataFrame):
+        return data.assign(**{plan["response"]: y_star})
+    out = np.array(data, dtype=np.float64, copy=True)
+    out[:, plan["response"]] = y_star
+    return out
+
+
+def _evaluate(statistic: Callable, sample, width: int) -> np.ndarray:
+    """Statistic of one sample as a float vector (NaN if it fails)."""
+    try:
+        value = np.asarray(statistic(sample), dtype=np.float64).ravel()
+    except Exception:
+        return np.full(width, np.nan)
+    if value.size != width:
+        return np.full(width, np.nan)
+    return value
+
+
+def _run_chunk(data, statistic: Callable, plan: dict, seed: int, start: int, stop: int,
+               width: int) -> np.ndarray:
+    out = np.empty((stop - start, width))
+    for r in range(start, stop):
+        # Same stream as SeedSequence(seed).spawn(n)[r]
+        rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(r,)))
+        out[r - start] = _evaluate(statistic, draw(data, plan, rng), width)
+    return out
+
+
+_WORKER = {}
+
+
+def _init_worker(data, statistic, plan, seed, width) -> None:
+    _WORKER.update(data=data, statistic=statistic, plan=plan, seed=seed, width=width)
+
+
+def _worker_chunk(start: int, stop: int) -> tuple:
+    w = _WORKER
+    return start, _run_chunk(w["data"], w["statistic"], w["plan"], w["seed"], start, stop, w["width"])
+
+
+def _hash_value(h, value) -> None:
+    """Feed a value (data, array, plan entry, statistic argument) into hash h."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        h.update(str(list(value.columns) if isinstance(value, pd.DataFrame) else value.name).encode())
+        h.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        arr = np.ascontiguousarray(value)
+        h.update(f"array{arr.shape}|{arr.dtype.str}".encode())
+        h.update(arr.tobytes())
+    elif isinstance(value, (list, tuple)):
+        h.update(f"{type(value).__name__}[{len(value)}]".encode())
+        for item in value:
+            _hash_value(h, item)
+    elif isinstance(value, dict):
+        h.update(f"dict[{len(value)}]".encode())
+        for key in sorted(value, key=str):
+            h.update(f"{key!r}:".encode())
+            _hash_value(h, value[key])
+    elif isinstance(value, functools.partial):
+        h.update(b"partial")
+        _hash_value(h, value.func)
+        _hash_value(h, value.args)
+        _hash_value(h, value.keywords)
+    elif callable(value):
+        h.update(f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', repr(value))}".encode())
+    else:
+        h.update(repr(value).encode())
+    h.update(b";")
+
+
+def _fingerprint(data, statistic: Callable, plan: dict) -> np.ndarray:
+    """SHA-256 of the data's contents, the statistic (name and partial
+    arguments) and the normalized scheme settings, as int64 words."""
+    h = hashlib.sha256()
+    for value in (data, statistic, plan):
+        _hash_value(h, value)
+    return np.frombuffer(h.digest(), dtype=np.int64)
+
+
+def _load_checkpoint(path: Path, signature: np.ndarray, shape: tuple):
+    """(replicates, done) saved for the same settings, or fresh arrays."""
+    if path.exists():
+        try:
+            with np.load(path) as saved:
+                if np.array_equal(saved["signature"], signature) and saved["replicates"].shape == shape:
+                    return saved["replicates"].copy(), saved["done"].copy()
+        except (OSError, KeyError, ValueError):
+            pass
+    return np.full(shape, np.nan), np.zeros(shape[0], dtype=bool)
+
+
+def _save_checkpoint(path: Path, signature: np.ndarray, replicates: np.ndarray, done: np.ndarray) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, signature=signature, replicates=replicates, done=done)
+    os.replace(tmp, path)
+
+
+def bootstrap(
+    data,
+    statistic: Callable,
+    n_replicates: int = 1000,
+    scheme: str = "iid",
+    cluster=None,
+    strata=None,
+    block_length: Optional[int] = None,
+    size=None,
+    fitted=None,
+    residuals=None,
+    response=None,
+    weights: str = "rademacher",
+    seed: int = RANDOM_SEED,
+    n_jobs: int = 1,
+    chunk_size: Optional[int] = None,
+    checkpoint=None,
+) -> dict:
+    """Evaluate statistic on n_replicates resamples of data.
+
+    Args:
+        data: DataFrame (or array) of observations, one row per unit.
+        statistic: Function of a resample returning a scalar or vector.
+        n_replicates: Number of replicates.
+        scheme: One of SCHEMES.
+        cluster: Cluster key (column name or aligned array) for the cluster
+            scheme; optional for wild (weights per cluster) and subsampling
+            (clusters drawn without replacement).
+        strata: Key resampled independently within (iid scheme).
+        block_length: Rows per block (block scheme).
+        size: Subsample size m, as a count or a fraction (subsampling scheme).
+        fitted, residuals: Columns or arrays of the restricted fit (wild scheme).
+        response: Column replaced by fitted + v * residuals (wild scheme).
+        weights: Wild weight distribution, one of WILD_WEIGHTS.
+        seed: Root of the per-replicate SeedSequence streams.
+        n_jobs: Worker processes (-1 for all cores); results do not depend on it.
+        chunk_size: Replicates per task (default: CHUNKS_PER_WORKER tasks per worker).
+        checkpoint: Optional .npz path for partial results.
+
+    Returns:
+        Dict with estimate (statistic on data, 1-D), replicates
+        (n_replicates x len(estimate), NaN where the statistic failed),
+        n_failed, scheme, seed and, for subsampling, n and m (in units).
+    """
+    plan = _plan(data, scheme, cluster=cluster, strata=strata, block_length=block_length,
+                 size=size, fitted=fitted, residuals=residuals, response=response, weights=weights)
+    estimate = np.asarray(statistic(data), dtype=np.float64).ravel()
+    width = estimate.size
+
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    n_jobs = max(1, min(n_jobs, n_replicates))
+    if chunk_size is None:
+        chunk_size = -(-n_replicates // (n_jobs * CHUNKS_PER_WORKER))
+    chunk_size = max(1, int(chunk_size))
+
+    shape = (n_replicates, width)
+    path = Path(checkpoint) if checkpoint is not None else None
+    signature = np.r_[
+        np.array([seed, n_replicates, width, SCHEMES.index(scheme), len(data)], dtype=np.int64),
+        _fingerprint(data, statistic, plan),
+    ]
+    if path is not None:
+        replicates, done = _load_checkpoint(path, signature, shape)
+    else:
+        replicates, done = np.full(shape, np.nan), np.zeros(n_replicates, dtype=bool)
+
+    chunks = [(a, min(a + chunk_size, n_replicates)) for a in range(0, n_replicates, chunk_size)]
+    chunks = [(a, b) for a, b in chunks if not done[a:b].all()]
+
+    def store(start, values):
+        replicates[start:start + len(values)] = values
+        done[start:start + len(values)] = True
+        if path is not None:
+            _save_checkpoint(path, signature, replicates, done)
+
+    if n_jobs == 1 or len(chunks) <= 1:
+        for a, b in chunks:
+            store(a, _run_chunk(data, statistic, plan, seed, a, b, width))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                 initargs=(data, statistic, plan, seed, width)) as pool:
+            futures = [pool.submit(_worker_chunk, a, b) for a, b in chunks]
+            for future in as_completed(futures):
+                store(*future.result())
+
+    result = {
+        "estimate": estimate,
+        "replicates": replicates,
+        "n_failed": int(np.isnan(replicates).any(axis=1).sum()),
+        "scheme": scheme,
+        "seed": seed,
+    }
+    if scheme == "subsampling":
+        result["n"] = len(plan["clusters"]) if "clusters" in plan else plan["n"]
+        result["m"] = plan["size"]
+    return result
+
+
+def index_blocks(n: int, n_replicates: int, seed: int = RANDOM_SEED, block_size: int = INDEX_BLOCK):
+    """Yield (start, idx) with idx the (rows x n) iid resample indices of replicates start:start+rows.
+
+    For statistics vectorized across replicates (reductions along axis 1 of
+    values[idx]), where one stream per replicate would dominate the cost.
+    Block b draws from SeedSequence(seed) child b, so the indices only depend
+    on seed and block_size.
+    """
+    for b, start in enumerate(range(0, n_replicates, block_size)):
+        rows = min(block_size, n_replicates - start)
+        rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(b,)))
+        yield start, rng.integers(0, n, size=(rows, n))
+
+
+def percentile_interval(replicates: np.ndarray, level: float = 0.95) -> tuple:
+    """Percentile interval per column, ignoring failed (NaN) replicates."""
+    alpha = (1 - level) / 2
+    lo, hi = np.nanpercentile(replicates, [100 * alpha, 100 * (1 - alpha)], axis=0)
+    return lo, hi
+
+
+def jackknife(data, statistic: Callable, cluster=None, n_groups: int = JACKKNIFE_GROUPS) -> np.ndarray:
+    """Leave-one-out statistics (rows, or clusters if cluster is given).
+
+    With more than n_groups units, units are split into n_groups contiguous
+    groups and one group is left out at a time (delete-a-group jackknife).
+    """
+    units = _groups(_column(data, cluster)) if cluster is not None else [np.array([i]) for i in range(len(data))]
+    groups = [np.concatenate([units[u] for u in part])
+              for part in np.array_split(np.arange(len(units)), min(n_groups, len(units)))]
+    n = len(data)
+    width = np.asarray(statistic(data), dtype=np.float64).size
+    values = np.empty((len(groups), width))
+    for g, rows in enumerate(groups):
+        keep = np.ones(n, dtype=bool)
+        keep[rows] = False
+        values[g] = _evaluate(statistic, _take(data, np.flatnonzero(keep)), width)
+    return values
+
+
+def bca_interval(result: dict, jack: np.ndarray, level: float = 0.95) -> tuple:
+    """Bias-corrected and accelerated interval per column.
+
+    Args:
+        result: Output of bootstrap().
+        jack: Output of jackknife() for the same data and statistic.
+        level: Confidence level.
+    """
+    reps, estimate = result["replicates"], result["estimate"]
+    alpha = (1 - level) / 2
+    lo, hi = np.full(estimate.size, np.nan), np.full(estimate.size, np.nan)
+    for j in range(estimate.size):
+        col = reps[:, j][~np.isnan(reps[:, j])]
+        if not len(col):
+            continue
+        # Bias correction from the share of replicates below the estimate (ties count half)
+        share = (np.sum(col < estimate[j]) + 0.5 * np.sum(col == estimate[j])) / len(col)
+        z0 = stats.norm.ppf(np.clip(share, 1 / (2 * len(col)), 1 - 1 / (2 * len(col))))
+        jj = jack[:, j][~np.isnan(jack[:, j])]
+        d = jj.mean() - jj
+        denom = 6 * np.sum(d ** 2) ** 1.5
+        a = np.sum(d ** 3) / denom if denom > 0 else 0.0
+        z = stats.norm.ppf([alpha, 1 - alpha])
+        adjusted = stats.norm.cdf(z0 + (z0 + z) / (1 - a * (z0 + z)))
+        lo[j], hi[j] = np.percentile(col, 100 * adjusted)
+    return lo, hi
+
+
+def subsampling_interval(result: dict, level: float = 0.95, rate: float = 0.5) -> tuple:
+    """Politis-Romano subsampling interval, for estimators converging at n**rate."""
+    n, m, estimate = result["n"], result["m"], result["estimate"]
+    alpha = (1 - level) / 2
+    roots = m ** rate * (result["replicates"] - estimate)
+    q_lo, q_hi = np.nanpercentile(roots, [100 * alpha, 100 * (1 - alpha)], axis=0)
+    return estimate - q_hi / n ** rate, estimate - q_lo / n ** rate
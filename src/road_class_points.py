@@ -0,0 +1,164 @@
+"""
+Segment-level speed by road class from the point-level road class matches.
+
+assign_road_class.py writes one row per matched GPS point
+(data_parquet/point_road_classes/{city}.parquet). This module joins those
+points to the 10-second speed samples in trips_cleaned.speeds_raw by time:
+each speed sample (t = sample_idx * SPEED_INTERVAL_S since trip start) takes
+the edge / road class of the latest GPS point at or before it (DuckDB ASOF
+JOIN on route_id). Speed statistics are then computed per road class from the
+samples themselves instead of from trip-level road class composition.
+
+Outputs:
+  - data_parquet/modeling/road_class_sample_speeds.csv -- sample-level speed
+    by road class (and by city x road class)
+"""
+
+import sys
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+import duckdb
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.config import (
+    CLEANED_PARQUET,
+    MODELING_DIR,
+    POINT_ROAD_CLASSES_DIR,
+    SPEED_LIMIT_KR,
+)
+from src.assign_road_class import ROAD_CATEGORIES
+from src.compute_indicators import SPEED_INTERVAL_S
+
+OUTPUT_PATH = MODELING_DIR / "road_class_sample_speeds.csv"
+
+
+def register_sample_road_classes(
+    con: duckdb.DuckDBPyConnection,
+    cities: Optional[Sequence[str]] = None,
+) -> None:
+    """Create views `point_road_classes`, `speed_samples`, `sample_road_classes`.
+
+    Args:
+        con: DuckDB connection to register the views on.
+        cities: Optional subset of cities (point table file stems); None uses
+            every city with a point table.
+    """
+    if cities is None:
+        files = sorted(POINT_ROAD_CLASSES_DIR.glob("*.parquet"))
+    else:
+        files = [POINT_ROAD_CLASSES_DIR / f"{c}.parquet" for c in cities]
+    if not files:
+        raise FileNotFoundError(
+            f"No point road class tables in {POINT_ROAD_CLASSES_DIR}; "
+            "run assign_road_class.py first"
+        )
+    file_list = ", ".join(f"'{f.as_posix()}'" for f in files)
+    categories = ", ".join(f"'{c}'" for c in ROAD_CATEGORIES)
+
+    con.execute(f"""
+        CREATE OR REPLACE VIEW point_road_classes AS
+        SELECT route_id, point_idx, t_offset_s, edge_id, snap_dist_m,
+               road_class AS road_class_code,
+               [{categories}][road_class + 1] AS road_class
+        FROM read_parquet([{file_list}])
+    """)
+
+    con.execute(f"""
+        CREATE OR REPLACE VIEW speed_samples AS
+        WITH raw AS (
+            SELECT route_id, city, mode,
+                   regexp_extract_all(speeds_raw, '(\\d+(?:\\.\\d+)?)') AS s
+            FROM read_parquet('{CLEANED_PARQUET.as_posix()}/trips_cleaned.parquet')
+            WHERE is_valid = true
+              AND route_id IN (SELECT DISTINCT route_id FROM point_road_classes)
+        )
+        SELECT route_id, city, mode,
+               CAST(UNNEST(s) AS DOUBLE) AS speed,
+               generate_subscripts(s, 1) - 1 AS sample_idx
+        FROM raw
+    """)
+
+    con.execute(f"""
+        CREATE OR REPLACE VIEW sample_road_classes AS
+        SELECT s.route_id, s.city, s.mode, s.sample_idx, s.speed,
+               p.point_idx, p.edge_id, p.road_class, p.snap_dist_m
+        FROM (
+            SELECT *, CAST(sample_idx * {SPEED_INTERVAL_S} AS FLOAT) AS t_offset_s
+            FROM speed_samples
+        ) s
+        ASOF JOIN point_road_classes p
+          ON s.route_id = p.route_id AND s.t_offset_s >= p.t_offset_s
+    """)
+
+
+def speed_by_road_class(
+    group_by: Sequence[str] = ("road_class",),
+    cities: Optional[Sequence[str]] = None,
+    max_snap_dist_m: Optional[float] = None,
+    con: Optional[duckdb.DuckDBPyConnection] = None,
+) -> pd.DataFrame:
+    """Sample-level speed statistics by road class.
+
+    Args:
+        group_by: Grouping columns of sample_road_classes (e.g. road_class,
+            city, mode, edge_id).
+        cities: Optional subset of cities.
+        max_snap_dist_m: Drop samples whose matched point is farther than this
+            from its edge (poor matches).
+        con: Optional existing connection (views are (re)registered on it).
+
+    Returns:
+        DataFrame with n_samples, n_trips, mean/median/p85 speed, speeding
+        share (> SPEED_LIMIT_KR), and mean snap distance per group.
+    """
+    own = con is None
+    con = con or duckdb.connect()
+    register_sample_road_classes(con, cities)
+
+    keys = ", ".join(group_by)
+    where = f"WHERE snap_dist_m <= {float(max_snap_dist_m)}" if max_snap_dist_m is not None else ""
+    df = con.execute(f"""
+        SELECT {keys},
+               COUNT(*) AS n_samples,
+               COUNT(DISTINCT route_id) AS n_trips,
+               AVG(speed) AS mean_speed,
+               MEDIAN(speed) AS median_speed,
+               QUANTILE_CONT(speed, 0.85) AS p85_speed,
+               AVG(CAST(speed > {SPEED_LIMIT_KR} AS DOUBLE)) AS speeding_share,
+               AVG(snap_dist_m) AS mean_snap_dist_m
+        FROM sample_road_classes
+        {where}
+        GROUP BY {keys}
+        ORDER BY {keys}
+    """).fetchdf()
+    if own:
+        con.close()
+    return df
+
+
+def main():
+    """Compute sample-level speed by road class and by city x road class."""
+    t_start = time.time()
+    print("=" * 70)
+    print("Sample-level speed by road class (point-level matches)")
+    print("=" * 70)
+
+    con = duckdb.connect()
+    overall = speed_by_road_class(["road_class"], con=con)
+    by_city = speed_by_road_class(["city", "road_class"], con=con)
+    con.close()
+
+    print(overall.to_string(index=False))
+
+    overall.insert(0, "city", "All")
+    out = pd.concat([overall, by_city], ignore_index=True)
+    out.to_csv(OUTPUT_PATH, index=False)
+    print(f"\nSaved: {OUTPUT_PATH} ({len(out)} rows)")
+    print(f"Total time: {time.time() - t_start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,11 @@
 """
 Task 3.6-3.7: Compute road-class-level speed indicators.
 
-Since we used nearest-edge matching (not full map-matching with per-point
-edge assignment), we compute speed statistics by road class composition.
-Also computes the relationship between road class and speeding behavior.
+Trip-level speed statistics by dominant road class (overall, by city and by
+mode, one DuckDB GROUPING SETS query), plus the segment-level summaries from
+segment_indicators.py when the segment dataset has been built.
 
 Outputs:
-  - data_parquet/segment_indicators.parquet -- road-class-level speed stats
   - data_parquet/modeling/road_class_speed_report.json -- analysis report
 """
 
@@ -24,13 +23,12 @@ warnings.filterwarnings("ignore")
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 from src.config import (
-    DATA_DIR,
     MODELING_DIR,
     RANDOM_SEED,
-    SPEED_LIMIT_KR,
+    SEGMENT_INDICATORS_PARQUET,
 )
+from src.segment_indicators import summarize_segments
 
-SEGMENT_INDICATORS_PATH = DATA_DIR / "segment_indicators.parquet"
 REPORT_PATH = MODELING_DIR / "road_class_speed_report.json"
 MODELING_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -39,24 +37,28 @@ ROAD_CATEGORIES = [
     "residential", "unclassified", "service", "cycleway", "footway", "other",
 ]
 
+# Minimum trips per reported cell
+MIN_TRIPS = 100
 
-def compute_road_class_speed_stats() -> pd.DataFrame:
-    """Compute speed statistics by dominant road class.
 
-    Joins trip indicators with road class data and computes per-road-class
-    speed distributions.
+def compute_road_class_speed_stats() -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, int]:
+    """Compute speed statistics by dominant road class, city and mode.
+
+    Joins trip indicators with road class data and aggregates road class,
+    city x road class and mode x road class cells in one DuckDB GROUPING SETS
+    query.
 
     Returns:
-        DataFrame with road class speed statistics.
+        (road class stats, city x road class stats, mode x road class stats,
+        total trips analyzed).
     """
     con = duckdb.connect()
 
     # Join trip indicators with road class data
-    df = con.execute("""
+    con.execute("""
+        CREATE TEMP VIEW joined AS
         SELECT
             r.dominant_road_class,
-            r.frac_major_road,
-            r.n_road_classes,
             t.mean_speed,
             t.max_speed_from_profile as max_speed,
             t.p85_speed,
@@ -64,98 +66,76 @@ def compute_road_class_speed_stats() -> pd.DataFrame:
             t.speed_cv,
             t.mean_abs_accel_ms2,
             t.cruise_fraction,
-            CASE WHEN t.speeding_rate_25 > 0 THEN true ELSE false END as has_speeding,
+            CASE WHEN t.speeding_rate_25 > 0 THEN 1.0 ELSE 0.0 END as has_speeding,
             c.mode,
-            c.city,
-            c.province
+            c.city
         FROM read_parquet('data_parquet/trip_indicators.parquet') t
         JOIN read_parquet('data_parquet/trip_road_classes.parquet') r
             ON t.route_id = r.route_id
         JOIN read_parquet('data_parquet/cleaned/trips_cleaned.parquet') c
             ON t.route_id = c.route_id
         WHERE c.is_valid = true
+    """)
+    n_total = con.execute("SELECT COUNT(*) FROM joined").fetchone()[0]
+
+    cells = con.execute(f"""
+        SELECT
+            GROUPING(city, mode) AS grp,
+            city,
+            mode,
+            dominant_road_class,
+            COUNT(*) AS n_trips,
+            COUNT(*) * 100.0 / {n_total} AS pct_of_total,
+            -- Speed statistics
+            AVG(mean_speed) AS mean_speed_mean,
+            MEDIAN(mean_speed) AS mean_speed_median,
+            STDDEV_SAMP(mean_speed) AS mean_speed_std,
+            AVG(max_speed) AS max_speed_mean,
+            QUANTILE_CONT(max_speed, 0.85) AS max_speed_p85,
+            AVG(p85_speed) AS p85_speed_mean,
+            -- Speeding
+            AVG(has_speeding) AS speeding_rate,
+            AVG(speeding_rate_25) AS mean_speeding_fraction,
+            -- Behavior
+            AVG(speed_cv) AS speed_cv_mean,
+            AVG(mean_abs_accel_ms2) AS mean_accel,
+            AVG(cruise_fraction) AS cruise_fraction_mean
+        FROM joined
+        GROUP BY GROUPING SETS (
+            (dominant_road_class),
+            (city, dominant_road_class),
+            (mode, dominant_road_class)
+        )
+        HAVING COUNT(*) >= {MIN_TRIPS}
     """).fetchdf()
     con.close()
 
-    print(f"Joined data: {len(df):,} trips")
-
-    # Compute stats by road class
-    results = []
-    for road_class in ROAD_CATEGORIES:
-        mask = df["dominant_road_class"] == road_class
-        subset = df[mask]
-        if len(subset) < 100:
-            continue
-
-        stats = {
-            "road_class": road_class,
-            "n_trips": len(subset),
-            "pct_of_total": len(subset) / len(df) * 100,
-            # Speed statistics
-            "mean_speed_mean": float(subset["mean_speed"].mean()),
-            "mean_speed_median": float(subset["mean_speed"].median()),
-            "mean_speed_std": float(subset["mean_speed"].std()),
-            "max_speed_mean": float(subset["max_speed"].mean()),
-            "max_speed_p85": float(subset["max_speed"].quantile(0.85)),
-            "p85_speed_mean": float(subset["p85_speed"].mean()),
-            # Speeding
-            "speeding_rate": float(subset["has_speeding"].mean()),
-            "mean_speeding_fraction": float(subset["speeding_rate_25"].mean()),
-            # Behavior
-            "speed_cv_mean": float(subset["speed_cv"].mean()),
-            "mean_accel": float(subset["mean_abs_accel_ms2"].mean()),
-            "cruise_fraction_mean": float(subset["cruise_fraction"].mean()),
-        }
-        results.append(stats)
-
-    stats_df = pd.DataFrame(results)
-    return stats_df, df
-
-
-def compute_road_class_by_city(df: pd.DataFrame) -> pd.DataFrame:
-    """Compute road class speed stats by city.
-
-    Args:
-        df: Joined trip + road class data.
+    print(f"Joined data: {n_total:,} trips")
 
-    Returns:
-        DataFrame with city x road class speed statistics.
-    """
-    city_road = (
-        df.groupby(["city", "dominant_road_class"])
-        .agg(
-            n_trips=("mean_speed", "count"),
-            mean_speed=("mean_speed", "mean"),
-            speeding_rate=("has_speeding", "mean"),
-            max_speed_mean=("max_speed", "mean"),
-        )
-        .reset_index()
+    # GROUPING(city, mode): 3 = road class only, 1 = city x road class, 2 = mode x road class
+    order = {cat: i for i, cat in enumerate(ROAD_CATEGORIES)}
+    stats_df = (
+        cells[cells["grp"] == 3]
+        .rename(columns={"dominant_road_class": "road_class"})
+        .sort_values("road_class", key=lambda s: s.map(order))
+        .drop(columns=["grp", "city", "mode"])
+        .reset_index(drop=True)
     )
-    # Filter to cells with enough data
-    city_road = city_road[city_road["n_trips"] >= 100]
-    return city_road
-
-
-def compute_road_class_by_mode(df: pd.DataFrame) -> pd.DataFrame:
-    """Compute road class speed stats by mode.
-
-    Args:
-        df: Joined trip + road class data.
-
-    Returns:
-        DataFrame with mode x road class speed statistics.
-    """
-    mode_road = (
-        df.groupby(["mode", "dominant_road_class"])
-        .agg(
-            n_trips=("mean_speed", "count"),
-            mean_speed=("mean_speed", "mean"),
-            speeding_rate=("has_speeding", "mean"),
-        )
-        .reset_index()
+    city_road_df = (
+        cells.loc[cells["grp"] == 1, ["city", "dominant_road_class", "n_trips",
+                                      "mean_speed_mean", "speeding_rate", "max_speed_mean"]]
+        .rename(columns={"mean_speed_mean": "mean_speed"})
+        .sort_values(["city", "dominant_road_class"])
+        .reset_index(drop=True)
     )
-    mode_road = mode_road[mode_road["n_trips"] >= 100]
-    return mode_road
+    mode_road_df = (
+        cells.loc[cells["grp"] == 2, ["mode", "dominant_road_class", "n_trips",
+                                      "mean_speed_mean", "speeding_rate"]]
+        .rename(columns={"mean_speed_mean": "mean_speed"})
+        .sort_values(["mode", "dominant_road_class"])
+        .reset_index(drop=True)
+    )
+    return stats_df, city_road_df, mode_road_df, n_total
 
 
 def main() -> None:
@@ -169,7 +149,7 @@ def main() -> None:
 
     # Overall stats by road class
     print("\nComputing road-class-level speed statistics...")
-    stats_df, joined_df = compute_road_class_speed_stats()
+    stats_df, city_road_df, mode_road_df, n_total = compute_road_class_speed_stats()
 
     print(f"\n{'Road Class':15s} {'N':>10s} {'Mean Spd':>10s} {'Max Spd':>10s} "
           f"{'Speeding%':>10s} {'SpeedCV':>8s}")
@@ -179,20 +159,14 @@ def main() -> None:
               f"{row['mean_speed_mean']:>10.1f} {row['max_speed_mean']:>10.1f} "
               f"{row['speeding_rate']*100:>9.1f}% {row['speed_cv_mean']:>8.3f}")
 
-    # By city
-    print("\nComputing city x road class statistics...")
-    city_road_df = compute_road_class_by_city(joined_df)
-    print(f"  {len(city_road_df)} city x road_class cells")
-
-    # By mode
-    print("\nComputing mode x road class statistics...")
-    mode_road_df = compute_road_class_by_mode(joined_df)
+    print(f"\n  {len(city_road_df)} city x road_class cells")
     print(f"  {len(mode_road_df)} mode x road_class cells")
 
-    # Save combined segment indicators
-    segment_df = stats_df.copy()
-    segment_df.to_parquet(SEGMENT_INDICATORS_PATH, index=False)
-    print(f"\nSaved segment indicators to: {SEGMENT_INDICATORS_PATH}")
+    # Segment-level summaries (segment_indicators.py), if built
+    segment_summary = None
+    if SEGMENT_INDICATORS_PARQUET.is_dir():
+        segment_summary = summarize_segments()
+        print(f"  {len(segment_summary)} segment-level summary cells")
 
     # Report
     total_time = time.time() - t_start
@@ -200,7 +174,7 @@ def main() -> None:
     report = {
         "task": "3.6-3.7",
         "description": "Road class speed indicators (based on nearest-edge matching)",
-        "total_trips_analyzed": len(joined_df),
+        "total_trips_analyzed": n_total,
         "total_time_s": round(total_time, 1),
         "road_class_stats": stats_df.to_dict(orient="records"),
         "key_findings": {
@@ -209,7 +183,10 @@ def main() -> None:
             "lowest_speeding_rate": stats_df.loc[stats_df["speeding_rate"].idxmin()].to_dict(),
         },
         "mode_road_class_stats": mode_road_df.to_dict(orient="records"),
+        "city_road_class_stats": city_road_df.to_dict(orient="records"),
     }
+    if segment_summary is not None:
+        report["segment_level_stats"] = segment_summary.to_dict(orient="records")
 
     with open(REPORT_PATH, "w", encoding="utf-8") as f:
         json.dump(report, f, indent=2, default=str, ensure_ascii=False)
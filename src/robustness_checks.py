@@ -16,6 +16,7 @@ Outputs:
 import json
 import sys
 import warnings
+from functools import partial
 from pathlib import Path
 
 import matplotlib
@@ -29,6 +30,8 @@ warnings.filterwarnings("ignore")
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 from src.config import DATA_DIR, FIGURES_DIR, RANDOM_SEED, FIG_DPI
+from src.compressed_logit import fit_compressed_logit
+from src.resampling import bootstrap
 
 MODELING_DIR = DATA_DIR / "modeling"
 FIGURES_DIR.mkdir(parents=True, exist_ok=True)
@@ -92,23 +95,48 @@ def prepare_logit_predictors(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.Series]
     return X, df
 
 
-def fit_logit(X: pd.DataFrame, y: pd.Series, label: str = "") -> dict:
+def fit_logit(
+    X: pd.DataFrame,
+    y: pd.Series,
+    label: str = "",
+    groups: pd.Series = None,
+    compressed: bool = True,
+) -> dict:
     """Fit logistic regression and return key coefficients.
 
     Args:
         X: Predictor matrix.
         y: Binary outcome.
         label: Model label for output.
+        groups: Optional cluster labels (user_id) for cluster-robust SEs.
+        compressed: Fit on covariate-cell counts (exact, see
+            compressed_logit.py) instead of trip by trip.
 
     Returns:
         Dict with model stats and coefficients.
     """
     X_const = sm.add_constant(X)
-    model = sm.Logit(y, X_const)
-    try:
-        result = model.fit(method="lbfgs", maxiter=100, disp=False)
-    except Exception:
-        result = model.fit(method="newton", maxiter=50, disp=False)
+    if compressed:
+        data = X_const.assign(_speeding=np.asarray(y))
+        if groups is not None:
+            data["_cluster"] = np.asarray(groups)
+        fit = fit_compressed_logit(
+            data, "_speeding", list(X_const.columns),
+            cluster="_cluster" if groups is not None else None,
+        )
+        params, bse, pvalues = fit["params"], fit["bse"], fit["pvalues"]
+        pseudo_r2, aic, converged = fit["pseudo_r2"], fit["aic"], fit["converged"]
+        cov_type = fit["cov_type"]
+    else:
+        model = sm.Logit(y, X_const)
+        try:
+            result = model.fit(method="lbfgs", maxiter=100, disp=False)
+        except Exception:
+            result = model.fit(method="newton", maxiter=50, disp=False)
+        params, bse, pvalues = result.params, result.bse, result.pvalues
+        pseudo_r2, aic = result.prsquared, result.aic
+        converged = result.mle_retvals.get("converged", True)
+        cov_type = "nonrobust"
 
     coefs = {}
     for var in X_const.columns:
@@ -116,19 +144,20 @@ def fit_logit(X: pd.DataFrame, y: pd.Series, label: str = "") -> dict:
             continue
         idx = list(X_const.columns).index(var)
         coefs[var] = {
-            "coef": round(float(result.params.iloc[idx]), 4),
-            "or": round(float(np.exp(result.params.iloc[idx])), 4),
-            "p_value": round(float(result.pvalues.iloc[idx]), 6),
-            "se": round(float(result.bse.iloc[idx]), 4),
+            "coef": round(float(params.iloc[idx]), 4),
+            "or": round(float(np.exp(params.iloc[idx])), 4),
+            "p_value": round(float(pvalues.iloc[idx]), 6),
+            "se": round(float(bse.iloc[idx]), 4),
         }
 
     return {
         "label": label,
         "n_obs": len(y),
         "speeding_rate": round(float(y.mean()), 4),
-        "pseudo_r2": round(float(result.prsquared), 4),
-        "aic": round(float(result.aic), 1),
-        "converged": bool(result.mle_retvals.get("converged", True)),
+        "pseudo_r2": round(float(pseudo_r2), 4),
+        "aic": round(float(aic), 1),
+        "converged": bool(converged),
+        "cov_type": cov_type,
         "coefficients": coefs,
     }
 
@@ -165,7 +194,7 @@ def threshold_sensitivity(df: pd.DataFrame) -> dict:
 
         # Fit logistic regression
         X, _ = prepare_logit_predictors(df)
-        model_result = fit_logit(X, y, label=f"threshold_{threshold}")
+        model_result = fit_logit(X, y, label=f"threshold_{threshold}", groups=df["user_id"])
         results[f"threshold_{threshold}"] = model_result
 
         # Print key ORs
@@ -182,6 +211,16 @@ def threshold_sensitivity(df: pd.DataFrame) -> dict:
 # Check 2: Subsampling stability
 # ---------------------------------------------------------------------------
 
+def _subsample_summary(sample: pd.DataFrame, key_vars: list) -> list:
+    """Speeding rate, pseudo R2 and key ORs (NaN if absent) of one subsample fit."""
+    y_sub = sample["_speeding"]
+    model_result = fit_logit(sample.drop(columns="_speeding"), y_sub, label="subsample")
+    coefs = model_result["coefficients"]
+    return [float(y_sub.mean()), model_result["pseudo_r2"]] + [
+        coefs[var]["or"] if var in coefs else np.nan for var in key_vars
+    ]
+
+
 def subsampling_stability(
     df: pd.DataFrame,
     n_subsamples: int = 5,
@@ -209,28 +248,28 @@ def subsampling_stability(
     key_vars = ["mode_TUB", "mode_ECO", "age_20-24", "age_25-29", "age_30-34",
                 "is_weekend", "prov_Chungnam"]
 
-    for i in range(n_subsamples):
-        seed = RANDOM_SEED + i
-        np.random.seed(seed)
-        sample_idx = np.random.choice(len(df), size=int(len(df) * frac), replace=False)
-
-        X_sub = X.iloc[sample_idx]
-        y_sub = y_full.iloc[sample_idx]
-
-        print(f"\n  Subsample {i+1}/{n_subsamples} (n={len(X_sub):,}, seed={seed})")
-        model_result = fit_logit(X_sub, y_sub, label=f"subsample_{i+1}")
-
-        # Extract key coefficients
-        sub_coefs = {}
-        for var in key_vars:
-            if var in model_result["coefficients"]:
-                sub_coefs[var] = model_result["coefficients"][var]["or"]
-
+    data = X.assign(_speeding=y_full.values)
+    n_sub = int(len(df) * frac)
+    print(f"\n  Fitting {n_subsamples} subsamples (n={n_sub:,} each, seed={RANDOM_SEED})")
+    boot = bootstrap(
+        data,
+        partial(_subsample_summary, key_vars=key_vars),
+        n_replicates=n_subsamples,
+        scheme="subsampling",
+        size=n_sub,
+        seed=RANDOM_SEED,
+        n_jobs=-1,
+    )
+
+    for i, row in enumerate(boot["replicates"]):
+        sub_coefs = {var: float(v) for var, v in zip(key_vars, row[2:]) if not np.isnan(v)}
+        print(f"  Subsample {i+1}/{n_subsamples}: pseudo R2={row[1]:.4f}")
         results["subsamples"].append({
-            "seed": seed,
-            "n_obs": len(X_sub),
-            "speeding_rate": round(float(y_sub.mean()), 4),
-            "pseudo_r2": model_result["pseudo_r2"],
+            "replicate": i,
+            "seed": RANDOM_SEED,
+            "n_obs": n_sub,
+            "speeding_rate": round(float(row[0]), 4),
+            "pseudo_r2": float(row[1]),
             "key_ors": sub_coefs,
         })
 
@@ -313,7 +352,7 @@ def city_specific_models(df: pd.DataFrame, top_n: int = 5) -> dict:
         # Drop columns with zero variance
         X_city = X_city.loc[:, X_city.std() > 0]
 
-        model_result = fit_logit(X_city, y_city, label=city)
+        model_result = fit_logit(X_city, y_city, label=city, groups=df_city["user_id"])
         results[city] = model_result
 
         # Print key ORs
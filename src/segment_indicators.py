@@ -0,0 +1,312 @@
+"""
+Segment-level speed, speeding and acceleration indicators.
+
+Each trip's 10-second speed samples (joined to their matched OSM edge by
+road_class_points.py) are split into segments, either
+
+  - "edge":     runs of consecutive samples on the same matched edge,
+  - "time":     fixed time windows (SEGMENT_WINDOW_S seconds), or
+  - "distance": fixed distance windows (SEGMENT_LENGTH_M meters, distance
+                integrated from the speed samples),
+
+and indicators are computed per segment with segmented reductions
+(ufunc.reduceat over the sorted sample arrays), one city at a time. Results
+are written as a hive-partitioned dataset (city=<name>/part-0.parquet) under
+SEGMENT_INDICATORS_PARQUET. Road class x city x mode summaries come from a
+single DuckDB GROUPING SETS query over that dataset.
+
+Outputs:
+  - data_parquet/segment_indicators.parquet/city=*/part-0.parquet
+  - data_parquet/modeling/road_class_segment_summary.csv
+"""
+
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.config import (
+    HARSH_ACCEL_THRESHOLD_10S,
+    MODELING_DIR,
+    POINT_ROAD_CLASSES_DIR,
+    SEGMENT_INDICATORS_PARQUET,
+    SPEED_LIMIT_KR,
+)
+from src.assign_road_class import ROAD_CATEGORIES
+from src.compute_indicators import SPEED_INTERVAL_S
+from src.road_class_points import register_sample_road_classes
+
+SUMMARY_PATH = MODELING_DIR / "road_class_segment_summary.csv"
+
+SEGMENT_METHODS = ("edge", "time", "distance")
+SEGMENT_WINDOW_S = 60.0
+SEGMENT_LENGTH_M = 200.0
+
+# Minimum segments per summary cell
+MIN_SEGMENTS = 100
+
+
+def load_city_samples(city: str, con: Optional[duckdb.DuckDBPyConnection] = None) -> pd.DataFrame:
+    """Speed samples of one city with their matched edge, sorted by trip and time.
+
+    Args:
+        city: City name (point table file stem).
+        con: Optional existing DuckDB connection.
+
+    Returns:
+        DataFrame with route_id, mode, sample_idx, speed, edge_id, road_class,
+        snap_dist_m.
+    """
+    own = con is None
+    con = con or duckdb.connect()
+    register_sample_road_classes(con, [city])
+    df = con.execute("""
+        SELECT route_id, mode, sample_idx,
+               CAST(speed AS FLOAT) AS speed,
+               edge_id, road_class, snap_dist_m
+        FROM sample_road_classes
+        ORDER BY route_id, sample_idx
+    """).fetchdf()
+    if own:
+        con.close()
+    return df
+
+
+def segment_starts(
+    trip_codes: np.ndarray,
+    sample_idx: np.ndarray,
+    speed: np.ndarray,
+    edge_id: np.ndarray,
+    method: str = "edge",
+    window_s: float = SEGMENT_WINDOW_S,
+    length_m: float = SEGMENT_LENGTH_M,
+) -> np.ndarray:
+    """Indices of the first sample of every segment.
+
+    Args:
+        trip_codes: Integer trip code per sample (samples sorted by trip, time).
+        sample_idx: Sample index within the trip.
+        speed: Speed per sample (km/h).
+        edge_id: Matched edge per sample.
+        method: "edge", "time" or "distance".
+        window_s: Window length for method="time".
+        length_m: Window length for method="distance".
+
+    Returns:
+        Sorted int64 array of segment start positions (always includes 0).
+    """
+    n = len(trip_codes)
+    if n == 0:
+        return np.array([], dtype=np.int64)
+    new_trip = np.r_[True, trip_codes[1:] != trip_codes[:-1]]
+
+    if method == "edge":
+        key = edge_id
+    elif method == "time":
+        key = (sample_idx * SPEED_INTERVAL_S // window_s).astype(np.int64)
+    elif method == "distance":
+        # Distance travelled before each sample, restarted at every trip
+        step = speed.astype(np.float64) / 3.6 * SPEED_INTERVAL_S
+        cum = np.cumsum(step) - step
+        trip_first = np.flatnonzero(new_trip)
+        cum -= np.repeat(cum[trip_first], np.diff(np.r_[trip_first, n]))
+        key = (cum // length_m).astype(np.int64)
+    else:
+        raise ValueError(f"method must be one of {SEGMENT_METHODS}, got {method!r}")
+
+    boundary = new_trip | np.r_[True, key[1:] != key[:-1]]
+    return np.flatnonzero(boundary)
+
+
+def compute_segment_indicators(
+    samples: pd.DataFrame,
+    method: str = "edge",
+    window_s: float = SEGMENT_WINDOW_S,
+    length_m: float = SEGMENT_LENGTH_M,
+) -> pd.DataFrame:
+    """Per-segment indicators from sorted speed samples via segmented reductions.
+
+    Acceleration is the change from the previous sample of the same trip
+    (km/h per interval -> m/s^2), attributed to the later sample.
+
+    Args:
+        samples: Output of load_city_samples (sorted by route_id, sample_idx).
+        method: Segmentation method, see segment_starts.
+        window_s: Window length for method="time".
+        length_m: Window length for method="distance".
+
+    Returns:
+        One row per segment with speed, speeding and acceleration indicators.
+    """
+    trip_codes, trips = pd.factorize(samples["route_id"], sort=False)
+    sample_idx = samples["sample_idx"].values.astype(np.int64)
+    v = samples["speed"].values.astype(np.float64)
+    edge = samples["edge_id"].values
+    cls_codes = pd.Categorical(samples["road_class"], categories=ROAD_CATEGORIES).codes
+
+    starts = segment_starts(trip_codes, sample_idx, v, edge, method, window_s, length_m)
+    n_samples = np.diff(np.r_[starts, len(v)])
+
+    # Sample-level acceleration; NaN at the first sample of every trip
+    accel = np.r_[np.nan, np.diff(v)] * (1000.0 / 3600.0) / SPEED_INTERVAL_S
+    accel[np.r_[True, trip_codes[1:] != trip_codes[:-1]]] = np.nan
+    has_accel = ~np.isnan(accel)
+    abs_accel = np.where(has_accel, np.abs(accel), 0.0)
+
+    speeding = v > SPEED_LIMIT_KR
+    sum_speed = np.add.reduceat(v, starts)
+    mean_speed = sum_speed / n_samples
+    var = np.add.reduceat(v ** 2, starts) / n_samples - mean_speed ** 2
+    n_accel = np.add.reduceat(has_accel, starts)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_abs_accel = np.add.reduceat(abs_accel, starts) / n_accel
+        max_accel = np.fmax.reduceat(accel, starts)
+        max_decel = np.fmin.reduceat(accel, starts)
+
+    # Dominant road class per segment (edge segments have exactly one)
+    seg_of_sample = np.repeat(np.arange(len(starts)), n_samples)
+    class_counts = np.zeros((len(starts), len(ROAD_CATEGORIES)), dtype=np.int32)
+    np.add.at(class_counts, (seg_of_sample, np.where(cls_codes >= 0, cls_codes, len(ROAD_CATEGORIES) - 1)), 1)
+
+    seg_trip = trip_codes[starts]
+    trip_first_seg = np.flatnonzero(np.r_[True, seg_trip[1:] != seg_trip[:-1]])
+    segment_idx = np.arange(len(starts)) - np.repeat(trip_first_seg, np.diff(np.r_[trip_first_seg, len(starts)]))
+
+    return pd.DataFrame({
+        "route_id": trips.values[seg_trip],
+        "segment_idx": segment_idx.astype(np.uint16),
+        "mode": samples["mode"].values[starts],
+        "edge_id": edge[starts],
+        "road_class": pd.Categorical.from_codes(class_counts.argmax(axis=1), ROAD_CATEGORIES),
+        "start_t_s": (sample_idx[starts] * SPEED_INTERVAL_S).astype(np.float32),
+        "n_samples": n_samples.astype(np.uint16),
+        "duration_s": (n_samples * SPEED_INTERVAL_S).astype(np.float32),
+        "distance_m": (sum_speed / 3.6 * SPEED_INTERVAL_S).astype(np.float32),
+        "mean_speed": mean_speed.astype(np.float32),
+        "max_speed": np.maximum.reduceat(v, starts).astype(np.float32),
+        "min_speed": np.minimum.reduceat(v, starts).astype(np.float32),
+        "speed_std": np.sqrt(np.maximum(var, 0.0)).astype(np.float32),
+        "speeding_share": (np.add.reduceat(speeding, starts) / n_samples).astype(np.float32),
+        "speeding_duration_s": (np.add.reduceat(speeding, starts) * SPEED_INTERVAL_S).astype(np.float32),
+        "mean_abs_accel_ms2": mean_abs_accel.astype(np.float32),
+        "max_accel_ms2": max_accel.astype(np.float32),
+        "max_decel_ms2": max_decel.astype(np.float32),
+        "harsh_accel_count": np.add.reduceat(accel > HARSH_ACCEL_THRESHOLD_10S, starts).astype(np.uint16),
+        "harsh_decel_count": np.add.reduceat(accel < -HARSH_ACCEL_THRESHOLD_10S, starts).astype(np.uint16),
+        "mean_snap_dist_m": (np.add.reduceat(samples["snap_dist_m"].values.astype(np.float64), starts) / n_samples).astype(np.float32),
+    })
+
+
+def write_city_segments(segments: pd.DataFrame, city: str, out_dir: Path = SEGMENT_INDICATORS_PARQUET) -> Path:
+    """Write one city's segments as the city=<name> hive partition."""
+    if out_dir.is_file():
+        out_dir.unlink()  # legacy single-file road class summary
+    part_dir = out_dir / f"city={city}"
+    if part_dir.exists():
+        shutil.rmtree(part_dir)
+    part_dir.mkdir(parents=True)
+    path = part_dir / "part-0.parquet"
+    segments.to_parquet(path, index=False, compression="zstd")
+    return path
+
+
+def summarize_segments(
+    min_segments: int = MIN_SEGMENTS,
+    segments_dir: Path = SEGMENT_INDICATORS_PARQUET,
+    con: Optional[duckdb.DuckDBPyConnection] = None,
+) -> pd.DataFrame:
+    """Road class x city x mode summaries with one GROUPING SETS query.
+
+    Rolled-up dimensions are reported as "All". Speed and speeding shares are
+    sample-weighted across segments.
+
+    Args:
+        min_segments: Drop cells with fewer segments.
+        segments_dir: Hive-partitioned segment dataset.
+        con: Optional existing DuckDB connection.
+
+    Returns:
+        DataFrame with city, mode, road_class and summary columns.
+    """
+    own = con is None
+    con = con or duckdb.connect()
+    df = con.execute(f"""
+        SELECT
+            CASE WHEN GROUPING(city) = 1 THEN 'All' ELSE city END AS city,
+            CASE WHEN GROUPING(mode) = 1 THEN 'All' ELSE mode END AS mode,
+            CAST(road_class AS VARCHAR) AS road_class,
+            COUNT(*) AS n_segments,
+            COUNT(DISTINCT route_id) AS n_trips,
+            SUM(n_samples) AS n_samples,
+            SUM(distance_m) / 1000.0 AS distance_km,
+            SUM(mean_speed * n_samples) / SUM(n_samples) AS mean_speed,
+            MEDIAN(mean_speed) AS segment_mean_speed_median,
+            QUANTILE_CONT(max_speed, 0.85) AS segment_max_speed_p85,
+            SUM(speeding_share * n_samples) / SUM(n_samples) AS speeding_share,
+            AVG(CAST(speeding_share > 0 AS DOUBLE)) AS segment_speeding_rate,
+            AVG(speed_std) AS speed_std_mean,
+            AVG(mean_abs_accel_ms2) AS mean_abs_accel_ms2,
+            SUM(harsh_accel_count + harsh_decel_count) * 60.0
+                / SUM(duration_s) AS harsh_events_per_min
+        FROM read_parquet('{segments_dir.as_posix()}/*/*.parquet', hive_partitioning = true)
+        GROUP BY GROUPING SETS (
+            (road_class),
+            (city, road_class),
+            (mode, road_class),
+            (city, mode, road_class)
+        )
+        HAVING COUNT(*) >= {int(min_segments)}
+        ORDER BY city, mode, road_class
+    """).fetchdf()
+    if own:
+        con.close()
+    return df
+
+
+def main(method: str = "edge") -> None:
+    """Build the segment indicator dataset for every city and summarize it."""
+    print("=" * 60)
+    print(f"Segment indicators (split by {method})")
+    print("=" * 60)
+    t_start = time.time()
+
+    cities = sorted(p.stem for p in POINT_ROAD_CLASSES_DIR.glob("*.parquet"))
+    con = duckdb.connect()
+    total = 0
+    for city in cities:
+        t0 = time.time()
+        samples = load_city_samples(city, con)
+        if samples.empty:
+            continue
+        segments = compute_segment_indicators(samples, method)
+        write_city_segments(segments, city)
+        total += len(segments)
+        print(f"  {city:12s} {len(samples):>12,} samples -> {len(segments):>10,} segments "
+              f"({time.time() - t0:.1f}s)")
+        del samples, segments
+
+    print(f"\nSaved {total:,} segments to: {SEGMENT_INDICATORS_PARQUET}")
+
+    summary = summarize_segments(con=con)
+    con.close()
+    summary.to_csv(SUMMARY_PATH, index=False)
+    print(f"Saved summary to: {SUMMARY_PATH} ({len(summary)} cells)")
+
+    overall = summary[(summary["city"] == "All") & (summary["mode"] == "All")]
+    print(f"\n{'Road Class':15s} {'Segments':>10s} {'Mean Spd':>10s} {'Speeding%':>10s}")
+    print("-" * 50)
+    for _, row in overall.iterrows():
+        print(f"{row['road_class']:15s} {row['n_segments']:>10,} "
+              f"{row['mean_speed']:>10.1f} {row['speeding_share'] * 100:>9.1f}%")
+    print(f"\nTotal time: {time.time() - t_start:.1f}s")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else "edge")
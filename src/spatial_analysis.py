@@ -11,22 +11,22 @@ Usage:
 import json
 import time
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
 
 import duckdb
 import geopandas as gpd
-import h3
 import numpy as np
 import pandas as pd
-from libpysal.weights import KNN, Queen
-from esda.getisord import G_Local
-from esda.moran import Moran, Moran_Local
-from shapely.geometry import Polygon
 
 from config import (
     DATA_DIR, CLEANED_PARQUET, MODELING_DIR, REPORTS_DIR,
     H3_RESOLUTION, SPEED_LIMIT_KR, RANDOM_SEED,
 )
+from hex_cube import (
+    TRIP_H3_PATH, attach_geometry, build_trip_cells, cells_to_str, load_trip_cells,
+    query_hexes,
+)
+from spatial_stats import spatial_statistics
 
 np.random.seed(RANDOM_SEED)
 
@@ -36,15 +36,6 @@ SPATIAL_DIR = DATA_DIR / "spatial"
 SPATIAL_DIR.mkdir(exist_ok=True)
 
 
-def h3_to_polygon(h3_index: str) -> Polygon:
-    """Convert H3 hex index to a Shapely Polygon."""
-    boundary = h3.cell_to_boundary(h3_index)
-    # h3 returns (lat, lon) tuples; shapely needs (lon, lat)
-    coords = [(lon, lat) for lat, lon in boundary]
-    coords.append(coords[0])  # close the ring
-    return Polygon(coords)
-
-
 def load_trip_data() -> pd.DataFrame:
     """Load trip data with coordinates and speed indicators via DuckDB."""
     print("Loading trip data...")
@@ -70,17 +61,27 @@ def load_trip_data() -> pd.DataFrame:
 
 
 def compute_h3_indices(df: pd.DataFrame, resolution: int = H3_RESOLUTION) -> pd.DataFrame:
-    """Add H3 hex indices for trip origins and destinations."""
-    print(f"Computing H3 indices at resolution {resolution}...")
+    """Add UINT64 H3 cell ids for trip origins and destinations.
+
+    Reads the multi-resolution trip cells cached by hex_cube.py; if the cache
+    is missing or does not cover every trip, cells are recomputed in
+    vectorized batches for all cube resolutions and the cache is rewritten.
+    """
+    print(f"Loading H3 cells at resolution {resolution}...")
     t0 = time.time()
-    df["h3_origin"] = [
-        h3.latlng_to_cell(lat, lon, resolution)
-        for lat, lon in zip(df["start_lat"], df["start_lon"])
-    ]
-    df["h3_dest"] = [
-        h3.latlng_to_cell(lat, lon, resolution)
-        for lat, lon in zip(df["end_lat"], df["end_lon"])
-    ]
+    cells = None
+    if TRIP_H3_PATH.exists():
+        cells = load_trip_cells(resolution)
+        if not df["route_id"].isin(cells["route_id"]).all():
+            print("  Cached cells do not cover all trips, recomputing")
+            cells = None
+    if cells is None:
+        all_cells = build_trip_cells(df)
+        all_cells.to_parquet(TRIP_H3_PATH, index=False)
+        print(f"  Saved H3 cells: {TRIP_H3_PATH}")
+        cells = load_trip_cells(resolution)
+
+    df = df.merge(cells, on="route_id", how="left")
     print(f"  Done in {time.time() - t0:.1f}s")
     print(f"  Unique origin hexes: {df['h3_origin'].nunique():,}")
     print(f"  Unique dest hexes: {df['h3_dest'].nunique():,}")
@@ -118,7 +119,7 @@ def aggregate_hexagons(
         harsh_events_mean=("harsh_event_count", "mean"),
     ).reset_index()
 
-    agg.rename(columns={h3_col: "h3_index"}, inplace=True)
+    agg.rename(columns={h3_col: "h3_cell"}, inplace=True)
     agg["speeding_pct"] = agg["speeding_pct"] * 100  # convert to percentage
 
     # Filter by minimum trip count
@@ -126,13 +127,9 @@ def aggregate_hexagons(
     agg = agg[agg["trip_count"] >= min_trips].copy()
     print(f"  {n_before:,} hexes -> {len(agg):,} after min_trips filter")
 
-    # Create geometries
-    agg["geometry"] = agg["h3_index"].apply(h3_to_polygon)
-    gdf = gpd.GeoDataFrame(agg, geometry="geometry", crs="EPSG:4326")
-
-    # Add hex centroid coordinates
-    gdf["hex_lat"] = gdf.geometry.centroid.y
-    gdf["hex_lon"] = gdf.geometry.centroid.x
+    # Attach cached hex geometries and centers (built once per cell)
+    agg["h3_index"] = cells_to_str(agg["h3_cell"].values)
+    gdf = attach_geometry(agg, "h3_cell")
 
     print(f"  Total trips in filtered hexes: {gdf['trip_count'].sum():,}")
     print(f"  Mean trips/hex: {gdf['trip_count'].mean():.1f}")
@@ -141,136 +138,51 @@ def aggregate_hexagons(
     return gdf
 
 
-def run_hotspot_analysis(
-    gdf: gpd.GeoDataFrame,
+def run_spatial_statistics(
+    hexes: pd.DataFrame,
     variable: str = "speeding_pct",
-    k: int = 8,
+    group_col: Optional[str] = "city",
+    k: int = 1,
     permutations: int = 999,
-) -> gpd.GeoDataFrame:
-    """Run Getis-Ord Gi* hotspot analysis.
-
-    Args:
-        gdf: GeoDataFrame with hex aggregated data.
-        variable: Column to analyze for hotspots.
-        k: Number of nearest neighbors for spatial weights.
-        permutations: Number of permutations for significance testing.
+) -> tuple[pd.DataFrame, dict[str, dict[str, Any]]]:
+    """Run Getis-Ord Gi* and global/local Moran's I for all groups in one call.
 
-    Returns:
-        GeoDataFrame with Gi* z-scores and p-values added.
-    """
-    print(f"Running Getis-Ord Gi* on '{variable}' (k={k}, perms={permutations})...")
-
-    # Build spatial weights using KNN (better for irregular hex grids)
-    w = KNN.from_dataframe(gdf, k=k)
-    w.transform = "R"  # row-standardize
-
-    # Run Gi*
-    y = gdf[variable].values
-    gi = G_Local(y, w, star=True, permutations=permutations, seed=RANDOM_SEED)
-
-    gdf = gdf.copy()
-    gdf["gi_zscore"] = gi.Zs
-    gdf["gi_pvalue"] = gi.p_sim
-
-    # Classify hotspot/coldspot at different significance levels
-    gdf["hotspot_class"] = "Not Significant"
-    gdf.loc[
-        (gdf["gi_zscore"] > 0) & (gdf["gi_pvalue"] <= 0.01),
-        "hotspot_class"
-    ] = "Hot Spot (99%)"
-    gdf.loc[
-        (gdf["gi_zscore"] > 0) & (gdf["gi_pvalue"] > 0.01) & (gdf["gi_pvalue"] <= 0.05),
-        "hotspot_class"
-    ] = "Hot Spot (95%)"
-    gdf.loc[
-        (gdf["gi_zscore"] > 0) & (gdf["gi_pvalue"] > 0.05) & (gdf["gi_pvalue"] <= 0.10),
-        "hotspot_class"
-    ] = "Hot Spot (90%)"
-    gdf.loc[
-        (gdf["gi_zscore"] < 0) & (gdf["gi_pvalue"] <= 0.01),
-        "hotspot_class"
-    ] = "Cold Spot (99%)"
-    gdf.loc[
-        (gdf["gi_zscore"] < 0) & (gdf["gi_pvalue"] > 0.01) & (gdf["gi_pvalue"] <= 0.05),
-        "hotspot_class"
-    ] = "Cold Spot (95%)"
-    gdf.loc[
-        (gdf["gi_zscore"] < 0) & (gdf["gi_pvalue"] > 0.05) & (gdf["gi_pvalue"] <= 0.10),
-        "hotspot_class"
-    ] = "Cold Spot (90%)"
-
-    # Summary
-    vc = gdf["hotspot_class"].value_counts()
-    print("  Hotspot classification:")
-    for cls, cnt in vc.items():
-        print(f"    {cls}: {cnt} ({cnt/len(gdf)*100:.1f}%)")
-
-    return gdf
-
-
-def run_morans_i(
-    gdf: gpd.GeoDataFrame,
-    variable: str = "speeding_pct",
-    k: int = 8,
-    permutations: int = 999,
-) -> dict[str, Any]:
-    """Compute Global and Local Moran's I for spatial autocorrelation.
+    Neighbors are H3 k-rings within each group, handled as sparse CSR
+    matrices by spatial_stats.spatial_statistics.
 
     Args:
-        gdf: GeoDataFrame with hex aggregated data.
-        variable: Column to analyze.
-        k: Number of nearest neighbors.
+        hexes: Per-hex table with h3_cell and the analysis variable.
+        variable: Column to analyze for hotspots.
+        group_col: Group column (e.g. "city"); None for a single region.
+        k: k-ring distance defining neighbors.
         permutations: Number of permutations for inference.
 
     Returns:
-        Dictionary with global and local Moran's I results.
+        Hexes with Gi* and LISA columns added, and a dictionary of global
+        Moran's I results keyed by group.
     """
-    print(f"Computing Moran's I on '{variable}' (k={k}, perms={permutations})...")
-
-    w = KNN.from_dataframe(gdf, k=k)
-    w.transform = "R"
-
-    y = gdf[variable].values
-
-    # Global Moran's I
-    mi_global = Moran(y, w, permutations=permutations)
-    print(f"  Global Moran's I: {mi_global.I:.4f}")
-    print(f"  Expected I: {mi_global.EI:.4f}")
-    print(f"  Z-score: {mi_global.z_sim:.4f}")
-    print(f"  p-value: {mi_global.p_sim:.6f}")
-
-    # Local Moran's I (LISA)
-    mi_local = Moran_Local(y, w, permutations=permutations, seed=RANDOM_SEED)
-
-    gdf = gdf.copy()
-    gdf["lisa_I"] = mi_local.Is
-    gdf["lisa_pvalue"] = mi_local.p_sim
-    gdf["lisa_quadrant"] = mi_local.q
-
-    # Classify LISA clusters
-    sig = mi_local.p_sim <= 0.05
-    quad_labels = {1: "HH", 2: "LH", 3: "LL", 4: "HL"}
-    gdf["lisa_cluster"] = "Not Significant"
-    for q_val, label in quad_labels.items():
-        mask = sig & (mi_local.q == q_val)
-        gdf.loc[mask, "lisa_cluster"] = label
+    print(f"Running Gi* and Moran's I on '{variable}' (k-ring={k}, perms={permutations})...")
+    t0 = time.time()
+    hexes, global_df = spatial_statistics(
+        hexes, variable, group_col=group_col, k=k, permutations=permutations,
+    )
+    print(f"  Done in {time.time() - t0:.1f}s ({len(hexes):,} hexes, {len(global_df)} groups)")
 
-    vc = gdf["lisa_cluster"].value_counts()
-    print("  LISA cluster counts:")
-    for cls, cnt in vc.items():
-        print(f"    {cls}: {cnt} ({cnt/len(gdf)*100:.1f}%)")
+    key = group_col or "group"
+    moran_results = {}
+    for row in global_df.to_dict(orient="records"):
+        group = row.pop(key)
+        group_hexes = hexes[hexes[group_col] == group] if group_col else hexes
+        row["lisa_clusters"] = group_hexes["lisa_cluster"].value_counts().to_dict()
+        moran_results[group] = row
 
-    results = {
-        "global_morans_I": float(mi_global.I),
-        "expected_I": float(mi_global.EI),
-        "z_score": float(mi_global.z_sim),
-        "p_value": float(mi_global.p_sim),
-        "variance": float(mi_global.VI_sim),
-        "n_hexagons": len(gdf),
-        "lisa_clusters": vc.to_dict(),
-    }
+        print(f"  [{group}] Global Moran's I: {row['global_morans_I']:.4f} "
+              f"(z={row['z_score']:.2f}, p={row['p_value']:.4f})")
+        vc = group_hexes["hotspot_class"].value_counts()
+        for cls, cnt in vc.items():
+            print(f"    {cls}: {cnt} ({cnt/len(group_hexes)*100:.1f}%)")
 
-    return results, gdf
+    return hexes, moran_results
 
 
 def overlay_infrastructure(
@@ -306,7 +218,7 @@ def overlay_infrastructure(
         frac_cycling_infra_mean=("frac_cycling_infra", "mean"),
         n_road_classes_mean=("n_road_classes", "mean"),
     ).reset_index()
-    road_agg.rename(columns={"h3_origin": "h3_index"}, inplace=True)
+    road_agg.rename(columns={"h3_origin": "h3_cell"}, inplace=True)
 
     # Also get dominant road class mode per hex
     mode_by_hex = (
@@ -314,11 +226,11 @@ def overlay_infrastructure(
         .agg(lambda x: x.mode().iloc[0] if len(x.mode()) > 0 else "unknown")
         .reset_index()
     )
-    mode_by_hex.columns = ["h3_index", "hex_dominant_road_class"]
-    road_agg = road_agg.merge(mode_by_hex, on="h3_index", how="left")
+    mode_by_hex.columns = ["h3_cell", "hex_dominant_road_class"]
+    road_agg = road_agg.merge(mode_by_hex, on="h3_cell", how="left")
 
     # Merge into hex GeoDataFrame
-    gdf_out = gdf_hex.merge(road_agg, on="h3_index", how="left")
+    gdf_out = gdf_hex.merge(road_agg, on="h3_cell", how="left")
 
     print(f"  Matched {gdf_out['frac_major_road_mean'].notna().sum():,}/{len(gdf_out):,} hexes")
     print(f"  Mean frac_major_road in hotspots: "
@@ -329,17 +241,58 @@ def overlay_infrastructure(
     return gdf_out
 
 
+def aggregate_city_hexagons(
+    df: pd.DataFrame,
+    cities: list[str],
+    min_trips: int = 10,
+) -> tuple[gpd.GeoDataFrame, dict[str, dict[str, Any]]]:
+    """Aggregate origin hexagons for each city eligible for spatial statistics.
+
+    Args:
+        df: Full trip dataframe with H3 indices.
+        cities: City names to aggregate.
+        min_trips: Minimum trips per hex.
+
+    Returns:
+        Combined per-city hex GeoDataFrame (with a city column), and partial
+        results for cities skipped for having too few trips or hexes.
+    """
+    frames = []
+    skipped = {}
+    for city in cities:
+        city_df = df[df["city"] == city]
+        print(f"\n{city}: {len(city_df):,} trips")
+
+        if len(city_df) < 100:
+            print(f"  Skipping - too few trips")
+            continue
+
+        gdf_origin = aggregate_hexagons(city_df, "h3_origin", f"{city}_origin", min_trips)
+        if len(gdf_origin) < 20:
+            print(f"  Skipping hotspot analysis - too few hexes ({len(gdf_origin)})")
+            skipped[city] = {"city": city, "n_trips": len(city_df), "n_hexes": len(gdf_origin)}
+            continue
+
+        frames.append(gdf_origin.assign(city=city))
+
+    if not frames:
+        return gpd.GeoDataFrame(), skipped
+    return gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs="EPSG:4326"), skipped
+
+
 def run_city_analysis(
     df: pd.DataFrame,
     city: str,
-    min_trips: int = 10,
+    gdf_city: gpd.GeoDataFrame,
+    moran_results: dict[str, Any],
 ) -> dict[str, Any]:
-    """Run full spatial analysis pipeline for a single city.
+    """Overlay infrastructure, save outputs and summarize results for a city.
 
     Args:
         df: Full trip dataframe with H3 indices.
         city: City name to analyze.
-        min_trips: Minimum trips per hex.
+        gdf_city: The city's hexes with Gi* and LISA columns.
+        moran_results: The city's global Moran's I results.
 
     Returns:
         Dictionary with analysis results.
@@ -349,27 +302,10 @@ def run_city_analysis(
     print(f"{'='*60}")
 
     city_df = df[df["city"] == city].copy()
-    print(f"  {len(city_df):,} trips")
-
-    if len(city_df) < 100:
-        print(f"  Skipping - too few trips")
-        return {}
-
-    # Aggregate origins
-    gdf_origin = aggregate_hexagons(city_df, "h3_origin", f"{city}_origin", min_trips)
-
-    if len(gdf_origin) < 20:
-        print(f"  Skipping hotspot analysis - too few hexes ({len(gdf_origin)})")
-        return {"city": city, "n_trips": len(city_df), "n_hexes": len(gdf_origin)}
-
-    # Hotspot analysis
-    gdf_hotspot = run_hotspot_analysis(gdf_origin, "speeding_pct")
-
-    # Moran's I
-    moran_results, gdf_lisa = run_morans_i(gdf_hotspot, "speeding_pct")
+    gdf_city = gdf_city.drop(columns=["city"])
 
     # Infrastructure overlay
-    gdf_final = overlay_infrastructure(gdf_lisa, city_df)
+    gdf_final = overlay_infrastructure(gdf_city, city_df)
 
     # Save city-level GeoDataFrame
     out_path = SPATIAL_DIR / f"hex_{city.lower().replace(' ', '_')}.parquet"
@@ -378,28 +314,56 @@ def run_city_analysis(
     save_df.to_parquet(out_path, index=False)
     print(f"  Saved: {out_path}")
 
-    # Also save as GeoPackage for GIS inspection
+    # Also save as GeoPackage for GIS inspection (GPKG has no unsigned 64-bit ints;
+    # H3 ids always fit in int64)
     gpkg_path = SPATIAL_DIR / f"hex_{city.lower().replace(' ', '_')}.gpkg"
-    gdf_final.to_file(gpkg_path, driver="GPKG")
+    gdf_final.astype({"h3_cell": "int64"}).to_file(gpkg_path, driver="GPKG")
     print(f"  Saved: {gpkg_path}")
 
     results = {
         "city": city,
         "n_trips": len(city_df),
         "n_hexes_total": int(city_df["h3_origin"].nunique()),
-        "n_hexes_filtered": len(gdf_origin),
+        "n_hexes_filtered": len(gdf_city),
         "global_morans_I": moran_results["global_morans_I"],
         "morans_p_value": moran_results["p_value"],
         "morans_z_score": moran_results["z_score"],
         "lisa_clusters": moran_results["lisa_clusters"],
-        "hotspot_counts": gdf_hotspot["hotspot_class"].value_counts().to_dict(),
-        "mean_speeding_pct": float(gdf_origin["speeding_pct"].mean()),
-        "speeding_pct_std": float(gdf_origin["speeding_pct"].std()),
+        "hotspot_counts": gdf_city["hotspot_class"].value_counts().to_dict(),
+        "mean_speeding_pct": float(gdf_city["speeding_pct"].mean()),
+        "speeding_pct_std": float(gdf_city["speeding_pct"].std()),
     }
 
     return results
 
 
+def run_national_hotspots(
+    resolution: int = 9,
+    min_trips: int = 10,
+) -> dict[str, Any]:
+    """Nationwide Gi* / Moran's I map from the hex cube at a fine resolution.
+
+    Args:
+        resolution: H3 resolution of the hex cube level to analyze.
+        min_trips: Minimum trips per hex.
+
+    Returns:
+        Dictionary with global Moran's I and hotspot counts.
+    """
+    print(f"\nNationwide hotspots at H3 resolution {resolution}...")
+    hexes = query_hexes(resolution, "origin", min_trips=min_trips)
+    hexes, moran_results = run_spatial_statistics(hexes, "speeding_pct", group_col=None)
+    hexes["h3_index"] = cells_to_str(hexes["h3_cell"].values)
+
+    out_path = SPATIAL_DIR / f"hex_national_r{resolution}.parquet"
+    hexes.to_parquet(out_path, index=False)
+    print(f"  Saved: {out_path}")
+
+    results = dict(moran_results[0])
+    results["hotspot_counts"] = hexes["hotspot_class"].value_counts().to_dict()
+    return results
+
+
 def main() -> None:
     """Run full spatial analysis pipeline."""
     t_start = time.time()
@@ -408,11 +372,6 @@ def main() -> None:
     df = load_trip_data()
     df = compute_h3_indices(df)
 
-    # Save H3 indices for later use
-    h3_path = DATA_DIR / "trip_h3_indices.parquet"
-    df[["route_id", "h3_origin", "h3_dest"]].to_parquet(h3_path, index=False)
-    print(f"Saved H3 indices: {h3_path}")
-
     # ---- Task 4.1: Full-dataset H3 aggregation ----
     print("\n" + "="*60)
     print("TASK 4.1: Full-dataset H3 aggregation")
@@ -439,11 +398,19 @@ def main() -> None:
     # Also run for top 5 cities for comparison
     top_cities = ["Seoul", "Daejeon", "Suwon", "Busan", "Daegu"]
 
-    all_results = {}
-    for city in top_cities:
-        results = run_city_analysis(df, city, min_trips=10)
-        if results:
-            all_results[city] = results
+    city_hexes, all_results = aggregate_city_hexagons(df, top_cities, min_trips=10)
+
+    # Gi* + Moran's I for every city in one call
+    if len(city_hexes) > 0:
+        city_hexes, moran_by_city = run_spatial_statistics(city_hexes, "speeding_pct")
+        for city in top_cities:
+            if city in moran_by_city:
+                all_results[city] = run_city_analysis(
+                    df, city, city_hexes[city_hexes["city"] == city], moran_by_city[city],
+                )
+
+    # Nationwide map at resolution 9 from the hex cube
+    all_results["national_r9"] = run_national_hotspots(resolution=9, min_trips=10)
 
     # ---- Task 4.5: Infrastructure overlay summary ----
     print("\n" + "="*60)
@@ -32,6 +32,7 @@ from src.config import (
     DATA_DIR, FIGURES_DIR, MODELING_DIR,
     FIG_DPI, SPEED_LIMIT_KR, H3_RESOLUTION,
 )
+from src.hex_cube import attach_geometry
 
 FIGURES_DIR.mkdir(parents=True, exist_ok=True)
 SPATIAL_DIR = DATA_DIR / "spatial"
@@ -80,6 +81,12 @@ LISA_COLORS = {
 }
 
 
+def load_city_hexes(city: str) -> gpd.GeoDataFrame:
+    """Load a city's hex analysis table with geometries from the hex cube cache."""
+    df = pd.read_parquet(SPATIAL_DIR / f"hex_{city.lower().replace(' ', '_')}.parquet")
+    return attach_geometry(df, "h3_cell")
+
+
 def save_fig(fig: plt.Figure, name: str) -> None:
     """Save figure in PDF and PNG formats."""
     fig.savefig(FIGURES_DIR / f"{name}.pdf", dpi=FIG_DPI, bbox_inches="tight")
@@ -97,7 +104,7 @@ def fig6_seoul_hotspot() -> None:
     Panel D: LISA cluster map
     """
     print("Creating Fig 6: Seoul spatial hotspot map...")
-    gdf = gpd.read_file(SPATIAL_DIR / "hex_seoul.gpkg")
+    gdf = load_city_hexes("Seoul")
     print(f"  {len(gdf)} hexes loaded")
 
     fig, axes = plt.subplots(2, 2, figsize=(14, 12))
@@ -221,7 +228,7 @@ def fig6_seoul_hotspot() -> None:
 def fig7_daejeon_hotspot() -> None:
     """Fig 7: Daejeon spatial hotspot analysis (4-panel)."""
     print("Creating Fig 7: Daejeon spatial hotspot map...")
-    gdf = gpd.read_file(SPATIAL_DIR / "hex_daejeon.gpkg")
+    gdf = load_city_hexes("Daejeon")
     print(f"  {len(gdf)} hexes loaded")
 
     fig, axes = plt.subplots(2, 2, figsize=(14, 12))
@@ -365,7 +372,7 @@ def fig_hotspot_infrastructure() -> None:
     """Seoul hotspot vs infrastructure comparison."""
     print("Creating figure: Hotspot infrastructure comparison...")
 
-    gdf = gpd.read_file(SPATIAL_DIR / "hex_seoul.gpkg")
+    gdf = load_city_hexes("Seoul")
 
     # Group by hotspot classification
     hot = gdf[gdf["hotspot_class"].str.contains("Hot")]
@@ -431,7 +438,7 @@ def fig_segment_speeding_map() -> None:
     """
     print("Creating figure: Segment-level speeding maps...")
 
-    gdf = gpd.read_file(SPATIAL_DIR / "hex_seoul.gpkg")
+    gdf = load_city_hexes("Seoul")
 
     # Define corridors (approximate bounding boxes of known Seoul areas)
     corridors = {
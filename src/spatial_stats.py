@@ -0,0 +1,278 @@
+"""
+Sparse-matrix Getis-Ord Gi* and Moran's I engine on H3 hexagons.
+
+Neighbor structure is derived directly from H3 k-rings (no GeoDataFrames or
+libpysal weights) as SciPy CSR matrices, restricted to hexes of the same group
+(city), so every city is processed in one call and a nationwide hex set is just
+a single group. Statistics are sparse mat-vecs:
+
+  - Gi* z-scores: row-standardized weights including the focal hex (star);
+    identical to esda.G_Local(star=True, transform="R").Zs.
+  - Global Moran's I: row-standardized, with permutation inference computed in
+    batches of shuffled columns (one sparse mat-mat product per batch).
+  - Local Moran's I (LISA): esda.Moran_Local scaling and quadrant codes,
+    with conditional permutation inference.
+
+Conditional permutation inference follows esda's shared-draw scheme: per
+group, one (permutations x max_neighbors) matrix of draws without replacement
+from the other n-1 hexes is reused for every focal hex (indices >= i are
+shifted by one), so simulated neighbor sums for a block of hexes are a single
+fancy-indexing gather. Gi* and LISA pseudo p-values share those draws. All
+randomness comes from a seeded SeedSequence spawned per group.
+"""
+
+import sys
+from pathlib import Path
+from typing import Optional
+
+import h3.api.numpy_int as h3i
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.config import RANDOM_SEED
+
+# Max elements gathered per block of conditional permutations (~128 MB float64)
+PERM_BLOCK_ELEMS = 2 ** 24
+
+LISA_LABELS = {1: "HH", 2: "LH", 3: "LL", 4: "HL"}
+
+
+def h3_weights(
+    cells: np.ndarray,
+    groups: Optional[np.ndarray] = None,
+    k: int = 1,
+) -> sparse.csr_matrix:
+    """Binary k-ring contiguity matrix among cells of the same group.
+
+    Args:
+        cells: UINT64 H3 cell ids (unique within each group).
+        groups: Optional group label per cell (e.g. city); neighbors are only
+            linked within a group. None treats all cells as one group.
+        k: Grid distance of the k-ring.
+
+    Returns:
+        n x n CSR matrix with 1 for neighbors (no self-links).
+    """
+    cells = np.asarray(cells, dtype=np.uint64)
+    n = len(cells)
+    codes = np.zeros(n, dtype=np.int64) if groups is None else pd.factorize(groups)[0]
+
+    units = pd.DataFrame({"g": codes, "cell": cells, "j": np.arange(n)})
+    if units.duplicated(["g", "cell"]).any():
+        raise ValueError("cells must be unique within each group")
+
+    disks = [h3i.grid_disk(c, k) for c in cells]
+    src = np.repeat(np.arange(n), [len(d) for d in disks])
+    pairs = pd.DataFrame({
+        "i": src,
+        "g": codes[src],
+        "cell": np.concatenate(disks).astype(np.uint64) if n else np.array([], np.uint64),
+    }).merge(units, on=["g", "cell"])
+    pairs = pairs[pairs["i"] != pairs["j"]]
+
+    return sparse.csr_matrix(
+        (np.ones(len(pairs)), (pairs["i"].values, pairs["j"].values)), shape=(n, n)
+    )
+
+
+def row_standardize(A: sparse.csr_matrix) -> sparse.csr_matrix:
+    """Row-standardize a weights matrix; island rows stay zero."""
+    card = np.asarray(A.sum(axis=1)).ravel()
+    inv = np.divide(1.0, card, out=np.zeros_like(card), where=card > 0)
+    return sparse.diags(inv) @ A
+
+
+def _fold_pvalue(larger: np.ndarray, permutations: int) -> np.ndarray:
+    """Folded one-sided pseudo p-value, as esda's p_sim."""
+    larger = np.where(permutations - larger < larger, permutations - larger, larger)
+    return (larger + 1.0) / (permutations + 1.0)
+
+
+def _conditional_counts(
+    x: np.ndarray,
+    A: sparse.csr_matrix,
+    permutations: int,
+    rng: np.random.Generator,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Count simulated neighbor sums >= / <= the observed ones per hex.
+
+    Args:
+        x: Values for one group.
+        A: Binary neighbor matrix for the group.
+        permutations: Number of conditional permutations.
+        rng: Random generator for this group.
+
+    Returns:
+        (n_ge, n_le) arrays of counts over the permutations.
+    """
+    m = len(x)
+    card = np.diff(A.indptr)
+    kmax = int(card.max()) if m else 0
+    n_ge = np.zeros(m, dtype=np.int64)
+    n_le = np.zeros(m, dtype=np.int64)
+    if kmax == 0:
+        return n_ge, n_le
+
+    observed = A @ x
+    draws = np.stack([rng.choice(m - 1, kmax, replace=False) for _ in range(permutations)])
+    col = np.arange(kmax)
+    block = max(1, PERM_BLOCK_ELEMS // (permutations * kmax))
+
+    for start in range(0, m, block):
+        i = np.arange(start, min(start + block, m))
+        # Skip the focal hex: draws are over the other m-1 hexes
+        idx = draws[None, :, :] + (draws[None, :, :] >= i[:, None, None])
+        keep = (col[None, :] < card[i, None])[:, None, :]
+        sims = np.where(keep, x[idx], 0.0).sum(axis=2)
+        n_ge[i] = (sims >= observed[i, None]).sum(axis=1)
+        n_le[i] = (sims <= observed[i, None]).sum(axis=1)
+    return n_ge, n_le
+
+
+def classify_hotspots(z: np.ndarray, p: np.ndarray) -> np.ndarray:
+    """Hot/cold spot class at 99/95/90% confidence from Gi* z and p."""
+    conditions, labels = [], []
+    for level, conf in [(0.01, "99%"), (0.05, "95%"), (0.10, "90%")]:
+        conditions += [(z > 0) & (p <= level), (z < 0) & (p <= level)]
+        labels += [f"Hot Spot ({conf})", f"Cold Spot ({conf})"]
+    return np.select(conditions, labels, default="Not Significant")
+
+
+def classify_lisa(q: np.ndarray, p: np.ndarray, alpha: float = 0.05) -> np.ndarray:
+    """LISA cluster label (HH/LH/LL/HL) for significant hexes."""
+    labels = np.array(["Not Significant"] + [LISA_LABELS[k] for k in sorted(LISA_LABELS)], dtype=object)
+    return labels[np.where(p <= alpha, q, 0)]
+
+
+def _group_statistics(
+    x: np.ndarray,
+    A: sparse.csr_matrix,
+    permutations: int,
+    rng: np.random.Generator,
+    batch_size: int,
+) -> tuple[dict, dict]:
+    """Gi*, LISA and global Moran's I for one group (one CSR block)."""
+    m = len(x)
+    card = np.diff(A.indptr).astype(np.float64)
+    has_nbrs = card > 0
+    neighbor_sum = A @ x
+
+    # ---- Gi* (star, row-standardized: weight 1/(card+1) incl. focal hex) ----
+    x_bar = x.mean()
+    s = np.sqrt((x ** 2).mean() - x_bar ** 2)
+    lag_star = (x + neighbor_sum) / (card + 1.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gi_z = (lag_star - x_bar) / s
+
+    # ---- Local Moran's I ----
+    z = x - x_bar
+    zz = (z ** 2).sum()
+    lag_z = np.divide(neighbor_sum - card * x_bar, card, out=np.zeros(m), where=has_nbrs)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lisa_i = (m - 1) * z * lag_z / zz
+    quadrant = np.select(
+        [(z > 0) & (lag_z > 0), (z <= 0) & (lag_z > 0), (z <= 0) & (lag_z <= 0)],
+        [1, 2, 3],
+        default=4,
+    )
+
+    # ---- Conditional permutation inference (shared draws) ----
+    n_ge, n_le = _conditional_counts(x, A, permutations, rng)
+    gi_p = np.where(has_nbrs, _fold_pvalue(n_ge, permutations), 1.0)
+    lisa_larger = np.where(z >= 0, n_ge, n_le)
+    lisa_p = np.where(has_nbrs, _fold_pvalue(lisa_larger, permutations), 1.0)
+
+    local = {
+        "gi_zscore": gi_z, "gi_pvalue": gi_p,
+        "lisa_I": lisa_i, "lisa_pvalue": lisa_p, "lisa_quadrant": quadrant,
+    }
+
+    # ---- Global Moran's I with batched permutations ----
+    W = row_standardize(A)
+    s0 = has_nbrs.sum()
+    if m < 2 or s0 == 0 or zz == 0:
+        # Undefined without two hexes, a neighbor pair and some variation
+        glob = {
+            "n_hexagons": m, "global_morans_I": np.nan, "expected_I": np.nan,
+            "z_score": np.nan, "p_value": np.nan, "variance": np.nan,
+        }
+        return local, glob
+    moran_i = m / s0 * (z @ (W @ z)) / zz
+
+    sims = np.empty(permutations)
+    for start in range(0, permutations, batch_size):
+        b = min(batch_size, permutations - start)
+        zp = rng.permuted(np.broadcast_to(z, (b, m)), axis=1).T
+        sims[start:start + b] = m / s0 * (zp * (W @ zp)).sum(axis=0) / zz
+    larger = (sims >= moran_i).sum()
+
+    glob = {
+        "n_hexagons": m,
+        "global_morans_I": float(moran_i),
+        "expected_I": -1.0 / (m - 1),
+        "z_score": float((moran_i - sims.mean()) / sims.std()),
+        "p_value": float(_fold_pvalue(np.array(larger), permutations)),
+        "variance": float(sims.var()),
+    }
+    return local, glob
+
+
+def spatial_statistics(
+    hexes: pd.DataFrame,
+    variable: str = "speeding_pct",
+    group_col: Optional[str] = "city",
+    cell_col: str = "h3_cell",
+    k: int = 1,
+    permutations: int = 999,
+    seed: int = RANDOM_SEED,
+    batch_size: int = 64,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Gi* hotspots, LISA clusters and global Moran's I for all groups at once.
+
+    Args:
+        hexes: Per-hex table (one row per group x cell).
+        variable: Column to analyze.
+        group_col: Group column (e.g. "city"); None treats all hexes as one
+            region (e.g. a nationwide map).
+        cell_col: UINT64 H3 cell id column.
+        k: k-ring distance defining neighbors.
+        permutations: Number of permutations for inference.
+        seed: Seed for the SeedSequence spawned per group.
+        batch_size: Shuffled columns per sparse product for global Moran's I.
+
+    Returns:
+        (hexes with gi_zscore, gi_pvalue, hotspot_class, lisa_I, lisa_pvalue,
+        lisa_quadrant, lisa_cluster added; per-group global Moran's I table).
+    """
+    groups = hexes[group_col].values if group_col else np.zeros(len(hexes), dtype=np.int64)
+    codes, labels = pd.factorize(groups, sort=True)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(labels) + 1))
+
+    x_all = hexes[variable].values.astype(np.float64)[order]
+    A_all = h3_weights(hexes[cell_col].values[order], codes[order], k=k)
+    streams = np.random.SeedSequence(seed).spawn(len(labels))
+
+    local_cols = {}
+    global_rows = []
+    for g, label in enumerate(labels):
+        lo, hi = bounds[g], bounds[g + 1]
+        rng = np.random.default_rng(streams[g])
+        local, glob = _group_statistics(
+            x_all[lo:hi], A_all[lo:hi, lo:hi], permutations, rng, batch_size,
+        )
+        for name, values in local.items():
+            local_cols.setdefault(name, np.empty(len(hexes), dtype=values.dtype))[lo:hi] = values
+        global_rows.append({group_col or "group": label, **glob})
+
+    out = hexes.copy()
+    inverse = np.empty_like(order)
+    inverse[order] = np.arange(len(order))
+    for name, values in local_cols.items():
+        out[name] = values[inverse]
+    out["hotspot_class"] = classify_hotspots(out["gi_zscore"].values, out["gi_pvalue"].values)
+    out["lisa_cluster"] = classify_lisa(out["lisa_quadrant"].values, out["lisa_pvalue"].values)
+
+    return out, pd.DataFrame(global_rows)
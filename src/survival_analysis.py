@@ -36,6 +36,7 @@ from scipy import stats
 
 sys.path.insert(0, str(Path(__file__).parent))
 from config import DATA_DIR, FIGURES_DIR, MODELING_DIR, FIG_DPI, RANDOM_SEED
+from resampling import bootstrap, percentile_interval
 
 warnings.filterwarnings('ignore', category=FutureWarning)
 warnings.filterwarnings('ignore', category=RuntimeWarning)
@@ -612,6 +613,17 @@ def plot_cumulative_hazard(df: pd.DataFrame, output_path: Path) -> None:
     print(f"Saved: {output_path}")
 
 
+def _mediation_pct(series: pd.DataFrame) -> float:
+    """Share (%) of the first-to-last experience bin speeding gap not seen within STD/ECO."""
+    overall = series[series['series'] == 'overall'].sort_values('experience_bin', kind='stable')
+    std_eco = series[series['series'] == 'std_eco'].sort_values('experience_bin', kind='stable')
+    b_total = overall['speeding_rate'].iloc[-1] - overall['speeding_rate'].iloc[0]
+    b_direct = std_eco['speeding_rate'].iloc[-1] - std_eco['speeding_rate'].iloc[0]
+    if b_total == 0:
+        return np.nan
+    return (1 - b_direct / b_total) * 100
+
+
 def compute_tub_mediation(df: pd.DataFrame) -> dict[str, Any]:
     """Estimate how much of the experience-speeding link is mediated by TUB adoption.
 
@@ -685,27 +697,17 @@ def compute_tub_mediation(df: pd.DataFrame) -> dict[str, Any]:
             direct_effect = (std_sorted.iloc[-1]['speeding_rate'] -
                              std_sorted.iloc[0]['speeding_rate'])
             mediation_pct = (1 - direct_effect / total_effect) * 100 if total_effect != 0 else 0
-            # Bootstrap CI for mediation proportion
+            # Bootstrap CI for mediation proportion: experience bins resampled
+            # with replacement, independently for the overall and STD/ECO series
             print("\n  Bootstrapping mediation CI (1000 iterations)...")
             n_boot = 1000
-            boot_mediation = []
-            all_bins = sorted(overall['experience_bin'].unique())
-            first_bin, last_bin = all_bins[0], all_bins[-1]
-            for b in range(n_boot):
-                # Resample cities/users by resampling experience bins with replacement
-                boot_overall = overall.sample(n=len(overall), replace=True,
-                                              random_state=RANDOM_SEED + b)
-                boot_std = std_eco.sample(n=len(std_eco), replace=True,
-                                          random_state=RANDOM_SEED + b)
-                bo_sorted = boot_overall.sort_values('experience_bin')
-                bs_sorted = boot_std.sort_values('experience_bin')
-                if len(bo_sorted) >= 2 and len(bs_sorted) >= 2:
-                    b_total = bo_sorted.iloc[-1]['speeding_rate'] - bo_sorted.iloc[0]['speeding_rate']
-                    b_direct = bs_sorted.iloc[-1]['speeding_rate'] - bs_sorted.iloc[0]['speeding_rate']
-                    if b_total != 0:
-                        boot_mediation.append((1 - b_direct / b_total) * 100)
-            boot_arr = np.array(boot_mediation)
-            ci_lo, ci_hi = np.percentile(boot_arr, [2.5, 97.5])
+            series = pd.concat([
+                overall[['experience_bin', 'speeding_rate']].assign(series='overall'),
+                std_eco[['experience_bin', 'speeding_rate']].assign(series='std_eco'),
+            ], ignore_index=True)
+            boot = bootstrap(series, _mediation_pct, n_replicates=n_boot,
+                             scheme='iid', strata='series', seed=RANDOM_SEED)
+            ci_lo, ci_hi = (float(v[0]) for v in percentile_interval(boot['replicates']))
 
             results['mediation'] = {
                 'total_effect': float(total_effect),
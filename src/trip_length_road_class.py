@@ -23,6 +23,7 @@ import json
 import sys
 import time
 import warnings
+from functools import partial
 from pathlib import Path
 from typing import Any, Dict, List, Tuple
 
@@ -45,6 +46,7 @@ from src.config import (
     DATA_DIR, FIGURES_DIR, MODELING_DIR,
     RANDOM_SEED, FIG_DPI, SPEED_LIMIT_KR,
 )
+from src.resampling import bootstrap, percentile_interval
 
 np.random.seed(RANDOM_SEED)
 
@@ -194,6 +196,12 @@ def wilson_ci(successes: int, n: int, alpha: float = 0.05) -> Tuple[float, float
     return (max(0, center - margin), min(1, center + margin))
 
 
+def _lowess_on_grid(sample: np.ndarray, x_grid: np.ndarray) -> np.ndarray:
+    """LOWESS of speeding on distance (columns 0, 1 of sample) interpolated to x_grid."""
+    fit = sm_lowess(sample[:, 1], sample[:, 0], frac=0.15, it=3, return_sorted=True)
+    return np.interp(x_grid, fit[:, 0], fit[:, 1])
+
+
 def analyze_distance_deciles(df: pd.DataFrame) -> Dict[str, Any]:
     """Compute speeding rate by distance decile with LOWESS and CIs.
 
@@ -238,28 +246,21 @@ def analyze_distance_deciles(df: pd.DataFrame) -> Dict[str, Any]:
         return_sorted=True,
     )
 
-    # Bootstrap CIs for LOWESS
+    # Bootstrap CIs for LOWESS (replicates fitted in parallel worker processes)
     print("  Computing bootstrap CIs for LOWESS...")
     n_boot = 20
-    boot_curves = []
     x_grid = np.linspace(df["distance"].quantile(0.01), df["distance"].quantile(0.99), 200)
-    for i in range(n_boot):
-        boot_sample = sample.sample(n=sample_n, replace=True, random_state=RANDOM_SEED + i)
-        boot_lowess = sm_lowess(
-            boot_sample["is_speeding_int"].values,
-            boot_sample["distance"].values,
-            frac=0.15,
-            it=3,
-            return_sorted=True,
-        )
-        # Interpolate to common grid
-        boot_y = np.interp(x_grid, boot_lowess[:, 0], boot_lowess[:, 1])
-        boot_curves.append(boot_y)
-
-    boot_curves = np.array(boot_curves)
-    lowess_ci_lower = np.percentile(boot_curves, 2.5, axis=0)
-    lowess_ci_upper = np.percentile(boot_curves, 97.5, axis=0)
-    lowess_mean = np.mean(boot_curves, axis=0)
+    boot = bootstrap(
+        sample[["distance", "is_speeding_int"]].to_numpy(dtype=np.float64),
+        partial(_lowess_on_grid, x_grid=x_grid),
+        n_replicates=n_boot,
+        scheme="iid",
+        seed=RANDOM_SEED,
+        n_jobs=-1,
+    )
+    boot_curves = boot["replicates"]
+    lowess_ci_lower, lowess_ci_upper = percentile_interval(boot_curves)
+    lowess_mean = np.nanmean(boot_curves, axis=0)
 
     # Plot
     fig, ax = plt.subplots(figsize=(8, 5))
@@ -3,7 +3,9 @@ Bootstrap confidence intervals for TUB mediation percentages.
 
 Resamples users (not trips) with replacement to preserve within-user
 correlation structure. Computes mediation % for each outcome across
-500 bootstrap iterations, reports 95% percentile CIs.
+10,000 bootstrap replicates, reports 95% percentile CIs. Replicates are
+multinomial user-count vectors applied in blocks through one sparse
+user x experience-bin product, instead of re-grouping DataFrames.
 
 Also extracts Schoenfeld residual correlation direction for Cox PH models
 to determine whether TUB effect intensifies or attenuates over the trip sequence.
@@ -18,6 +20,7 @@ from pathlib import Path
 import duckdb
 import numpy as np
 import pandas as pd
+from scipy import sparse
 
 warnings.filterwarnings("ignore")
 
@@ -32,7 +35,9 @@ OUTCOMES = [
     "speed_cv", "cruise_fraction", "zero_speed_fraction",
 ]
 
-N_BOOTSTRAP = 500
+N_BOOTSTRAP = 10000
+# Replicates per sparse product (users x BOOT_BLOCK float64 weights)
+BOOT_BLOCK = 250
 SAMPLE_USERS = 50000
 
 
@@ -96,15 +101,69 @@ def compute_mediation(df: pd.DataFrame) -> dict[str, float]:
     return results
 
 
-def bootstrap_mediation(df: pd.DataFrame, n_boot: int = N_BOOTSTRAP) -> dict:
+def user_bin_matrix(df: pd.DataFrame, user_codes: np.ndarray, bin_codes: np.ndarray,
+                    n_users: int, n_bins: int) -> sparse.csr_matrix:
+    """Sparse (stat rows x users) matrix of per-(user, exp_bin) sums and counts.
+
+    Rows are ordered (subset, outcome, stat, bin) with subsets all / STD+ECO
+    and stats sum / non-null count, so for a (users x replicates) weight
+    matrix W every weighted bin total is one row of ``M @ W``.
+    """
+    subsets = [np.ones(len(df), dtype=bool), df["mode"].isin(["STD", "ECO"]).values]
+    rows, cols, vals = [], [], []
+    block = 0
+    for mask in subsets:
+        for outcome in OUTCOMES:
+            y = df[outcome].values.astype(np.float64)
+            valid = mask & ~np.isnan(y)
+            for stat in (y, np.ones(len(y))):
+                rows.append(block * n_bins + bin_codes[valid])
+                cols.append(user_codes[valid])
+                vals.append(stat[valid])
+                block += 1
+    # Duplicate (row, user) entries are summed by the CSR conversion
+    return sparse.coo_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(block * n_bins, n_users),
+    ).tocsr()
+
+
+def mediation_from_totals(totals: np.ndarray, n_bins: int) -> np.ndarray:
+    """Mediation % per (outcome, replicate) from weighted bin totals.
+
+    Args:
+        totals: ``M @ W`` from user_bin_matrix, shape (rows, replicates).
+        n_bins: Number of experience bins.
+
+    Returns:
+        Array of shape (len(OUTCOMES), replicates). Bins without weight are
+        skipped, as groupby drops them.
+    """
+    t = totals.reshape(2, len(OUTCOMES), 2, n_bins, -1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = t[:, :, 0] / t[:, :, 1]
+    ranges = np.nanmax(means, axis=2) - np.nanmin(means, axis=2)
+    total_range, direct_range = ranges[0], ranges[1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pct = (total_range - direct_range) / total_range * 100
+    return np.where(total_range != 0, pct, 0.0)
+
+
+def bootstrap_mediation(df: pd.DataFrame, n_boot: int = N_BOOTSTRAP,
+                        block_size: int = BOOT_BLOCK) -> dict:
     """Bootstrap CIs for mediation percentages by resampling users.
 
-    Pre-computes user-level summary stats to avoid expensive DataFrame
-    operations inside the loop.
+    Cluster bootstrap in matrix form: each replicate is a vector of
+    multinomial user counts (n_users draws with replacement, as resampling
+    users does), and all weighted bin means of a block of replicates come
+    from one sparse product with the user x bin sums/counts matrix.
+    Replicate r draws from its own child of SeedSequence(RANDOM_SEED), so
+    results do not depend on block_size.
     """
-    rng = np.random.RandomState(RANDOM_SEED)
-    user_ids = df["user_id"].unique()
+    user_codes, user_ids = pd.factorize(df["user_id"])
+    bin_codes = df["exp_bin"].cat.codes.values.astype(np.int64)
     n_users = len(user_ids)
+    n_bins = len(df["exp_bin"].cat.categories)
 
     print(f"\n  Running {n_boot} bootstrap iterations ({n_users:,} users)...")
 
@@ -114,84 +173,34 @@ def bootstrap_mediation(df: pd.DataFrame, n_boot: int = N_BOOTSTRAP) -> dict:
     for outcome in OUTCOMES:
         print(f"    {outcome}: {point[outcome]:.1f}%")
 
-    # Pre-compute user-level aggregates per (user, exp_bin) and (user, exp_bin, mode)
-    # This avoids re-grouping millions of rows in each iteration
-    print("  Pre-computing user-level aggregates...")
-    user_exp = df.groupby(["user_id", "exp_bin"], observed=True)[OUTCOMES].agg(["sum", "count"])
-    user_exp.columns = [f"{o}_{s}" for o, s in user_exp.columns]
-    user_exp = user_exp.reset_index()
+    print("  Pre-computing user x exp_bin sums and counts...")
+    M = user_bin_matrix(df, user_codes, bin_codes, n_users, n_bins)
 
-    # STD/ECO only
-    std_eco_mask = df["mode"].isin(["STD", "ECO"])
-    user_exp_se = df[std_eco_mask].groupby(["user_id", "exp_bin"], observed=True)[OUTCOMES].agg(["sum", "count"])
-    user_exp_se.columns = [f"{o}_{s}" for o, s in user_exp_se.columns]
-    user_exp_se = user_exp_se.reset_index()
-
-    # Create user_id -> integer index for fast lookup
-    uid_to_idx = {uid: i for i, uid in enumerate(user_ids)}
-    user_exp["uid_idx"] = user_exp["user_id"].map(uid_to_idx)
-    user_exp_se["uid_idx"] = user_exp_se["user_id"].map(uid_to_idx)
-
-    # Bootstrap
-    boot_results = {o: [] for o in OUTCOMES}
+    streams = np.random.SeedSequence(RANDOM_SEED).spawn(n_boot)
+    boot = np.empty((len(OUTCOMES), n_boot))
 
     t0 = time.time()
-    for i in range(n_boot):
-        if (i + 1) % 50 == 0:
-            elapsed = time.time() - t0
-            rate = (i + 1) / elapsed
-            eta = (n_boot - i - 1) / rate
-            print(f"    Iteration {i + 1}/{n_boot} ({rate:.1f} iter/s, ETA {eta:.0f}s)")
-
-        # Resample user indices with replacement
-        boot_idx = rng.randint(0, n_users, size=n_users)
-
-        # Count how many times each user is sampled
-        unique_idx, counts = np.unique(boot_idx, return_counts=True)
-        weight_map = dict(zip(unique_idx, counts))
-
-        # Apply weights to pre-aggregated data
-        boot_all = user_exp[user_exp["uid_idx"].isin(unique_idx)].copy()
-        boot_all["_w"] = boot_all["uid_idx"].map(weight_map)
-
-        boot_se = user_exp_se[user_exp_se["uid_idx"].isin(unique_idx)].copy()
-        boot_se["_w"] = boot_se["uid_idx"].map(weight_map)
-
-        med = {}
-        for outcome in OUTCOMES:
-            sum_col = f"{outcome}_sum"
-            cnt_col = f"{outcome}_count"
-
-            # Weighted group means
-            all_grp = boot_all.groupby("exp_bin", observed=True).apply(
-                lambda g: (g[sum_col] * g["_w"]).sum() / (g[cnt_col] * g["_w"]).sum(),
-                include_groups=False,
-            )
-            se_grp = boot_se.groupby("exp_bin", observed=True).apply(
-                lambda g: (g[sum_col] * g["_w"]).sum() / (g[cnt_col] * g["_w"]).sum(),
-                include_groups=False,
-            )
-
-            total_range = all_grp.max() - all_grp.min()
-            direct_range = se_grp.max() - se_grp.min()
-
-            if total_range != 0:
-                med[outcome] = float((total_range - direct_range) / total_range * 100)
-            else:
-                med[outcome] = 0.0
-
-        for outcome in OUTCOMES:
-            boot_results[outcome].append(med[outcome])
+    for start in range(0, n_boot, block_size):
+        stop = min(start + block_size, n_boot)
+        W = np.empty((n_users, stop - start))
+        for j, r in enumerate(range(start, stop)):
+            draws = np.random.default_rng(streams[r]).integers(0, n_users, size=n_users)
+            W[:, j] = np.bincount(draws, minlength=n_users)
+        boot[:, start:stop] = mediation_from_totals(M @ W, n_bins)
+
+        if (start // block_size + 1) % 8 == 0 or stop == n_boot:
+            rate = stop / (time.time() - t0)
+            print(f"    Iteration {stop}/{n_boot} ({rate:.0f} iter/s, ETA {(n_boot - stop) / rate:.0f}s)")
 
     elapsed = time.time() - t0
-    print(f"\n  Bootstrap completed in {elapsed:.0f}s ({elapsed / n_boot:.2f}s/iter)")
+    print(f"\n  Bootstrap completed in {elapsed:.1f}s ({elapsed / n_boot * 1000:.1f}ms/iter)")
 
     # Compute CIs
     results = {}
     print(f"\n  {'Outcome':<25s} {'Point':<10s} {'95% CI':<25s} {'SE':<10s}")
     print(f"  {'-' * 70}")
-    for outcome in OUTCOMES:
-        vals = np.array(boot_results[outcome])
+    for k, outcome in enumerate(OUTCOMES):
+        vals = boot[k]
         ci_lo = float(np.percentile(vals, 2.5))
         ci_hi = float(np.percentile(vals, 97.5))
         se = float(np.std(vals))
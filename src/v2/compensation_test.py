@@ -4,7 +4,7 @@ Phase 3: Compensation Test (Tasks 3.1-3.5).
 Tests Peltzman / risk homeostasis: do riders compensate on unconstrained margins
 when speed governance changes?
 
-Task 3.1: Multi-outcome DiD restricted to STD/ECO trips only.
+Task 3.1: Multi-outcome DiD restricted to STD/ECO trips only (panel and trip level).
 Task 3.2: Mode-switcher within-user DiD on all outcomes.
 Task 3.3: Cohen's d effect sizes across all outcomes.
 Task 3.4: Mode-switcher placebo (Oct 2023).
@@ -25,13 +25,13 @@ matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import statsmodels.api as sm
 from scipy.spatial import cKDTree
 
 warnings.filterwarnings("ignore")
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 from src.config import DATA_DIR, FIGURES_DIR, FIG_DPI, RANDOM_SEED
+from src.hdfe import hdfe_regression
 
 V2_DIR = DATA_DIR / "v2"
 FIG_DIR = FIGURES_DIR / "v2"
@@ -154,7 +154,7 @@ def _load_dec_trips(con: duckdb.DuckDBPyConnection) -> pd.DataFrame:
 
 
 def task_3_1(panel: pd.DataFrame) -> dict:
-    """Multi-outcome DiD restricted to STD/ECO trips only (city-month level)."""
+    """Multi-outcome DiD restricted to STD/ECO trips only (city-month panel, and trips with user FE)."""
     print("=" * 60)
     print("Task 3.1: DiD on STD/ECO Trips Only")
     print("=" * 60)
@@ -198,33 +198,39 @@ def task_3_1(panel: pd.DataFrame) -> dict:
     panel_se["post"] = (panel_se["month_year"] == "2023-12").astype(int)
     panel_se["treat_x_post"] = panel_se["tub_share_nov"] * panel_se["post"]
 
-    # TWFE DiD per outcome
-    city_dummies = pd.get_dummies(panel_se["city"], prefix="city", dtype=float, drop_first=True)
-    month_dummies = pd.get_dummies(panel_se["month_year"], prefix="month", dtype=float, drop_first=True)
+    # Trip-level design: same treatment, user + city + month FE absorbed
+    all_trips = all_trips.merge(panel_se[["city", "month_year", "treat_x_post"]],
+                                on=["city", "month_year"], how="left")
+    print(f"  Trip-level rows: {len(all_trips):,} ({all_trips['user_id'].nunique():,} users)")
 
     n_tests = len(OUTCOMES)
     bonf_alpha = 0.05 / n_tests
     results = {}
 
     for outcome in OUTCOMES:
-        y = panel_se[outcome].values
-        X = np.column_stack([
-            panel_se["treat_x_post"].values,
-            city_dummies.values,
-            month_dummies.values,
-        ])
-        X = sm.add_constant(X)
-
-        model = sm.OLS(y, X).fit(cov_type="cluster", cov_kwds={"groups": panel_se["city"]})
+        # TWFE DiD on the city-month panel (city + month FE absorbed)
+        model = hdfe_regression(
+            panel_se[outcome].values, panel_se[["treat_x_post"]],
+            [panel_se["city"].values, panel_se["month_year"].values],
+            cluster=panel_se["city"].values,
+        )
 
-        beta = model.params[1]
-        se = model.bse[1]
-        p = model.pvalues[1]
-        ci_lo, ci_hi = model.conf_int()[1]
+        beta = model["params"]["treat_x_post"]
+        se = model["bse"]["treat_x_post"]
+        p = model["pvalues"]["treat_x_post"]
+        ci_lo, ci_hi = model["conf_int"].loc["treat_x_post"]
 
         sig = "***" if p < 0.001 else "**" if p < 0.01 else "*" if p < 0.05 else "ns"
         bonf = " [Bonf]" if p < bonf_alpha else ""
 
+        # Same DiD on trips with user fixed effects (within-rider change)
+        trips = all_trips[np.isfinite(all_trips[outcome]) & all_trips["treat_x_post"].notna()]
+        trip_model = hdfe_regression(
+            trips[outcome].values, trips[["treat_x_post"]],
+            [trips["user_id"].values, trips["city"].values, trips["month_year"].values],
+            cluster=trips["city"].values, dtype=np.float32,
+        )
+
         results[outcome] = {
             "beta": round(float(beta), 4),
             "se": round(float(se), 4),
@@ -232,9 +238,18 @@ def task_3_1(panel: pd.DataFrame) -> dict:
             "ci_lower": round(float(ci_lo), 4),
             "ci_upper": round(float(ci_hi), 4),
             "significant_bonferroni": p < bonf_alpha,
+            "trip_level_user_fe": {
+                "beta": round(float(trip_model["params"]["treat_x_post"]), 4),
+                "se": round(float(trip_model["bse"]["treat_x_post"]), 4),
+                "p": float(trip_model["pvalues"]["treat_x_post"]),
+                "n_trips": int(trip_model["nobs"]),
+                "converged": trip_model["converged"],
+            },
         }
 
         print(f"  {outcome:<25s} beta={beta:>8.4f} SE={se:.4f} p={p:.4g} {sig}{bonf}")
+        print(f"  {'':<25s} trip-level + user FE: beta={trip_model['params']['treat_x_post']:>8.4f} "
+              f"SE={trip_model['bse']['treat_x_post']:.4f} p={trip_model['pvalues']['treat_x_post']:.4g}")
 
     return results
 
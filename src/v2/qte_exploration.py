@@ -5,7 +5,8 @@ Extends the mean-level TWFE DiD framework to quantile-specific effects.
 Key question: Does the TUB ban disproportionately reduce extreme-risk trips?
 
 Approach:
-1. Build city-month panel with quantile summaries (p25, p50, p75, p90)
+1. Build city-month panel with quantile summaries (p25, p50, p75, p90),
+   aggregated in DuckDB (exact quantile_cont, or mergeable t-digests)
 2. Run TWFE DiD at each quantile for each outcome
 3. Create visualization showing how treatment effects vary across distribution
 
@@ -35,6 +36,13 @@ warnings.filterwarnings("ignore")
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 from src.config import DATA_DIR, FIGURES_DIR, FIG_DPI, RANDOM_SEED
+from src.quantile_digest import (
+    COMPRESSION,
+    build_digests,
+    digest_quantiles,
+    merge_digests,
+    quantile_label,
+)
 
 V2_DIR = DATA_DIR / "v2"
 FIG_DIR = FIGURES_DIR / "v2"
@@ -83,30 +91,33 @@ ACCEL_FACTOR = 1000.0 / 3600.0 / 10.0
 HARSH_THRESH = 0.5
 
 
-def build_quantile_panel(con: duckdb.DuckDBPyConnection) -> pd.DataFrame:
-    """Build city-month panel with quantile summaries for each outcome."""
-    print("=" * 60)
-    print("Building City-Month Quantile Panel (Feb-Dec 2023)")
-    print("=" * 60)
+def register_trip_view(con: duckdb.DuckDBPyConnection) -> None:
+    """Create view qte_trips of Feb-Dec 2023 trips (city, month_year, mode, outcomes).
 
+    Feb-Nov come from trip_modeling; Dec 2023 is parsed from the raw CSV
+    and each trip is assigned the nearest city centre, all inside DuckDB.
+    """
     trip_path = str(V2_DIR / "trip_modeling.parquet").replace("\\", "/")
-
-    # Step 1: Feb-Nov from trip_modeling
-    print("  Loading Feb-Nov from trip_modeling...")
-    feb_nov = con.execute(f"""
-        SELECT city, month_year, mode, user_id,
-               mean_speed, harsh_accel_count, harsh_decel_count,
-               speed_cv, cruise_fraction, zero_speed_fraction
+    dec_csv = str(RAW_DIR / "2023_12_Swing_Routes.csv").replace("\\", "/")
+    all_outcomes = QTE_OUTCOMES + QTE_HARSH
+    outcome_cols = ", ".join(all_outcomes)
+
+    con.register("city_centers_df", pd.DataFrame(
+        [(c, lat, lon) for c, (lat, lon) in CITY_CENTERS.items()],
+        columns=["city", "lat", "lon"],
+    ))
+    con.execute("CREATE OR REPLACE TEMP TABLE city_centers AS SELECT * FROM city_centers_df")
+    con.unregister("city_centers_df")
+
+    con.execute(f"""
+        CREATE OR REPLACE VIEW feb_nov_trips AS
+        SELECT city, month_year, mode, {outcome_cols}
         FROM read_parquet('{trip_path}')
         WHERE mode IN ('TUB', 'STD', 'ECO')
-    """).fetchdf()
-    print(f"  Feb-Nov trips: {len(feb_nov):,}")
+    """)
 
-    # Step 2: Dec 2023 from raw CSV
-    print("  Processing Dec 2023 from raw CSV...")
-    dec_csv = str(RAW_DIR / "2023_12_Swing_Routes.csv").replace("\\", "/")
-
-    dec_raw = con.execute(f"""
+    con.execute(f"""
+        CREATE OR REPLACE VIEW dec_trips AS
         WITH raw_parsed AS (
             SELECT
                 route_id, user_id, model,
@@ -143,54 +154,162 @@ def build_quantile_panel(con: duckdb.DuckDBPyConnection) -> pd.DataFrame:
                 )) AS speed_std_val,
                 list_transform(range(1, n_pts), i -> (speed_arr[i+1] - speed_arr[i]) * {ACCEL_FACTOR}) AS accel_arr
             FROM with_stats
+        ),
+        dec AS (
+            SELECT
+                mode, month_year,
+                -- Nearest city centre in (lat, lon), as a k-d tree query on the raw coordinates
+                (
+                    SELECT arg_min(c.city, (start_lat - c.lat) ** 2 + (start_lon - c.lon) ** 2)
+                    FROM city_centers c
+                ) AS city,
+                ROUND(mean_spd, 2) AS mean_speed,
+                list_count(list_filter(accel_arr, x -> x > {HARSH_THRESH})) AS harsh_accel_count,
+                list_count(list_filter(accel_arr, x -> x < -{HARSH_THRESH})) AS harsh_decel_count,
+                ROUND(CASE WHEN mean_spd > 0 THEN speed_std_val / mean_spd ELSE 0.0 END, 4) AS speed_cv,
+                ROUND(list_count(list_filter(speed_arr, x -> abs(x - mean_spd) <= 3.0)) * 1.0 / n_pts, 4) AS cruise_fraction,
+                ROUND(list_count(list_filter(speed_arr, x -> x = 0.0)) * 1.0 / n_pts, 4) AS zero_speed_fraction
+            FROM with_derived
+            WHERE mode IN ('TUB', 'STD', 'ECO')
         )
-        SELECT
-            user_id, mode, month_year,
-            start_lat, start_lon,
-            ROUND(mean_spd, 2) AS mean_speed,
-            list_count(list_filter(accel_arr, x -> x > {HARSH_THRESH})) AS harsh_accel_count,
-            list_count(list_filter(accel_arr, x -> x < -{HARSH_THRESH})) AS harsh_decel_count,
-            ROUND(CASE WHEN mean_spd > 0 THEN speed_std_val / mean_spd ELSE 0.0 END, 4) AS speed_cv,
-            ROUND(list_count(list_filter(speed_arr, x -> abs(x - mean_spd) <= 3.0)) * 1.0 / n_pts, 4) AS cruise_fraction,
-            ROUND(list_count(list_filter(speed_arr, x -> x = 0.0)) * 1.0 / n_pts, 4) AS zero_speed_fraction
-        FROM with_derived
-        WHERE mode IN ('TUB', 'STD', 'ECO')
-    """).fetchdf()
-    print(f"  Dec 2023 trips: {len(dec_raw):,}")
-
-    # Assign city to Dec trips
-    from scipy.spatial import cKDTree
-    city_names = list(CITY_CENTERS.keys())
-    city_coords = np.array([CITY_CENTERS[c] for c in city_names])
-    city_tree = cKDTree(city_coords)
-    trip_coords = np.column_stack([dec_raw["start_lat"].values, dec_raw["start_lon"].values])
-    _, idxs = city_tree.query(trip_coords, k=1)
-    dec_raw["city"] = [city_names[i] for i in idxs]
-
-    # Combine
+        SELECT city, month_year, mode, {outcome_cols}
+        FROM dec
+    """)
+
+    con.execute("""
+        CREATE OR REPLACE VIEW qte_trips AS
+        SELECT * FROM feb_nov_trips
+        UNION ALL BY NAME
+        SELECT * FROM dec_trips
+    """)
+
+
+def exact_quantile_panel(
+    con: duckdb.DuckDBPyConnection,
+    quantiles: list = QUANTILES,
+) -> pd.DataFrame:
+    """City-month means and exact quantiles in one DuckDB aggregation.
+
+    quantile_cont with a list of levels sorts each group once, so a finer
+    grid costs little more than the four default levels.
+    """
     all_outcomes = QTE_OUTCOMES + QTE_HARSH
-    all_trips = pd.concat([
-        feb_nov[["city", "month_year", "mode", "user_id"] + all_outcomes],
-        dec_raw[["city", "month_year", "mode", "user_id"] + all_outcomes],
-    ], ignore_index=True)
-    print(f"  Total trips (Feb-Dec): {len(all_trips):,}")
-
-    # Aggregate to city-month panel with quantile summaries
-    print("  Computing quantile summaries per city-month...")
-    records = []
-    for (city, month), grp in all_trips.groupby(["city", "month_year"]):
-        rec = {"city": city, "month_year": month, "trip_count": len(grp)}
-        rec["tub_share"] = (grp["mode"] == "TUB").mean()
-
-        for outcome in all_outcomes:
-            vals = grp[outcome].dropna()
-            rec[f"{outcome}_mean"] = vals.mean()
-            for q in QUANTILES:
-                q_label = f"p{int(q*100)}"
-                rec[f"{outcome}_{q_label}"] = vals.quantile(q)
-        records.append(rec)
-
-    panel = pd.DataFrame(records)
+    q_list = "[" + ", ".join(str(q) for q in quantiles) + "]"
+    inner = ",\n".join(
+        f"AVG({o}) AS {o}_mean, quantile_cont({o}, {q_list}) AS {o}_q" for o in all_outcomes
+    )
+    outer = ",\n".join(
+        f"{o}_mean, " + ", ".join(
+            f"{o}_q[{i + 1}] AS {o}_{quantile_label(q)}" for i, q in enumerate(quantiles)
+        )
+        for o in all_outcomes
+    )
+    return con.execute(f"""
+        SELECT city, month_year, trip_count, tub_share, {outer}
+        FROM (
+            SELECT city, month_year, COUNT(*) AS trip_count,
+                   AVG(CASE WHEN mode = 'TUB' THEN 1.0 ELSE 0.0 END) AS tub_share,
+                   {inner}
+            FROM qte_trips
+            GROUP BY city, month_year
+        )
+        ORDER BY city, month_year
+    """).df()
+
+
+def source_fingerprint() -> dict:
+    """Identity of the panel's inputs and digest settings, for cache validation."""
+    sources = {}
+    for path in (V2_DIR / "trip_modeling.parquet", RAW_DIR / "2023_12_Swing_Routes.csv"):
+        try:
+            st = path.stat()
+            sources[str(path)] = [st.st_size, st.st_mtime_ns]
+        except OSError:
+            sources[str(path)] = None
+    return {
+        "sources": sources,
+        "delta": COMPRESSION,
+        "outcomes": QTE_OUTCOMES + QTE_HARSH,
+    }
+
+
+def approx_quantile_panel(
+    con: duckdb.DuckDBPyConnection,
+    quantiles: list = QUANTILES,
+    refresh: bool = False,
+) -> pd.DataFrame:
+    """City-month means and quantiles read off cached t-digest sketches.
+
+    Digests are built per source partition (Feb-Nov parquet, Dec CSV),
+    merged, and saved with the city-month counts; later calls (any
+    quantile levels) load them instead of scanning the trips, as long as
+    the source files (size, mtime) and digest settings still match the
+    fingerprint stored with them; refresh forces a rebuild. Means are
+    exact; quantiles of heavily tied counts (harsh events) are interpolated
+    across tied values, so use exact mode for reported estimates.
+    """
+    groups = ["city", "month_year"]
+    digest_path = V2_DIR / "city_month_quantile_digests.parquet"
+    base_path = V2_DIR / "city_month_quantile_base.parquet"
+    fingerprint_path = V2_DIR / "city_month_quantile_digests.json"
+    fingerprint = source_fingerprint()
+    cached = None
+    if not refresh and digest_path.exists() and base_path.exists():
+        try:
+            with open(fingerprint_path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = None
+    if cached != fingerprint:
+        all_outcomes = QTE_OUTCOMES + QTE_HARSH
+        parts = [build_digests(con, view, groups, all_outcomes)
+                 for view in ("feb_nov_trips", "dec_trips")]
+        digests = merge_digests(con, parts, groups)
+        base = con.execute("""
+            SELECT city, month_year, COUNT(*) AS trip_count,
+                   AVG(CASE WHEN mode = 'TUB' THEN 1.0 ELSE 0.0 END) AS tub_share
+            FROM qte_trips
+            GROUP BY city, month_year
+            ORDER BY city, month_year
+        """).df()
+        digests.to_parquet(digest_path, index=False, compression="zstd")
+        base.to_parquet(base_path, index=False, compression="zstd")
+        with open(fingerprint_path, "w") as f:
+            json.dump(fingerprint, f, indent=2)
+        print(f"  Saved digests: {digest_path} ({len(digests):,} centroids)")
+    else:
+        digests = pd.read_parquet(digest_path)
+        base = pd.read_parquet(base_path)
+        print(f"  Loaded digests: {digest_path} ({len(digests):,} centroids)")
+    summaries = digest_quantiles(digests, groups, quantiles)
+    return base.merge(summaries, on=groups, how="left")
+
+
+def build_quantile_panel(
+    con: duckdb.DuckDBPyConnection,
+    quantiles: list = QUANTILES,
+    exact: bool = True,
+    refresh: bool = False,
+) -> pd.DataFrame:
+    """Build city-month panel with quantile summaries for each outcome.
+
+    Trips are aggregated inside DuckDB and never loaded into pandas. With
+    exact=False quantiles come from cached mergeable t-digest sketches
+    (see src/quantile_digest.py), so new quantile levels need no rescan;
+    refresh rebuilds the sketches even when the cache is current.
+    """
+    print("=" * 60)
+    print("Building City-Month Quantile Panel (Feb-Dec 2023)")
+    print("=" * 60)
+
+    register_trip_view(con)
+    if exact:
+        print("  Computing exact quantile summaries per city-month (DuckDB)...")
+        panel = exact_quantile_panel(con, quantiles)
+    else:
+        print("  Computing digest quantile summaries per city-month...")
+        panel = approx_quantile_panel(con, quantiles, refresh=refresh)
+    print(f"  Total trips (Feb-Dec): {int(panel['trip_count'].sum()):,}")
 
     # Add Nov TUB share as treatment intensity
     nov_tub = panel[panel["month_year"] == "2023-11"][["city", "tub_share"]].rename(
@@ -223,7 +342,7 @@ def run_qte_did(panel: pd.DataFrame) -> dict:
     results = {}
 
     all_outcomes = QTE_OUTCOMES + QTE_HARSH
-    quantile_labels = ["mean"] + [f"p{int(q*100)}" for q in QUANTILES]
+    quantile_labels = ["mean"] + [quantile_label(q) for q in QUANTILES]
 
     for outcome in all_outcomes:
         results[outcome] = {}
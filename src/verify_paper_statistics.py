@@ -191,7 +191,7 @@ check("Results", "GMM Stop-and-Go n=15,055", gmm_n_dict.get("Stop-and-Go", 0), 1
 print("\n--- Spatial: H3 Hexes ---")
 
 n_hexes = con.sql(f"""
-    SELECT COUNT(DISTINCT h3_origin) FROM read_parquet('{DATA}/trip_h3_indices.parquet')
+    SELECT COUNT(DISTINCT h3_origin_r8) FROM read_parquet('{DATA}/trip_h3_indices.parquet')
 """).fetchone()[0]
 check("Results", "8,144 unique origin hexes", n_hexes, 8144, tol=0.02)
 
@@ -0,0 +1,163 @@
+"""
+Wild cluster bootstrap (WCR) inference for few-cluster linear models.
+
+Fast formulation (Roodman, MacKinnon, Nielsen and Webb 2019, "Fast and wild"):
+for the coefficient of interest, the (weighted) design is partialled out on
+all other columns once (FWL, via an orthonormal basis Q of those columns),
+and everything the bootstrap needs collapses to cluster-level quantities:
+
+  s_g = x_g' u_g          restricted-residual scores
+  a_g = x_g' x_g
+  C   = (x_g' Q_g)(Q_h' u_h)   G x G correction for re-residualizing
+
+so for a G x B matrix V of weight draws (v_g constant within a cluster),
+
+  beta* - beta0 = s' V / x'x
+  score*        = diag(s) V - C V - a (s' V) / x'x
+
+and t* follows from the cluster-robust variance of score*. No refits are
+needed; B replicates cost O(G^2 B). The null is imposed (restricted
+residuals), p-values are symmetric (|t*| >= |t|) and confidence intervals
+come from inverting the test over beta0 with the same weight draws.
+"""
+
+import sys
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.config import RANDOM_SEED
+from src.resampling import wild_weights
+
+N_WCB = 9999
+# Rademacher weights have only 2**G distinct draws; below this many clusters use Webb
+MIN_RADEMACHER_CLUSTERS = 12
+
+
+class _Problem:
+    """One coefficient of a weighted linear model, partialled out for the bootstrap."""
+
+    def __init__(self, y, X, groups, j, weights=None):
+        scale = np.sqrt(np.asarray(weights, dtype=np.float64)) if weights is not None else 1.0
+        X = np.asarray(X, dtype=np.float64) * np.reshape(scale, (-1, 1))
+        y = np.asarray(y, dtype=np.float64) * scale
+        n, k = X.shape
+        Z = np.delete(X, j, axis=1)
+        U, sv, _ = np.linalg.svd(Z, full_matrices=False)
+        Q = U[:, sv > sv.max() * max(Z.shape) * np.finfo(float).eps]
+
+        self.x = X[:, j] - Q @ (Q.T @ X[:, j])
+        self.y = y - Q @ (Q.T @ y)
+        self.Q = Q
+        self.xx = float(self.x @ self.x)
+        self.beta = float(self.x @ self.y) / self.xx
+
+        codes, _ = pd.factorize(np.asarray(groups), sort=True)
+        self.G = int(codes.max()) + 1
+        self.S = sparse.csr_matrix((np.ones(n), (codes, np.arange(n))), shape=(self.G, n))
+        self.a = self.S @ (self.x * self.x)
+        self.xQ = self.S @ (self.x[:, None] * Q)
+        # Cluster-robust small-sample factor, as statsmodels cov_type='cluster'
+        self.factor = self.G / (self.G - 1) * (n - 1) / (n - k)
+
+    def se(self, u):
+        scores = self.S @ (self.x * u)
+        return np.sqrt(self.factor * np.sum(scores ** 2)) / self.xx
+
+    def t_stats(self, beta0, V):
+        """Observed t and bootstrap t* (length B) for H0: beta = beta0."""
+        u = self.y - self.x * beta0                 # restricted residuals
+        s = self.S @ (self.x * u)
+        C = self.xQ @ (self.S @ (self.Q * u[:, None])).T
+        num = s @ V / self.xx                        # beta* - beta0
+        scores = s[:, None] * V - C @ V - self.a[:, None] * num[None, :]
+        se_star = np.sqrt(self.factor * np.sum(scores ** 2, axis=0)) / self.xx
+        t = (self.beta - beta0) / self.se(self.y - self.x * self.beta)
+        return t, num / se_star
+
+    def pvalue(self, beta0, V):
+        t, t_star = self.t_stats(beta0, V)
+        return float(np.mean(np.abs(t_star) >= abs(t)))
+
+
+def _invert(problem, V, alpha, side, tol):
+    """Bound of {beta0: p(beta0) > alpha} on one side of beta, by bisection."""
+    step = problem.se(problem.y - problem.x * problem.beta)
+    inside, outside = problem.beta, problem.beta + side * step
+    for _ in range(60):
+        if problem.pvalue(outside, V) <= alpha:
+            break
+        inside, step = outside, 2 * step
+        outside = problem.beta + side * step
+    else:
+        return np.nan
+    while abs(outside - inside) > tol:
+        mid = (inside + outside) / 2
+        if problem.pvalue(mid, V) > alpha:
+            inside = mid
+        else:
+            outside = mid
+    return (inside + outside) / 2
+
+
+def wild_cluster_bootstrap(
+    y: np.ndarray,
+    X: np.ndarray,
+    groups: np.ndarray,
+    params: Sequence[int] = (1,),
+    weights: Optional[np.ndarray] = None,
+    n_boot: int = N_WCB,
+    weight_type: Optional[str] = None,
+    null: float = 0.0,
+    level: float = 0.95,
+    seed: int = RANDOM_SEED,
+    conf_int: bool = True,
+) -> dict:
+    """Wild cluster restricted bootstrap p-values and CIs.
+
+    Args:
+        y: Outcome.
+        X: Full design (constant, regressors, fixed-effect dummies).
+        groups: Cluster labels per row.
+        params: Column indices of X to test.
+        weights: WLS weights as passed to sm.WLS (inverse variances).
+        n_boot: Weight draws (shared by all tests and the CI inversion).
+        weight_type: 'rademacher', 'webb' or 'mammen'; default Webb below
+            MIN_RADEMACHER_CLUSTERS clusters, Rademacher otherwise.
+        null: Hypothesized value for the p-values.
+        level: Confidence level of the inverted intervals.
+        seed: Seed of the weight draws.
+        conf_int: Whether to invert the test for confidence intervals.
+
+    Returns:
+        Dict keyed by column index with beta, se (cluster-robust), t, pvalue
+        and ci (if conf_int), plus n_boot, n_clusters and weight_type.
+    """
+    out = {}
+    V = None
+    for j in params:
+        problem = _Problem(y, X, groups, j, weights)
+        if V is None:
+            if weight_type is None:
+                weight_type = "webb" if problem.G < MIN_RADEMACHER_CLUSTERS else "rademacher"
+            rng = np.random.default_rng(np.random.SeedSequence(seed))
+            V = wild_weights(rng, problem.G * n_boot, weight_type).reshape(problem.G, n_boot)
+        t, _ = problem.t_stats(null, V)
+        se = problem.se(problem.y - problem.x * problem.beta)
+        result = {
+            "beta": problem.beta,
+            "se": float(se),
+            "t": float(t),
+            "pvalue": problem.pvalue(null, V),
+        }
+        if conf_int:
+            alpha, tol = 1 - level, se * 1e-4
+            result["ci"] = [float(_invert(problem, V, alpha, -1, tol)),
+                            float(_invert(problem, V, alpha, 1, tol))]
+        out[j] = result
+    out.update(n_boot=n_boot, n_clusters=problem.G, weight_type=weight_type)
+    return out
@@ -0,0 +1,40 @@
+"""Tile rendering on empty and non-empty tiles."""
+import os
+import sys
+
+import duckdb
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+import tiles
+
+
+def _connection(paths):
+    """In-memory scooter_data with one row per path of [ts, lat, lon] vertices."""
+    con = duckdb.connect()
+    con.execute("CREATE TABLE scooter_data (path DOUBLE[][], grid_lat INTEGER, grid_lon INTEGER)")
+    for path in paths:
+        con.execute("INSERT INTO scooter_data VALUES (?, ?, ?)",
+                    [path, int(np.floor(path[0][1] * 10)), int(np.floor(path[0][2] * 10))])
+    return con
+
+
+def test_simplify_parts_empty():
+    lengths, qx, qy = tiles.simplify_parts(np.array([], np.int64), np.array([]), np.array([]))
+    assert len(lengths) == 0 and len(qx) == 0 and len(qy) == 0
+
+
+def test_render_empty_tile():
+    # One trip in Seoul; tile (12, 0, 0) is in the far north-west
+    con = _connection([[[0.0, 37.55, 126.97], [10.0, 37.56, 126.98]]])
+    offsets, coords = tiles.decode_tile(tiles.render_tile(con, 12, 0, 0))
+    assert list(offsets) == [0]
+    assert coords.shape == (0, 2)
+
+
+def test_render_tile_with_trip():
+    con = _connection([[[0.0, 37.55, 126.97], [10.0, 37.56, 126.98]]])
+    x, y = tiles.lonlat_to_tile(np.array([126.975]), np.array([37.555]), 12)
+    offsets, coords = tiles.decode_tile(tiles.render_tile(con, 12, int(x[0]), int(y[0])))
+    assert list(offsets) == [0, 2]
+    assert coords.shape == (2, 2)